@@ -98,6 +98,7 @@ export default function ChatDetailScreen() {
     const [selectionMode, setSelectionMode] = useState(false);
     const [selectedMessages, setSelectedMessages] = useState<Set<string>>(new Set());
     const [pinnedModalVisible, setPinnedModalVisible] = useState(false);
+    const [remotePinned, setRemotePinned] = useState<Message[]>([]);
 
     // Media Viewer optimization
     const [mediaViewerVisible, setMediaViewerVisible] = useState(false);
@@ -183,6 +184,31 @@ export default function ChatDetailScreen() {
         };
     }, [animationsEnabled]);
 
+    // Pinned messages older than the loaded history come from the server
+    useEffect(() => {
+        if (!pinnedModalVisible || !id) return;
+        const { token, user: me } = useStore.getState() as any;
+        if (!token) return;
+        api.chat.getPinnedMessages(token, id).then(({ results }) => {
+            setRemotePinned(results.map((m: any) => ({
+                id: m.id.toString(),
+                text: m.text,
+                sender: (m.sender?.username === me?.username) ? 'me' : (m.sender?.username || 'them'),
+                timestamp: new Date(m.timestamp),
+                is_pinned: true,
+            })) as Message[]);
+        });
+    }, [pinnedModalVisible, id]);
+
+    const pinnedMessages = useMemo(() => {
+        const loaded = chat?.messages || [];
+        const loadedIds = new Set(loaded.map((m: any) => m.id));
+        return [
+            ...loaded.filter((m: any) => m.is_pinned),
+            ...remotePinned.filter((m) => !loadedIds.has(m.id)),
+        ];
+    }, [chat?.messages, remotePinned]);
+
     useEffect(() => {
         if (animationsEnabled && chat?.messages?.length) {
             LayoutAnimation.configureNext(LayoutAnimation.Presets.easeInEaseOut);
@@ -807,7 +833,7 @@ export default function ChatDetailScreen() {
                     <PinnedMessagesModal 
                         visible={pinnedModalVisible}
                         onClose={() => setPinnedModalVisible(false)}
-                        pinnedMessages={chat?.messages?.filter((m: any) => m.is_pinned) || []}
+                        pinnedMessages={pinnedMessages}
                         onUnpin={(msgId) => unpinMessage(chat.id, msgId)}
                         onJumpTo={(msgId) => {
                             // Find index and scroll
@@ -117,7 +117,7 @@ export default function ProfileScreen() {
                                     />
                                 ) : (
                                     <Avatar
-                                        source={user?.profile_picture}
+                                        source={user?.avatar_urls?.medium || user?.profile_picture}
                                         size={130}
                                         style={styles.avatar}
                                     />
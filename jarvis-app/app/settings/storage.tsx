@@ -9,23 +9,30 @@ import { useAppTheme } from '@/hooks/useAppTheme';
 import SettingRow from '@/components/settings/SettingRow';
 import SettingCard from '@/components/settings/SettingCard';
 import { getAppStorageSize, getNetworkUsage, formatSize, NetworkUsage } from '@/utils/usageTracker';
+import { api } from '@/services/api';
+import { StorageUsage } from '@/types';
 
 export default function StorageSettingsScreen() {
     const { colors } = useAppTheme();
     const user = useStore((state) => state.user);
+    const token = useStore((state) => state.token);
     const updateSettings = useStore((state) => state.updateSettings);
     const showToast = useStore((state) => state.showToast);
     const showAlert = useStore((state) => state.showAlert);
 
     const [storageSize, setStorageSize] = useState('Calculating...');
     const [networkUsage, setNetworkUsage] = useState<NetworkUsage>({ sent: 0, received: 0 });
+    const [serverUsage, setServerUsage] = useState<StorageUsage | null>(null);
 
     const loadStats = useCallback(async () => {
         const size = await getAppStorageSize();
         const network = await getNetworkUsage();
         setStorageSize(formatSize(size));
         setNetworkUsage(network);
-    }, []);
+        if (token) {
+            setServerUsage(await api.chat.getStorageUsage(token));
+        }
+    }, [token]);
 
     useFocusEffect(
         useCallback(() => {
@@ -75,7 +82,13 @@ export default function StorageSettingsScreen() {
             'Storage Breakdown',
             `Your application is using ${storageSize} in total.\n\n` + 
             `• Database: Managed SQLite storage\n` +
-            `• Media: Downloaded photos, videos & voice messages.`
+            `• Media: Downloaded photos, videos & voice messages.` +
+            (serverUsage && serverUsage.count
+                ? `\n\nMedia you've sent (${serverUsage.count} files, ${formatSize(serverUsage.bytes)}):\n` +
+                  Object.entries(serverUsage.by_type)
+                      .map(([type, usage]) => `• ${type}: ${usage.count} files, ${formatSize(usage.bytes)}`)
+                      .join('\n')
+                : '')
         );
     };
 
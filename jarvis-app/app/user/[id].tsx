@@ -165,7 +165,7 @@ export default function UserProfileScreen() {
             <ScrollView contentContainerStyle={styles.scrollContent}>
                 <View style={styles.profileSection}>
                     <Avatar
-                        source={userProfile.profile_picture}
+                        source={userProfile.avatar_urls?.medium || userProfile.profile_picture}
                         size={120}
                         style={styles.avatar}
                     />
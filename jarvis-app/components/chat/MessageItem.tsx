@@ -224,7 +224,8 @@ const MessageItemComponent = ({ item, onLongPress, onMediaPress, onSwipeReply, o
                                         ) : item.file_type?.startsWith('audio/') ? (
                                             <VoicePlayer 
                                                 audioUri={getMediaUrl(item.file)!} 
-                                                duration={parseInt((item as any).duration || '0')} 
+                                                duration={item.media_metadata?.duration ?? parseInt((item as any).duration || '0')} 
+                                                waveform={item.media_metadata?.waveform}
                                             />
                                         ) : (
                                             <View style={[styles.documentPreview, { backgroundColor: colors.backgroundSecondary }]}>
@@ -343,7 +344,8 @@ const MessageItemComponent = ({ item, onLongPress, onMediaPress, onSwipeReply, o
                                         ) : item.file_type?.startsWith('audio/') ? (
                                             <VoicePlayer 
                                                 audioUri={getMediaUrl(item.file)!} 
-                                                duration={parseInt((item as any).duration || '0')} 
+                                                duration={item.media_metadata?.duration ?? parseInt((item as any).duration || '0')} 
+                                                waveform={item.media_metadata?.waveform}
                                             />
                                         ) : (
                                             <View style={[styles.documentPreview, { backgroundColor: 'rgba(255,255,255,0.15)' }]}>
@@ -8,9 +8,13 @@ import { useStore } from '@/store';
 interface VoicePlayerProps {
     audioUri: string;
     duration: number;
+    // Peaks 0-255 computed by the server
+    waveform?: number[];
 }
 
-export const VoicePlayer = ({ audioUri, duration }: VoicePlayerProps) => {
+const BAR_COUNT = 20;
+
+export const VoicePlayer = ({ audioUri, duration, waveform }: VoicePlayerProps) => {
     const { colors } = useAppTheme();
     const player = useAudioPlayer(audioUri);
     const playerRef = useRef(player);
@@ -19,6 +23,14 @@ export const VoicePlayer = ({ audioUri, duration }: VoicePlayerProps) => {
     const [playbackSpeed, setPlaybackSpeed] = useState(1.0);
 
     const waveformBars = useMemo(() => {
+        if (waveform && waveform.length > 0) {
+            return Array.from({ length: BAR_COUNT }, (_, i) => {
+                const start = Math.floor((i * waveform.length) / BAR_COUNT);
+                const end = Math.max(Math.floor(((i + 1) * waveform.length) / BAR_COUNT), start + 1);
+                return 4 + (Math.max(...waveform.slice(start, end)) / 255) * 26;
+            });
+        }
+
         const seedSource = `${audioUri}:${duration}`;
         let seed = 0;
 
@@ -31,8 +43,8 @@ export const VoicePlayer = ({ audioUri, duration }: VoicePlayerProps) => {
             return seed / 0xffffffff;
         };
 
-        return Array.from({ length: 20 }, () => 10 + nextRandom() * 20);
-    }, [audioUri, duration]);
+        return Array.from({ length: BAR_COUNT }, () => 10 + nextRandom() * 20);
+    }, [audioUri, duration, waveform]);
 
     useEffect(() => {
         playerRef.current = player;
@@ -99,7 +111,7 @@ export const VoicePlayer = ({ audioUri, duration }: VoicePlayerProps) => {
                                 styles.waveBar,
                                 {
                                     height: barHeight,
-                                    backgroundColor: i < (position / duration) * 20 ? colors.primary : 'rgba(255,255,255,0.3)',
+                                    backgroundColor: i < (position / duration) * BAR_COUNT ? colors.primary : 'rgba(255,255,255,0.3)',
                                 }
                             ]}
                         />
@@ -1,6 +1,7 @@
 import { Platform } from 'react-native';
 import { getInfoAsync } from 'expo-file-system/legacy';
 import { addNetworkUsage } from '@/utils/usageTracker';
+import { StorageUsage } from '@/types';
 
 const BACKEND_URL = process.env.EXPO_PUBLIC_BACKEND_URL;
 
@@ -47,6 +48,9 @@ const fetchWithTracking = async (url: string, options: any = {}) => {
     return response;
 };
 
+// Last validated response per URL, replayed when the server answers 304
+const conditionalCache = new Map<string, { etag: string; token: string; body: any }>();
+
 export const api = {
     auth: {
         requestOTP: async (identifier: string) => {
@@ -156,7 +160,7 @@ export const api = {
                     method: 'DELETE',
                     headers: { 'Authorization': `Token ${token}` },
                 });
-                if (response.status === 204) return true;
+                if (response.status === 202) return true;
                 const json = await response.json();
                 if (!response.ok) throw new Error(JSON.stringify(json) || 'Delete failed');
                 return json;
@@ -273,6 +277,63 @@ export const api = {
                 throw error;
             }
         },
+        markConversationsRead: async (token: string, points: { id: number; up_to?: number }[]) => {
+            const url = `${API_URL}/chat/conversations/read/`;
+            try {
+                const response = await fetchWithTracking(url, {
+                    method: 'POST',
+                    headers: {
+                        'Authorization': `Token ${token}`,
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ conversations: points }),
+                });
+                const json = await response.json();
+                if (!response.ok) throw new Error(JSON.stringify(json) || 'Failed to mark as read');
+                return json;
+            } catch (error) {
+                throw error;
+            }
+        },
+        forwardMessage: async (token: string, messageId: string, conversationIds: string[]) => {
+            const url = `${API_URL}/chat/messages/${messageId}/forward/`;
+            try {
+                log(`POST ${url}`, { conversationIds });
+                const response = await fetchWithTracking(url, {
+                    method: 'POST',
+                    headers: {
+                        'Authorization': `Token ${token}`,
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ conversation_ids: conversationIds.map(Number) }),
+                });
+                const json = await response.json();
+                if (!response.ok) throw new Error(json.error || 'Failed to forward message');
+                return json.messages;
+            } catch (error) {
+                log(`Forward message error from ${url}`, error);
+                throw error;
+            }
+        },
+        getStorageUsage: async (token: string, conversationId?: number): Promise<StorageUsage | null> => {
+            const url = conversationId
+                ? `${API_URL}/chat/conversations/${conversationId}/storage/`
+                : `${API_URL}/chat/storage/`;
+            try {
+                const response = await fetchWithTracking(url, {
+                    method: 'GET',
+                    headers: {
+                        'Authorization': `Token ${token}`,
+                        'Content-Type': 'application/json',
+                    },
+                });
+                if (!response.ok) return null;
+                return await response.json();
+            } catch (error) {
+                log(`Fetch storage usage error from ${url}`, error);
+                return null;
+            }
+        },
         restoreChats: async (token: string, conversationIds: number[], restoreDate?: string) => {
             const url = `${API_URL}/chat/restore/`;
             try {
@@ -297,15 +358,20 @@ export const api = {
         getConversations: async (token: string, deleted: boolean = false) => {
             const url = `${API_URL}/chat/conversations/?deleted=${deleted}`;
             try {
-                const response = await fetchWithTracking(url, {
-                    method: 'GET',
-                    headers: {
-                        'Authorization': `Token ${token}`,
-                        'Content-Type': 'application/json',
-                    },
-                });
+                const cached = conditionalCache.get(url);
+                const headers: Record<string, string> = {
+                    'Authorization': `Token ${token}`,
+                    'Content-Type': 'application/json',
+                };
+                if (cached && cached.token === token) headers['If-None-Match'] = cached.etag;
+
+                const response = await fetchWithTracking(url, { method: 'GET', headers });
+                if (response.status === 304 && cached) return cached.body;
+
                 const json = await response.json();
                 if (!response.ok) throw new Error('Failed to fetch conversations');
+                const etag = response.headers.get('ETag');
+                if (etag) conditionalCache.set(url, { etag, token, body: json });
                 return json;
             } catch (error) {
                 return [];
@@ -332,6 +398,43 @@ export const api = {
                 return [];
             }
         },
+        // Pinned messages and shared media are served by their own indexed listings,
+        // so the client doesn't page through the whole history to find them
+        getPinnedMessages: async (token: string, conversationId: string, cursorUrl?: string | null) => {
+            const url = cursorUrl || `${API_URL}/chat/conversations/${conversationId}/pinned/`;
+            try {
+                const response = await fetchWithTracking(url, {
+                    method: 'GET',
+                    headers: {
+                        'Authorization': `Token ${token}`,
+                        'Content-Type': 'application/json',
+                    },
+                });
+                const json = await response.json();
+                if (!response.ok) throw new Error('Failed to fetch pinned messages');
+                return { results: json.results || [], next: json.next as string | null };
+            } catch (error) {
+                return { results: [], next: null };
+            }
+        },
+        getConversationMedia: async (token: string, conversationId: string, types: string[] = [], cursorUrl?: string | null) => {
+            const query = types.length ? `?type=${types.join(',')}` : '';
+            const url = cursorUrl || `${API_URL}/chat/conversations/${conversationId}/media/${query}`;
+            try {
+                const response = await fetchWithTracking(url, {
+                    method: 'GET',
+                    headers: {
+                        'Authorization': `Token ${token}`,
+                        'Content-Type': 'application/json',
+                    },
+                });
+                const json = await response.json();
+                if (!response.ok) throw new Error('Failed to fetch media');
+                return { results: json.results || [], next: json.next as string | null };
+            } catch (error) {
+                return { results: [], next: null };
+            }
+        },
         checkContacts: async (token: string, phoneNumbers: string[]) => {
             const url = `${API_URL}/auth/check-contacts/`;
             try {
@@ -397,7 +500,7 @@ export const api = {
                 throw error;
             }
         },
-        clearMessages: async (token: string, conversationId: string) => {
+        clearMessages: async (token: string, conversationId: string, forEveryone: boolean = false) => {
             const url = `${API_URL}/chat/conversations/${conversationId}/clear/`;
             try {
                 log(`POST ${url}`);
@@ -407,6 +510,7 @@ export const api = {
                         'Authorization': `Token ${token}`,
                         'Content-Type': 'application/json',
                     },
+                    body: JSON.stringify({ for_everyone: forEveryone }),
                 });
 
                 if (response.status === 204 || response.status === 200) {
@@ -607,7 +711,7 @@ export const api = {
                     method: 'DELETE',
                     headers: { 'Authorization': `Token ${token}` },
                 });
-                if (response.status === 204) return true;
+                if (response.status === 202) return true;
                 throw new Error('Failed to clear call history');
             } catch (error) {
                 log('Clear call history error', error);
@@ -626,7 +730,7 @@ export const api = {
                     },
                     body: JSON.stringify({ call_ids: callIds }),
                 });
-                if (response.status === 204) return true;
+                if (response.status === 202) return true;
                 throw new Error('Failed to bulk delete calls');
             } catch (error) {
                 log('Bulk delete calls error', error);
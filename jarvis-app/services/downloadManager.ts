@@ -11,6 +11,8 @@ class DownloadManager {
     private queue: DownloadTask[] = [];
     private activeDownloads = 0;
     private maxConcurrent = 2;
+    // Interrupted downloads resume where they stopped, so a retry is cheap
+    private maxAttempts = 2;
 
     enqueue(url: string, id: string, onComplete: (uri: string) => void, onError: (err: any) => void) {
         this.queue.push({ url, id, onComplete, onError });
@@ -26,7 +28,10 @@ class DownloadManager {
         this.activeDownloads++;
         try {
             console.log(`[DownloadManager] Starting: ${task.id}`);
-            const localUri = await downloadMedia(task.url, task.id);
+            let localUri: string | null = null;
+            for (let attempt = 0; attempt < this.maxAttempts && !localUri; attempt++) {
+                localUri = await downloadMedia(task.url, task.id);
+            }
             if (localUri) {
                 task.onComplete(localUri);
             }
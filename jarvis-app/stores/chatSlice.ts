@@ -528,6 +528,7 @@ export const createChatSlice: StateCreator<AppState, [], [], ChatSlice> = (set,
                     file: m.file,
                     file_type: m.file_type,
                     file_name: m.file_name,
+                    media_metadata: m.media_metadata,
                     reactions: m.reactions || [],
                     reply_to: m.reply_to || null
                 };
@@ -686,6 +687,7 @@ export const createChatSlice: StateCreator<AppState, [], [], ChatSlice> = (set,
                     file: m.file,
                     file_type: m.file_type,
                     file_name: m.file_name,
+                    media_metadata: m.media_metadata,
                     reactions: m.reactions || [],
                     is_pinned: !!m.is_pinned,
                     reply_to: m.reply_to || null
@@ -711,7 +713,14 @@ export const createChatSlice: StateCreator<AppState, [], [], ChatSlice> = (set,
     },
 
     forwardMessage: async (message, chatIds) => {
-        const { sendMessage, sendFileMessage } = get() as any;
+        const { token, sendMessage, sendFileMessage } = get() as any;
+        if (token && /^\d+$/.test(String(message.id))) {
+            // The server copies the stored file into every chat at once; the
+            // copies arrive over the socket like any new message
+            await api.chat.forwardMessage(token, String(message.id), chatIds);
+            return;
+        }
+        // Not on the server yet: send it again to each chat
         for (const id of chatIds) {
             if (message.file) {
                 const file = {
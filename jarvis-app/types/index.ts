@@ -4,6 +4,8 @@ export interface User {
     email: string;
     phone_number?: string;
     profile_picture?: string;
+    // Square variants of the profile picture; profile_picture is the small one
+    avatar_urls?: { small?: string; medium?: string; large?: string };
     bio?: string;
     privacy_last_seen?: 'everyone' | 'contacts' | 'nobody';
     privacy_profile_photo?: 'everyone' | 'contacts' | 'nobody';
@@ -35,6 +37,12 @@ export interface Message {
     file?: string | null;
     file_type?: string | null;
     file_name?: string | null;
+    // Filled in by the server's media processing (waveform for audio, previews for images)
+    media_metadata?: {
+        duration?: number;
+        waveform?: number[];
+        [key: string]: any;
+    };
     isRead?: boolean;
     isDelivered?: boolean;
     reactions?: string[];
@@ -46,6 +54,8 @@ export interface Message {
     isUnsent?: boolean;
     deleted_at?: string;
     is_pinned?: boolean;
+    // Set when the sender has disappearing messages on
+    expires_at?: string | null;
     duration?: number;
     isUploading?: boolean;
     error?: boolean;
@@ -78,3 +88,9 @@ export interface Call {
     status: 'ongoing' | 'completed' | 'missed' | 'rejected';
     is_video: boolean;
 }
+
+export interface StorageUsage {
+    bytes: number;
+    count: number;
+    by_type: Record<string, { bytes: number; count: number }>;
+}
@@ -39,8 +39,13 @@ export const getMediaUrl = (relativePath: string | null | undefined): string | n
     return `${MEDIA_URL}/${cleanPath}`;
 };
 
+// Resume data of interrupted downloads, keyed by message ID
+const interruptedDownloads = new Map<string, string>();
+
 /**
- * Downloads a media file from the server and saves it locally
+ * Downloads a media file from the server and saves it locally.
+ * The file is written to a `.part` file first and moved into place when complete;
+ * an interrupted download is resumed from where it stopped (the server supports ranges).
  * @param remoteUrl - The full URL to download from
  * @param messageId - The message ID to use for the filename
  * @returns Local file URI or null if download fails
@@ -67,16 +72,29 @@ export const downloadMedia = async (remoteUrl: string, messageId: string): Promi
             return file.uri;
         }
 
+        const partUri = `${file.uri}.part`;
+        const download = FileSystem.createDownloadResumable(
+            remoteUrl, partUri, {}, undefined, interruptedDownloads.get(messageId)
+        );
         try {
-            // Use the legacy downloadAsync for now as the new API is different
-            const result = await FileSystem.downloadAsync(remoteUrl, file.uri);
-            if (result.status === 200) {
+            const result = interruptedDownloads.has(messageId)
+                ? await download.resumeAsync()
+                : await download.downloadAsync();
+            interruptedDownloads.delete(messageId);
+            if (result && (result.status === 200 || result.status === 206)) {
+                await FileSystem.moveAsync({ from: partUri, to: file.uri });
                 return file.uri;
             } else {
-                console.error('[Media] Download failed with status:', result.status);
+                console.error('[Media] Download failed with status:', result?.status);
+                await FileSystem.deleteAsync(partUri, { idempotent: true });
                 return null;
             }
         } catch (downloadError) {
+            // Keep what was received so the next attempt only fetches the rest
+            const { resumeData } = download.savable();
+            if (resumeData) {
+                interruptedDownloads.set(messageId, resumeData);
+            }
             console.error('[Media] Download failed:', downloadError);
             return null;
         }
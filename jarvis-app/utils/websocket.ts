@@ -38,6 +38,25 @@ export const handleWebSocketMessage = async (event: WebSocketMessageEvent, actio
         } else if (data.type === 'message_read') {
             const { message_id, conversation_id } = data;
             actions.updateMessageRead(message_id, conversation_id);
+        } else if (data.type === 'messages_read') {
+            const { conversations, reader_id } = data;
+            // Sent to the reader's own devices too: there it marks incoming messages read
+            const byMe = String(reader_id) === String(actions.getCurrentUser()?.id);
+            const readUpTo = new Map<string, number>(
+                conversations.map((c: any) => [String(c.conversation_id), c.up_to ? new Date(c.up_to).getTime() : Infinity])
+            );
+            const chats = actions.getChats();
+            const updatedChats = chats.map((chat) => {
+                const upTo = readUpTo.get(String(chat.id));
+                if (upTo === undefined) return chat;
+                const newMessages = chat.messages.map((msg: Message) =>
+                    msg.sender === (byMe ? 'them' : 'me') && new Date(msg.timestamp).getTime() <= upTo ? { ...msg, isRead: true } : msg
+                );
+                if (!byMe) return { ...chat, messages: newMessages };
+                const unreadCount = newMessages.filter((msg: Message) => msg.sender === 'them' && !msg.isRead).length;
+                return { ...chat, messages: newMessages, unreadCount };
+            });
+            actions.setChats(updatedChats);
         } else if (data.type === 'message_delivered') {
             const { message_id, conversation_id } = data;
             actions.updateMessageDelivered(message_id, conversation_id);
@@ -69,6 +88,21 @@ export const handleWebSocketMessage = async (event: WebSocketMessageEvent, actio
             });
             actions.setChats(updatedChats);
             database.deleteMessage(message_id);
+        } else if (data.type === 'messages_expired') {
+            // Disappearing messages purged on the server, one event per conversation
+            const { message_ids, conversation_id } = data;
+            const expired = new Set((message_ids as (string | number)[]).map(String));
+            const chats = actions.getChats();
+            const updatedChats = chats.map((chat) => {
+                if (String(chat.id) === String(conversation_id)) {
+                    const newMessages = chat.messages.filter((msg: Message) => !expired.has(String(msg.id)));
+                    const lastMsg = newMessages.length > 0 ? newMessages[newMessages.length - 1].text : '';
+                    return { ...chat, messages: newMessages, lastMessage: lastMsg };
+                }
+                return chat;
+            });
+            actions.setChats(updatedChats);
+            expired.forEach((id) => database.deleteMessage(id));
         } else if (data.type === 'message_reaction') {
             const { message_id, conversation_id, reactions } = data;
             const chats = actions.getChats();
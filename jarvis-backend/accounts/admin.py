@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, BlockedUser, OTP, PendingVerification
+from .models import User, BlockedUser, DeletionJob, OTP, PendingVerification
 
 class CustomUserAdmin(UserAdmin):
     list_display = UserAdmin.list_display + ('is_online', 'last_seen', 'phone_number', 'fcm_token')
@@ -35,3 +35,11 @@ class PendingVerificationAdmin(admin.ModelAdmin):
     list_display = ('identifier', 'code', 'session_id', 'created_at', 'is_verified')
     search_fields = ('identifier', 'code', 'session_id')
     list_filter = ('is_verified', 'created_at')
+
+@admin.register(DeletionJob)
+class DeletionJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'username', 'kind', 'status', 'step', 'rows_deleted', 'created_at', 'updated_at', 'finished_at')
+    search_fields = ('username',)
+    list_filter = ('kind', 'status')
+    raw_id_fields = ('user',)
+    readonly_fields = ('created_at', 'updated_at')
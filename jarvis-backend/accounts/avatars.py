@@ -0,0 +1,89 @@
+"""
+Fixed-size variants of profile pictures.
+
+A new picture is cropped square and scaled to each of ``SIZES`` once, on
+upload. Variants are named after the hash of the original's bytes, so the
+same picture always gets the same URLs and they can be cached forever (see
+chat.media_access). Their URLs are stored on ``User.avatar_urls``, so
+payloads that embed users don't touch storage to build them.
+"""
+import hashlib
+import io
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from chat import derivatives
+
+# Square side in pixels, smallest first
+SIZES = {
+    'small': 96,
+    'medium': 256,
+    'large': 640,
+}
+DEFAULT_SIZE = 'small'
+
+
+def _digest(file):
+    sha = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        sha.update(chunk)
+    file.seek(0)
+    return sha.hexdigest()
+
+
+def _encode(image, format_name):
+    if format_name == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format_name, quality=derivatives.QUALITY)
+    return buffer.getvalue()
+
+
+def generate(user):
+    """Build the variants of ``user.profile_picture`` and return their URLs by size."""
+    format_name, extension, _ = derivatives.output_format()
+    with user.profile_picture.open('rb') as file:
+        digest = _digest(file)
+        names = {size: f"avatars/{digest[:2]}/{digest}_{size}.{extension}" for size in SIZES}
+        if not all(default_storage.exists(name) for name in names.values()):
+            with Image.open(file) as image:
+                largest = max(SIZES.values())
+                image.draft('RGB', (largest, largest))
+                image = ImageOps.exif_transpose(image)
+                has_alpha = 'transparency' in image.info or image.mode in ('RGBA', 'LA', 'PA')
+                image = image.convert('RGBA' if has_alpha else 'RGB')
+                for size, side in reversed(SIZES.items()):
+                    image = ImageOps.fit(image, (min(side, *image.size),) * 2, Image.Resampling.LANCZOS)
+                    if not default_storage.exists(names[size]):
+                        default_storage.save(names[size], ContentFile(_encode(image, format_name)))
+    return {size: default_storage.url(name) for size, name in names.items()}
+
+
+def update(user):
+    """Refresh ``user.avatar_urls`` after the profile picture changed."""
+    previous = user.avatar_urls or {}
+    user.avatar_urls = generate(user) if user.profile_picture else {}
+    user.save(update_fields=['avatar_urls'])
+    if previous and previous != user.avatar_urls:
+        _delete_unused(previous)
+
+
+def _delete_unused(urls):
+    from django.contrib.auth import get_user_model
+    # Identical pictures share variants
+    if get_user_model().objects.filter(avatar_urls__small=urls.get('small')).exists():
+        return
+    for url in urls.values():
+        name = url.split('/avatars/', 1)[-1]
+        default_storage.delete(f"avatars/{name}")
+
+
+def url(user, size=DEFAULT_SIZE):
+    """URL of ``user``'s avatar at ``size``, or '' without one."""
+    if user.avatar_urls and size in user.avatar_urls:
+        return user.avatar_urls[size]
+    # Not built yet (manage.py build_avatars backfills)
+    return user.profile_picture.url if user.profile_picture else ''
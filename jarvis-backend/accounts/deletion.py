@@ -0,0 +1,219 @@
+"""
+Deleting an account or call history in the background.
+
+A single ``user.delete()`` cascades through every message, reaction, call and
+membership of the user in one transaction. A single unbounded DELETE on
+calls is no better: for heavy users, either one holds locks for seconds.
+Instead ``start`` records a ``DeletionJob`` and queues it. An account is
+deactivated right away, so it can't sign in or be messaged while its data
+goes. Its API token stops working with it, so progress is read with the
+signed ``progress_token`` returned when the job starts, which needs no
+authentication.
+
+``run`` works through the job's steps in order. Each step deletes up to
+``BATCH_SIZE`` rows per short transaction, and the job's ``step`` and
+``rows_deleted`` are saved in that same transaction. It sleeps
+``settings.DELETION_BATCH_PAUSE`` seconds between batches. A job whose worker
+died is picked up again by ``resume`` and carries on from its step.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from calls.models import Call
+from chat import inbox, purge, render_cache
+from chat.models import ArchivedMessage, Conversation, InboxEntry, Message, Reaction
+
+from .models import DeletionJob
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# A running job not saved for this long lost its worker
+STALE_AFTER = timedelta(minutes=10)
+PROGRESS_SALT = 'accounts.deletion.progress'
+PROGRESS_TOKEN_MAX_AGE = timedelta(days=7)
+
+
+def _calls(job):
+    calls = Call.objects.filter(Q(caller_id=job.user_id) | Q(receiver_id=job.user_id))
+    if job.call_ids is not None:
+        return calls.filter(id__in=job.call_ids)
+    if job.until_id is not None:
+        return calls.filter(id__lte=job.until_id)
+    return calls
+
+
+def _batches(rows):
+    """A step deleting the rows of ``rows(job)`` a batch at a time."""
+    def delete(job, batch_size):
+        queryset = rows(job)
+        ids = list(queryset.values_list('id', flat=True)[:batch_size])
+        if ids:
+            queryset.model.objects.filter(id__in=ids).delete()
+        return len(ids)
+    return delete
+
+
+def _delete_messages(job, batch_size):
+    ids = list(Message.objects.filter(sender_id=job.user_id).values_list('id', flat=True)[:batch_size])
+    if ids:
+        previews, _, _ = purge.delete_messages(ids)
+        transaction.on_commit(lambda: [inbox.refresh_entries(conversation_id) for conversation_id in previews])
+    return len(ids)
+
+
+def _delete_reactions(job, batch_size):
+    rows = list(Reaction.objects.filter(user_id=job.user_id).values_list(
+        'id', 'message_id', 'message__conversation_id',
+    )[:batch_size])
+    if rows:
+        Reaction.objects.filter(id__in=[pk for pk, _, _ in rows]).delete()
+        # Reactions render with the message they are on
+        render_cache.invalidate(*{message_id for _, message_id, _ in rows})
+        conversation_ids = {conversation_id for _, _, conversation_id in rows}
+        transaction.on_commit(lambda: inbox.touch_many(conversation_ids))
+    return len(rows)
+
+
+def _delete_memberships(job, batch_size):
+    memberships = Conversation.participants.through.objects.filter(user_id=job.user_id)
+    rows = list(memberships.values_list('id', 'conversation_id')[:batch_size])
+    if rows:
+        memberships.model.objects.filter(id__in=[pk for pk, _ in rows]).delete()
+        # The conversations they left list one participant fewer
+        conversation_ids = {conversation_id for _, conversation_id in rows}
+        transaction.on_commit(lambda: inbox.touch_many(conversation_ids))
+    return len(rows)
+
+
+def _delete_account(job, batch_size):
+    if job.user_id is None:
+        return 0
+    # Entries naming them as the other side lose that name
+    conversation_ids = list(InboxEntry.objects.filter(other_user_id=job.user_id).values_list('conversation_id', flat=True))
+    # What is left is small: tokens, blocks, imports, counters
+    user, job.user = job.user, None
+    user.delete()
+    transaction.on_commit(lambda: inbox.touch_many(conversation_ids))
+    return 1
+
+
+STEPS = {
+    'calls': [
+        ('calls', _batches(_calls)),
+    ],
+    'account': [
+        ('calls', _batches(_calls)),
+        ('reactions', _delete_reactions),
+        ('messages', _delete_messages),
+        ('archived_messages', _batches(lambda job: ArchivedMessage.objects.filter(sender_id=job.user_id))),
+        ('inbox', _batches(lambda job: InboxEntry.objects.filter(user_id=job.user_id))),
+        ('memberships', _delete_memberships),
+        ('account', _delete_account),
+    ],
+}
+
+
+def start(user, kind, call_ids=None):
+    """Record and queue the deletion of ``user``'s account or calls; returns the job."""
+    from .tasks import run_deletion_job
+
+    if kind == 'account':
+        user.is_active = False
+        user.is_online = False
+        user.fcm_token = None
+        user.save(update_fields=['is_active', 'is_online', 'fcm_token'])
+        # Partners' lists show them offline, and soon gone
+        inbox.touch_profile(user.id)
+    until_id = None
+    if kind == 'calls' and call_ids is None:
+        # Clearing the history leaves calls made after it alone
+        until_id = Call.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    job = DeletionJob.objects.create(
+        user=user, username=user.username, kind=kind, call_ids=call_ids, until_id=until_id,
+    )
+    run_deletion_job.delay(job.id)
+    return job
+
+
+def progress_token(job):
+    """A token for reading ``job``'s progress without signing in."""
+    return signing.dumps(job.id, salt=PROGRESS_SALT)
+
+
+def job_for_token(token):
+    """The job ``token`` was issued for, or None if it is forged, expired or gone."""
+    try:
+        job_id = signing.loads(token, salt=PROGRESS_SALT, max_age=PROGRESS_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return DeletionJob.objects.filter(id=job_id).first()
+
+
+def hidden_calls(user):
+    """A filter for ``user``'s calls that an unfinished job is deleting, so lists skip them already."""
+    hidden = Q(pk__in=[])
+    for call_ids, until_id in DeletionJob.objects.filter(
+        user=user, kind='calls', status__in=['pending', 'running'],
+    ).values_list('call_ids', 'until_id'):
+        hidden |= Q(id__in=call_ids) if call_ids is not None else Q(id__lte=until_id)
+    return hidden
+
+
+def run(job_id, batch_size=BATCH_SIZE, pause=None):
+    """Claim the job and delete its rows a batch at a time; returns it, or None if it isn't claimable."""
+    # Claim atomically; a running job whose worker died can be taken over
+    now = timezone.now()
+    claimed = DeletionJob.objects.filter(id=job_id).filter(
+        Q(status='pending') | Q(status='running', updated_at__lt=now - STALE_AFTER)
+    ).update(status='running', updated_at=now)
+    if not claimed:
+        return None
+    job = DeletionJob.objects.get(id=job_id)
+    pause = getattr(settings, 'DELETION_BATCH_PAUSE', 0) if pause is None else pause
+    steps = STEPS[job.kind]
+    names = [name for name, _ in steps]
+    try:
+        for name, delete in steps[names.index(job.step) if job.step in names else 0:]:
+            job.step = name
+            while True:
+                with transaction.atomic():
+                    deleted = delete(job, batch_size)
+                    job.rows_deleted += deleted
+                    job.save(update_fields=['step', 'rows_deleted', 'updated_at'])
+                if deleted < batch_size:
+                    break
+                if pause:
+                    time.sleep(pause)
+    except Exception as e:
+        logger.exception("Deletion job %s failed at %s", job.id, job.step)
+        job.status = 'failed'
+        job.error = str(e)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        return job
+
+    job.status = 'completed'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at', 'updated_at'])
+    logger.info("Deleted %s of %s: %s rows", job.kind, job.username, job.rows_deleted)
+    return job
+
+
+def resume():
+    """Queue jobs that never started or whose worker died; returns how many."""
+    from .tasks import run_deletion_job
+
+    stale = timezone.now() - STALE_AFTER
+    ids = list(DeletionJob.objects.filter(
+        Q(status='pending', created_at__lt=stale) | Q(status='running', updated_at__lt=stale)
+    ).values_list('id', flat=True))
+    for job_id in ids:
+        run_deletion_job.delay(job_id)
+    return len(ids)
@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts import avatars
+
+
+class Command(BaseCommand):
+    help = "Build avatar variants for users whose profile picture has none yet."
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+        built = 0
+        for user in users.filter(avatar_urls={}).iterator():
+            try:
+                avatars.update(user)
+                built += 1
+            except Exception as exc:
+                self.stderr.write(f"{user.username}: {exc}")
+        self.stdout.write(f"Built avatars for {built} users")
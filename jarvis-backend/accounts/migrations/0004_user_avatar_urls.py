@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-19 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_user_email_nullable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_urls',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -6,6 +6,8 @@ class User(AbstractUser):
     phone_number = models.CharField(max_length=15, blank=True, null=True, unique=True)
     normalized_phone_number = models.CharField(max_length=15, blank=True, null=True, unique=True, db_index=True)
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
+    # URLs of the resized variants by size (see accounts.avatars)
+    avatar_urls = models.JSONField(default=dict, blank=True)
     bio = models.TextField(blank=True, null=True)
     last_seen = models.DateTimeField(null=True, blank=True)
     is_online = models.BooleanField(default=False)
@@ -83,3 +85,40 @@ class PendingVerification(models.Model):
 
     def __str__(self):
         return f"Pending {self.identifier} ({self.code})"
+
+class DeletionJob(models.Model):
+    """
+    A user's account or call history being deleted in the background, one
+    batch at a time (see accounts.deletion).
+
+    ``step`` and ``rows_deleted`` are saved with every batch, so progress can
+    be followed while the job runs and an interrupted job resumes at its step.
+    """
+    KIND_CHOICES = [
+        ('account', 'Account'),
+        ('calls', 'Call history'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    # Cleared once the account itself is deleted
+    user = models.ForeignKey(User, null=True, blank=True, related_name='deletion_jobs', on_delete=models.SET_NULL)
+    username = models.CharField(max_length=150)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Calls only: the ids picked for a bulk delete, or else every call up to until_id
+    call_ids = models.JSONField(null=True, blank=True)
+    until_id = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    step = models.CharField(max_length=30, blank=True)
+    rows_deleted = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Delete {self.kind} of {self.username} ({self.status})"
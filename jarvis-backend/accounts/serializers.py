@@ -1,8 +1,23 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 
+from . import avatars
+from .models import DeletionJob
+
 User = get_user_model()
 
+
+def _avatar_representation(serializer, instance, representation):
+    """Emit the precomputed small avatar as ``profile_picture`` plus every size in ``avatar_urls``."""
+    request = serializer.context.get('request')
+    absolute = request.build_absolute_uri if request else (lambda url: url)
+    if instance.avatar_urls:
+        representation['avatar_urls'] = {size: absolute(url) for size, url in instance.avatar_urls.items()}
+    else:
+        representation['avatar_urls'] = {}
+    url = avatars.url(instance)
+    representation['profile_picture'] = absolute(url) if url else None
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -13,11 +28,15 @@ class UserSerializer(serializers.ModelSerializer):
             'privacy_disappearing_messages_timer',
             'notifications_enabled', 'notifications_sound', 'notifications_groups_enabled',
             'security_notifications_enabled', 'two_step_verification_enabled',
-            'storage_auto_download_media', 'chat_wallpaper', 'app_language'
+            'storage_auto_download_media', 'chat_wallpaper', 'app_language', 'avatar_urls'
         )
+        read_only_fields = ('avatar_urls',)
+        # Written as an upload, rendered from the precomputed variants
+        extra_kwargs = {'profile_picture': {'write_only': True}}
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
+        _avatar_representation(self, instance, representation)
         request = self.context.get('request')
         current_user = request.user if request else None
 
@@ -41,6 +60,7 @@ class UserSerializer(serializers.ModelSerializer):
             
             if instance.privacy_profile_photo == 'nobody':
                 representation['profile_picture'] = None
+                representation['avatar_urls'] = {}
 
         return representation
 
@@ -48,10 +68,13 @@ class PublicUserSerializer(serializers.ModelSerializer):
     """Simplified serializer for public-facing profiles with privacy masking."""
     class Meta:
         model = User
-        fields = ('id', 'username', 'profile_picture', 'bio', 'last_seen', 'is_online')
+        fields = ('id', 'username', 'profile_picture', 'bio', 'last_seen', 'is_online', 'avatar_urls')
+        read_only_fields = ('avatar_urls',)
+        extra_kwargs = {'profile_picture': {'write_only': True}}
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
+        _avatar_representation(self, instance, representation)
         request = self.context.get('request')
         current_user = request.user if request else None
 
@@ -62,6 +85,7 @@ class PublicUserSerializer(serializers.ModelSerializer):
             
             if instance.privacy_profile_photo == 'nobody':
                 representation['profile_picture'] = None
+                representation['avatar_urls'] = {}
                 
         return representation
 
@@ -80,3 +104,16 @@ class RegisterSerializer(serializers.ModelSerializer):
             phone_number=validated_data.get('phone_number', '')
         )
         return user
+
+
+class DeletionJobSerializer(serializers.ModelSerializer):
+    progress_token = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DeletionJob
+        fields = ('id', 'kind', 'status', 'step', 'rows_deleted', 'created_at', 'updated_at', 'finished_at', 'progress_token')
+        read_only_fields = fields
+
+    def get_progress_token(self, obj):
+        from .deletion import progress_token
+        return progress_token(obj)
@@ -0,0 +1,14 @@
+from celery import shared_task
+
+from . import deletion
+
+
+@shared_task
+def run_deletion_job(job_id):
+    job = deletion.run(job_id)
+    return job and job.status
+
+
+@shared_task
+def resume_deletion_jobs():
+    return deletion.resume()
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import RequestOTPView, UniversalLoginView, CheckContactsView, UserProfileView, PublicUserProfileView, BlockUserView, VerifyOTPView, CompleteSignupView, UpdateFCMTokenView
+from .views import RequestOTPView, UniversalLoginView, CheckContactsView, UserProfileView, PublicUserProfileView, BlockUserView, VerifyOTPView, CompleteSignupView, UpdateFCMTokenView, DeletionJobDetailView, DeletionJobStatusView
 
 urlpatterns = [
     path('request-otp/', RequestOTPView.as_view(), name='request-otp'),
@@ -11,4 +11,6 @@ urlpatterns = [
     path('users/<int:pk>/', PublicUserProfileView.as_view(), name='public-user-profile'),
     path('block/', BlockUserView.as_view(), name='block-user'),
     path('fcm-token/', UpdateFCMTokenView.as_view(), name='update-fcm-token'),
+    path('deletions/<int:pk>/', DeletionJobDetailView.as_view(), name='deletion-detail'),
+    path('deletions/status/<str:token>/', DeletionJobStatusView.as_view(), name='deletion-status'),
 ]
@@ -5,18 +5,18 @@ from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.views import APIView
 from rest_framework.throttling import ScopedRateThrottle
-from .serializers import RegisterSerializer, UserSerializer
+from . import avatars, deletion
+from .serializers import DeletionJobSerializer, RegisterSerializer, UserSerializer
 from django.contrib.auth import get_user_model
 from chat.models import Message
 from chat.serializers import MessageSerializer
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from chat import fanout, media_access
 import random
 import uuid
 from django.core.mail import send_mail
 from django.utils import timezone
 from datetime import timedelta
-from .models import PendingVerification, BlockedUser
+from .models import DeletionJob, PendingVerification, BlockedUser
 from django.contrib.auth import authenticate
 
 User = get_user_model()
@@ -315,10 +315,18 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         return self.request.user
 
+    def perform_update(self, serializer):
+        user = serializer.save()
+        if 'profile_picture' in serializer.validated_data:
+            avatars.update(user)
+        # Profiles are embedded in conversation lists and message history
+        from chat.inbox import touch_profile
+        touch_profile(user.id)
+
     def delete(self, request, *args, **kwargs):
-        user = self.get_object()
-        user.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        # Deactivated now; messages, calls and the rest go in the background
+        job = deletion.start(self.get_object(), 'account')
+        return Response(DeletionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
 from .models import BlockedUser
 
@@ -341,6 +349,7 @@ class PublicUserProfileView(generics.RetrieveAPIView):
             # Respect privacy settings for profile photo
             if user.privacy_profile_photo == 'nobody':
                 data['profile_picture'] = None
+                data['avatar_urls'] = {}
             elif user.privacy_profile_photo == 'contacts':
                 # For now, show to all authenticated users
                 # In future, check if requester is in user's contacts
@@ -378,6 +387,8 @@ class BlockUserView(APIView):
                  return Response({"error": "Cannot block yourself"}, status=status.HTTP_400_BAD_REQUEST)
 
             BlockedUser.objects.get_or_create(blocker=request.user, blocked=user_to_block)
+            from chat.inbox import touch_users
+            touch_users([request.user.id])
             return Response({"status": "blocked"}, status=status.HTTP_201_CREATED)
         except User.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -405,20 +416,20 @@ class BlockUserView(APIView):
                 # We can either push them via WS or just let the user fetch them. 
                 # Pushing is better for "live" feel.
                 
-                channel_layer = get_channel_layer()
-                
-                for message in pending_messages:
-                    # Determine conversation link?
-                    # We just need to send it to the current user (the blocker who is unblocking)
-                   
-                    data = MessageSerializer(message).data
-                    async_to_sync(channel_layer.group_send)(
-                        f"user_{request.user.id}",
-                        {
-                            'type': 'chat_message',
-                            'message': data
-                        }
-                    )
+                # Pending messages become visible, so recompute the blocker's inbox rows
+                from chat.inbox import refresh_entries
+                for conversation_id in pending_messages.order_by().values_list('conversation_id', flat=True).distinct():
+                    refresh_entries(conversation_id, user_ids=[request.user.id])
+
+                # Serialize as one batch so cached renders are fetched with a single multi-get.
+                # We just need to send them to the current user (the blocker who is unblocking)
+                fanout.send(
+                    (fanout.user_group(request.user.id), {
+                        'type': 'chat_message',
+                        'message': media_access.sign_message(data, request.user.id)
+                    })
+                    for data in MessageSerializer(pending_messages.select_related('sender'), many=True).data
+                )
             
             return Response({"status": "unblocked"}, status=status.HTTP_200_OK)
         except User.DoesNotExist:
@@ -435,3 +446,31 @@ class UpdateFCMTokenView(APIView):
         request.user.fcm_token = fcm_token
         request.user.save()
         return Response({"status": "updated"}, status=status.HTTP_200_OK)
+
+
+class DeletionJobDetailView(APIView):
+    """Progress of a background deletion of the user's call history."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        job = DeletionJob.objects.filter(id=pk, user=request.user).first()
+        if job is None:
+            return Response({"error": "Deletion not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(DeletionJobSerializer(job).data)
+
+
+class DeletionJobStatusView(APIView):
+    """
+    Progress of a deletion by its ``progress_token``. A deleted account is
+    deactivated, so its API token can't be used here; the signed token is
+    the credential instead.
+    """
+    permission_classes = [permissions.AllowAny]
+    # The deactivated user's token would be rejected before the view runs
+    authentication_classes = []
+
+    def get(self, request, token):
+        job = deletion.job_for_token(token)
+        if job is None:
+            return Response({"error": "Deletion not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(DeletionJobSerializer(job).data)
@@ -2,6 +2,9 @@ from django.test import TestCase
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
+from unittest.mock import patch
+from accounts import deletion
+from accounts.models import DeletionJob
 from .models import Call
 
 User = get_user_model()
@@ -25,3 +28,48 @@ class CallCreationTest(TestCase):
         self.assertEqual(call.caller, self.caller)
         self.assertEqual(call.receiver, self.receiver)
         self.assertTrue(call.is_video)
+
+
+class CallHistoryDeletionTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.caller = User.objects.create_user(username='caller', password='password', email='caller@example.com')
+        self.receiver = User.objects.create_user(username='receiver', password='password', email='receiver@example.com')
+        self.client.force_authenticate(user=self.caller)
+        self.calls = [Call.objects.create(caller=self.caller, receiver=self.receiver) for _ in range(5)]
+        self.other = Call.objects.create(caller=self.receiver, receiver=self.receiver)
+
+    def test_clear_deletes_in_batches_and_reports_progress(self):
+        with patch('accounts.tasks.run_deletion_job.delay') as delay:
+            response = self.client.delete('/api/calls/clear/')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            job_id = response.data['id']
+            delay.assert_called_once_with(job_id)
+            # Hidden right away, deleted once the job runs
+            self.assertEqual(self.client.get('/api/calls/').data, [])
+            later = Call.objects.create(caller=self.caller, receiver=self.receiver)
+
+            job = deletion.run(job_id, batch_size=2, pause=0)
+        self.assertEqual((job.status, job.step, job.rows_deleted), ('completed', 'calls', 5))
+        self.assertEqual(set(Call.objects.values_list('id', flat=True)), {self.other.id, later.id})
+        self.assertEqual([call['id'] for call in self.client.get('/api/calls/').data], [later.id])
+        self.assertIsNone(deletion.run(job_id))
+
+        progress = self.client.get(f'/api/auth/deletions/{job_id}/').data
+        self.assertEqual((progress['status'], progress['rows_deleted']), ('completed', 5))
+        other_client = APIClient()
+        other_client.force_authenticate(user=self.receiver)
+        self.assertEqual(other_client.get(f'/api/auth/deletions/{job_id}/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_bulk_delete_only_takes_own_calls(self):
+        response = self.client.post('/api/calls/bulk-delete/', {
+            'call_ids': [self.calls[0].id, self.other.id],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(DeletionJob.objects.get(id=response.data['id']).status, 'completed')
+        self.assertFalse(Call.objects.filter(id=self.calls[0].id).exists())
+        self.assertTrue(Call.objects.filter(id=self.other.id).exists())
+        self.assertEqual(Call.objects.filter(caller=self.caller).count(), 4)
+
+        bad = self.client.post('/api/calls/bulk-delete/', {'call_ids': ['x']}, format='json')
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
@@ -2,6 +2,8 @@ from rest_framework import generics, permissions, serializers, status, views
 from rest_framework.response import Response
 from django.db.models import Q
 from django.contrib.auth import get_user_model
+from accounts import deletion
+from accounts.serializers import DeletionJobSerializer
 from .models import Call
 from .serializers import CallSerializer
 
@@ -15,7 +17,7 @@ class CallViewSet(generics.ListCreateAPIView):
         # Return calls where user is caller OR receiver
         return Call.objects.filter(
             Q(caller=self.request.user) | Q(receiver=self.request.user)
-        ).order_by('-started_at')
+        ).exclude(deletion.hidden_calls(self.request.user)).order_by('-started_at')
 
     def perform_create(self, serializer):
         recipient_username = self.request.data.get('receiver_username')
@@ -38,10 +40,8 @@ class ClearCallHistoryView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def delete(self, request):
-        Call.objects.filter(
-            Q(caller=request.user) | Q(receiver=request.user)
-        ).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        job = deletion.start(request.user, 'calls')
+        return Response(DeletionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
 class BulkDeleteCallsView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -50,9 +50,10 @@ class BulkDeleteCallsView(views.APIView):
         call_ids = request.data.get('call_ids', [])
         if not call_ids:
             return Response({"error": "No call IDs provided"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        Call.objects.filter(
-            Q(caller=request.user) | Q(receiver=request.user),
-            id__in=call_ids
-        ).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        try:
+            call_ids = [int(call_id) for call_id in call_ids]
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid call IDs"}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = deletion.start(request.user, 'calls', call_ids=call_ids)
+        return Response(DeletionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
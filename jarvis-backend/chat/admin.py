@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Conversation, Message, Reaction
+from . import search
+from .models import ArchivedMessage, Conversation, ImportJob, InboxEntry, MediaBlob, Message, PurgeRun, Reaction, StorageUsage, UploadSession
 
 
 @admin.register(Conversation)
@@ -19,9 +20,16 @@ class ConversationAdmin(admin.ModelAdmin):
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('id', 'sender', 'conversation', 'get_text_preview', 'timestamp', 'is_read', 'is_delivered', 'file_type', 'file_name', 'reply_to', 'deleted_at')
     list_filter = ('timestamp', 'is_read', 'is_delivered', 'file_type', 'deleted_at')
-    search_fields = ('text', 'sender__username', 'conversation__id', 'file_name')
+    search_fields = ('sender__username', 'conversation__id', 'file_name')
     readonly_fields = ('timestamp',)
-    raw_id_fields = ('conversation', 'sender', 'reply_to')
+    raw_id_fields = ('conversation', 'sender', 'reply_to', 'blob')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Message text goes through the full-text index instead of an ILIKE scan
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            results |= search.filter_messages(queryset, search_term)
+        return results, may_have_duplicates
     
     def get_text_preview(self, obj):
         return obj.text[:50] + '...' if len(obj.text) > 50 else obj.text
@@ -40,3 +48,60 @@ class ReactionAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'message__id', 'emoji')
     readonly_fields = ('timestamp',)
     raw_id_fields = ('message', 'user')
+
+
+@admin.register(InboxEntry)
+class InboxEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'conversation', 'last_message_preview', 'unread_count', 'last_activity_at', 'is_deleted')
+    list_filter = ('is_deleted',)
+    search_fields = ('user__username', 'conversation__id')
+    raw_id_fields = ('user', 'conversation', 'other_user', 'last_message')
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'conversation', 'status', 'messages_imported', 'rows_skipped', 'lines_processed', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('user__username',)
+    readonly_fields = ('created_at', 'updated_at')
+    raw_id_fields = ('user', 'conversation')
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'file_name', 'status', 'received', 'total_size', 'expires_at')
+    list_filter = ('status',)
+    search_fields = ('user__username', 'file_name')
+    readonly_fields = ('created_at',)
+    raw_id_fields = ('user', 'message')
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'content_type', 'size', 'ref_count', 'created_at')
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'file', 'size', 'ref_count', 'created_at')
+
+
+@admin.register(StorageUsage)
+class StorageUsageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'conversation', 'media_type', 'bytes', 'count', 'updated_at')
+    list_filter = ('media_type',)
+    search_fields = ('user__username', 'conversation__id')
+    raw_id_fields = ('user', 'conversation')
+
+
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'conversation', 'sender', 'timestamp', 'month', 'archived_at')
+    raw_id_fields = ('conversation', 'sender')
+    readonly_fields = ('id', 'timestamp', 'month', 'archived_at')
+    exclude = ('payload',)
+
+
+@admin.register(PurgeRun)
+class PurgeRunAdmin(admin.ModelAdmin):
+    list_display = ('id', 'cutoff', 'phase', 'messages_purged', 'conversations_purged',
+                    'files_deleted', 'bytes_freed', 'started_at', 'finished_at')
+    list_filter = ('phase',)
+    readonly_fields = ('started_at', 'updated_at')
@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ChatConfig(AppConfig):
     name = 'chat'
+
+    def ready(self):
+        from .search import ensure_index
+        post_migrate.connect(ensure_index, sender=self)
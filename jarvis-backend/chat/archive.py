@@ -0,0 +1,235 @@
+"""
+Cold storage for old messages.
+
+Every index on ``Message`` covers every row it has ever held, so the live
+table only keeps recent history. Whole months older than
+``settings.MESSAGE_ARCHIVE_AFTER_DAYS`` are moved, a batch per short
+transaction, into ``ArchivedMessage``. There each row keeps its rendered
+body and reactions as zlib-compressed JSON and nothing else is indexed but
+the history order. On PostgreSQL the archive is range-partitioned by month
+and partitions are created as they are first needed; other databases get a
+plain table.
+
+Rows that the live tables still point at stay behind: unread or pinned
+messages, ones with a file or a disappearing timer, replied-to ones, inbox
+previews, and rows a running import may still link to. Unread counts, media
+access checks, storage counters and reply previews therefore never have to
+look at the archive.
+
+History (``MessageCursorPagination``) and export merge archived rows in by
+``(timestamp, id)``. History only queries the archive when the page reaches
+back to the conversation's newest archived message.
+
+Archived rows have no tombstone: clearing a chat for everyone or deleting an
+archived message removes its row for good (``delete``, ``delete_sent``).
+"""
+import datetime
+import json
+import logging
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from . import inbox
+from .models import ArchivedMessage, ImportedMessage, InboxEntry, Message, Reaction
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+# Bounds one run; the next run picks up whatever is left
+MAX_BATCHES = 100
+NEWEST_TIMEOUT = 60 * 60 * 24
+
+_partitions = set()
+
+
+def horizon(now=None):
+    """Messages older than this may be archived, or None when archiving is off."""
+    days = getattr(settings, 'MESSAGE_ARCHIVE_AFTER_DAYS', 0)
+    if not days:
+        return None
+    cutoff = (now or timezone.now()).astimezone(datetime.timezone.utc) - timedelta(days=days)
+    # Whole months, so each archive partition is filled once
+    return cutoff.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def month_of(timestamp):
+    timestamp = timestamp.astimezone(datetime.timezone.utc)
+    return datetime.date(timestamp.year, timestamp.month, 1)
+
+
+def _next_month(month):
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def create_table(schema_editor, model):
+    """Create the archive table: partitioned by month on PostgreSQL, plain elsewhere."""
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.create_model(model)
+        return
+    quote = schema_editor.quote_name
+    conversations = model._meta.get_field('conversation').related_model._meta.db_table
+    users = model._meta.get_field('sender').related_model._meta.db_table
+    # A partitioned table's primary key has to include the partition key
+    schema_editor.execute(f"""
+        CREATE TABLE {quote(model._meta.db_table)} (
+            "id" bigint NOT NULL,
+            "conversation_id" bigint NOT NULL REFERENCES {quote(conversations)} ("id") DEFERRABLE INITIALLY DEFERRED,
+            "sender_id" bigint NOT NULL REFERENCES {quote(users)} ("id") DEFERRABLE INITIALLY DEFERRED,
+            "timestamp" timestamp with time zone NOT NULL,
+            "month" date NOT NULL,
+            "payload" bytea NOT NULL,
+            "archived_at" timestamp with time zone NOT NULL,
+            PRIMARY KEY ("id", "month")
+        ) PARTITION BY RANGE ("month")
+    """)
+    # Payloads are compressed already; don't let TOAST try again
+    schema_editor.execute(f'ALTER TABLE {quote(model._meta.db_table)} ALTER COLUMN "payload" SET STORAGE EXTERNAL')
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
+
+
+def ensure_partitions(months):
+    """Create the PostgreSQL partitions holding ``months`` if they don't exist yet."""
+    if connection.vendor != 'postgresql':
+        return
+    table = ArchivedMessage._meta.db_table
+    missing = sorted(set(months) - _partitions)
+    with connection.cursor() as cursor:
+        for month in missing:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}_p{month:%Y%m}" PARTITION OF "{table}" '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+            )
+    # Only remembered once the DDL can't be rolled back any more
+    transaction.on_commit(lambda: _partitions.update(missing))
+
+
+def archivable(before):
+    """Messages older than ``before`` that nothing in the live tables depends on."""
+    return Message.objects.filter(
+        Q(file='') | Q(file__isnull=True),
+        timestamp__lt=before,
+        deleted_at__isnull=True,
+        is_read=True,
+        is_pinned=False,
+        expires_at__isnull=True,
+    ).exclude(
+        Exists(Message.objects.filter(reply_to=OuterRef('pk')))
+    ).exclude(
+        Exists(InboxEntry.objects.filter(last_message=OuterRef('pk')))
+    ).exclude(
+        Exists(ImportedMessage.objects.filter(message=OuterRef('pk'), job__status__in=('pending', 'running')))
+    )
+
+
+def _payloads(messages):
+    from .serializers import render_message_bodies
+
+    reactions = {}
+    for reaction in Reaction.objects.filter(
+        message_id__in=[message.id for message in messages]
+    ).values('message_id', 'emoji', user_username=F('user__username')).order_by('id'):
+        reactions.setdefault(reaction.pop('message_id'), []).append(reaction)
+    for message, body in zip(messages, render_message_bodies(messages)):
+        data = {'body': body, 'reactions': reactions.get(message.id, [])}
+        yield zlib.compress(json.dumps(data, cls=DjangoJSONEncoder).encode())
+
+
+def archive_batch(before, batch_size=BATCH_SIZE):
+    """Move up to ``batch_size`` archivable messages; returns how many moved."""
+    with transaction.atomic():
+        candidates = archivable(before).order_by('timestamp', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True, of=('self',))
+        ids = list(candidates.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        messages = list(Message.objects.filter(id__in=ids).order_by('timestamp', 'id'))
+        archived = [
+            ArchivedMessage(
+                id=message.id,
+                conversation_id=message.conversation_id,
+                sender_id=message.sender_id,
+                timestamp=message.timestamp,
+                month=month_of(message.timestamp),
+                payload=payload,
+            )
+            for message, payload in zip(messages, _payloads(messages))
+        ]
+        ensure_partitions({row.month for row in archived})
+        ArchivedMessage.objects.bulk_create(archived)
+        Message.objects.filter(id__in=ids).delete()
+    cache.delete_many([_newest_key(conversation_id) for conversation_id in {m.conversation_id for m in messages}])
+    return len(ids)
+
+
+def archive(batch_size=BATCH_SIZE, max_batches=MAX_BATCHES, now=None):
+    """Move messages behind the horizon to the archive; returns how many moved."""
+    before = horizon(now)
+    if before is None:
+        return 0
+    moved = 0
+    for _ in range(max_batches):
+        count = archive_batch(before, batch_size)
+        moved += count
+        if count < batch_size:
+            break
+    if moved:
+        logger.info("Archived %s messages older than %s", moved, before.date())
+    return moved
+
+
+def _newest_key(conversation_id):
+    return f"chat:archive:newest:{conversation_id}"
+
+
+def delete(conversation_id, ids=None, batch_size=BATCH_SIZE):
+    """Delete a conversation's archived messages, or only ``ids`` of them; returns how many went."""
+    rows = ArchivedMessage.objects.filter(conversation_id=conversation_id)
+    if ids is not None:
+        rows = rows.filter(id__in=ids)
+    deleted = 0
+    while batch := list(rows.values_list('id', flat=True)[:batch_size]):
+        ArchivedMessage.objects.filter(id__in=batch).delete()
+        deleted += len(batch)
+    cache.delete(_newest_key(conversation_id))
+    return deleted
+
+
+def delete_sent(user, message_id):
+    """Delete ``user``'s archived message ``message_id``; returns its conversation id, or None if there is none."""
+    conversation_id = ArchivedMessage.objects.filter(
+        id=message_id, sender=user,
+    ).values_list('conversation_id', flat=True).first()
+    if conversation_id is not None:
+        delete(conversation_id, ids=[message_id])
+        inbox.touch(conversation_id)
+    return conversation_id
+
+
+def newest(conversation_id):
+    """Timestamp of the newest archived message of a conversation, or None."""
+    key = _newest_key(conversation_id)
+    value = cache.get(key)
+    if value is None:
+        value = ArchivedMessage.objects.filter(conversation_id=conversation_id).order_by(
+            '-timestamp'
+        ).values_list('timestamp', flat=True).first() or ''
+        cache.set(key, value, NEWEST_TIMEOUT)
+    return value or None
+
+
+def visible_messages(user, conversation_id):
+    """Archived messages of a conversation as ``user`` is allowed to see them."""
+    messages = ArchivedMessage.objects.filter(conversation_id=conversation_id)
+    watermark = inbox.cleared_before(user.id, conversation_id)
+    if watermark is not None:
+        messages = messages.filter(timestamp__gt=watermark)
+    return messages
@@ -6,6 +6,9 @@ from django.contrib.auth import get_user_model
 from django.core.cache import cache
 import logging
 
+from accounts import avatars
+from . import archive, expiry, inbox, render_cache, storage_usage
+
 logger = logging.getLogger(__name__)
 
 User = get_user_model()
@@ -276,7 +279,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
                 # Inject caller info for reliability on receiver end
                 text_data_json['caller_name'] = self.user.username
-                text_data_json['caller_avatar'] = self.user.profile_picture.url if getattr(self.user, 'profile_picture', None) else ""
+                text_data_json['caller_avatar'] = avatars.url(self.user)
 
                 logger.info(f"[WS] ➡️ Broadcasting {message_type} to user_{recipient_id}")
                 await self.channel_layer.group_send(
@@ -348,7 +351,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 recipient_id,
                 str(chat_id),
                 self.user.username,
-                str(self.user.profile_picture.url) if self.user.profile_picture else None,
+                avatars.url(self.user) or None,
                 text_data_json.get('is_video'),
                 text_data_json.get('call_uuid') or text_data_json.get('callUUID') or str(uuid.uuid4()),
                 text_data_json.get('offer', {}).get('type', 'offer'),
@@ -373,6 +376,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'message': message
         }))
 
+    async def chat_messages(self, event):
+        # Several new messages in one channel layer event (e.g. a forward);
+        # clients still get one frame per message
+        for message in event['messages']:
+            await self.chat_message({'message': message})
+
     @database_sync_to_async
     def get_recipient_from_conversation(self, conversation_id):
         from .models import Conversation
@@ -392,6 +401,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'conversation_id': event.get('conversation_id')
         }))
 
+    async def messages_read(self, event):
+        # Bulk receipt: the reader caught up on one or more conversations
+        await self.send(text_data=json.dumps({
+            'type': 'messages_read',
+            'reader_id': event['reader_id'],
+            'conversations': event['conversations'],
+        }))
+
     async def message_delivered(self, event):
         # Notify user that their message was delivered
         await self.send(text_data=json.dumps({
@@ -425,6 +442,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if not message.is_read:
                 message.is_read = True
                 message.save()
+                inbox.message_read(self.user, message)
                 return message.sender.id
             return None
         except Message.DoesNotExist:
@@ -438,6 +456,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if not message.is_delivered:
                 message.is_delivered = True
                 message.save()
+                inbox.touch(message.conversation_id)
                 return message.sender.id
             return None
         except Message.DoesNotExist:
@@ -484,8 +503,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     conversation=conversation,
                     sender=self.user,
                     text=message_text,
-                    reply_to=reply_to_message
+                    reply_to=reply_to_message,
+                    expires_at=expiry.expires_at(self.user),
                 )
+                inbox.record_message(message, hidden_from=[other_user.id] if is_blocked else ())
                 
                 # Determine recipient for return
                 data = MessageSerializer(message).data
@@ -531,6 +552,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             message = Message.objects.get(id=message_id, sender=self.user)
             message.text = new_text
             message.save()
+            # Replies embed the quoted text
+            render_cache.invalidate(*message.replies.values_list('id', flat=True))
+            inbox.message_changed(message)
             return True
         except Message.DoesNotExist:
             return False
@@ -541,11 +565,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
         from django.utils import timezone
         try:
             message = Message.objects.get(id=message_id, sender=self.user)
+            storage_usage.subtract(Message.objects.filter(pk=message.pk))
             message.deleted_at = timezone.now()
             message.save()
+            inbox.refresh_entries(message.conversation_id)
             return message.deleted_at.isoformat()
         except Message.DoesNotExist:
-            return None
+            # Archived messages can't be soft-deleted; they go for good
+            if archive.delete_sent(self.user, message_id) is None:
+                return None
+            return timezone.now().isoformat()
 
     @database_sync_to_async
     def react_to_message(self, message_id, emoji):
@@ -565,7 +594,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     existing.save()
             else:
                 Reaction.objects.create(message=message, user=self.user, emoji=emoji)
-            
+
+            render_cache.invalidate(message.id)
+            inbox.touch(message.conversation_id)
             return list(message.reactions.values_list('emoji', flat=True))
         except Message.DoesNotExist:
             return []
@@ -581,6 +612,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             message.is_pinned = True
             message.save()
+            inbox.touch(message.conversation_id)
             return True
         except Message.DoesNotExist:
             return False
@@ -596,6 +628,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             message.is_pinned = False
             message.save()
+            inbox.touch(message.conversation_id)
             return True
         except Message.DoesNotExist:
             return False
@@ -645,6 +678,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'chat_id': event['chat_id']
         }))
 
+    async def messages_expired(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'messages_expired',
+            'conversation_id': event['conversation_id'],
+            'message_ids': event['message_ids']
+        }))
+
     async def clear_chat(self, event):
         await self.send(text_data=json.dumps({
             'type': 'clear_chat',
@@ -0,0 +1,161 @@
+"""
+Downscaled copies of image messages for chat bubbles and the viewer.
+
+``generate`` decodes the original once: JPEGs are opened in draft mode so
+libjpeg decodes straight at 1/2, 1/4 or 1/8 scale, and the rest of the
+downscale goes through ``reduce`` (``reducing_gap``). EXIF orientation is
+applied and no EXIF is written out, so location and camera data stay in the
+original only. Each size is stored as WebP, or JPEG where Pillow was built
+without WebP, and described in ``media_metadata['previews']``. A BlurHash of
+the smallest size goes in ``media_metadata['placeholder']``.
+"""
+import io
+import math
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+# Longest side in pixels, smallest first
+SIZES = {
+    'thumb': 320,
+    'preview': 1280,
+}
+QUALITY = 80
+PLACEHOLDER_SIZE = 32
+PLACEHOLDER_COMPONENTS = (4, 3)
+
+_BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def output_format():
+    if features.check('webp'):
+        return 'WEBP', 'webp', 'image/webp'
+    return 'JPEG', 'jpg', 'image/jpeg'
+
+
+def base_name(message):
+    """Storage prefix for a message's derivatives, shared by copies of one blob."""
+    if message.blob_id:
+        digest = message.blob.sha256
+        return f"derivatives/{digest[:2]}/{digest[2:4]}/{digest}"
+    return f"derivatives/legacy/{message.id}"
+
+
+def _encode(image, format_name):
+    if format_name == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    # No exif= argument, so none of the original's metadata is written
+    image.save(buffer, format_name, quality=QUALITY)
+    return buffer.getvalue()
+
+
+def generate(image, prefix):
+    """
+    Store derivatives of the opened, not yet loaded ``image``, which is
+    scaled down in place.
+
+    Returns the ``previews`` and ``placeholder`` entries for media_metadata.
+    Sizes at least as large as the original are skipped, except the
+    smallest, which is always made so there is an EXIF-free copy to show.
+    """
+    format_name, extension, content_type = output_format()
+    longest = max(image.size)
+    wanted = [(name, bound) for name, bound in SIZES.items() if bound < longest]
+    if not wanted:
+        wanted = [next(iter(SIZES.items()))]
+
+    # Decode once, at the smallest JPEG scale that still covers the largest size
+    largest = wanted[-1][1]
+    image.draft('RGB', (largest, largest))
+    ImageOps.exif_transpose(image, in_place=True)
+    if image.mode not in ('RGB', 'RGBA'):
+        # Palette and greyscale images are resampled poorly; transparency is kept
+        has_alpha = 'transparency' in image.info or image.mode in ('LA', 'PA')
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    # Each size is scaled down from the previous one, in place
+    previews = {}
+    for name, bound in reversed(wanted):
+        image.thumbnail((bound, bound), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        data = _encode(image, format_name)
+        path = default_storage.save(f"{prefix}_{name}.{extension}", ContentFile(data))
+        previews[name] = {
+            'path': path,
+            'url': default_storage.url(path),
+            'width': image.width,
+            'height': image.height,
+            'size': len(data),
+            'content_type': content_type,
+        }
+
+    image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.BILINEAR)
+    return {'previews': previews, 'placeholder': blurhash(image.convert('RGB'))}
+
+
+def delete(metadata):
+    for preview in (metadata or {}).get('previews', {}).values():
+        default_storage.delete(preview['path'])
+
+
+def _base83(value, length):
+    return ''.join(_BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _to_linear(value):
+    value /= 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value):
+    value = min(max(value, 0.0), 1.0)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exponent):
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def blurhash(image, components=PLACEHOLDER_COMPONENTS):
+    """BlurHash (https://blurha.sh) of a small RGB image."""
+    components_x, components_y = components
+    width, height = image.size
+    linear = [tuple(_to_linear(channel) for channel in pixel) for pixel in image.getdata()]
+
+    factors = []
+    for j in range(components_y):
+        cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(components_x):
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[x] * cos_y[y]
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = normalisation / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((components_x - 1) + (components_y - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, int(math.floor(max(abs(c) for f in ac for c in f) * 166 - 0.5))))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1
+    result += _base83(quantised_max, 1)
+    result += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+
+    def quantise(value):
+        return max(0, min(18, int(math.floor(_sign_pow(value / max_value, 0.5) * 9 + 9.5))))
+
+    for r, g, b in ac:
+        result += _base83(quantise(r) * 19 * 19 + quantise(g) * 19 + quantise(b), 2)
+    return result
@@ -0,0 +1,109 @@
+"""
+Disappearing messages.
+
+A message gets ``expires_at`` when it is sent if its sender has a disappearing
+messages timer (``User.privacy_disappearing_messages_timer``, in seconds).
+History and inbox queries hide a message as soon as it is due (see
+``inbox.visible_messages``). The periodic ``purge`` then tombstones it:
+the text and media are dropped and ``deleted_at`` is set. The files
+themselves are deleted once the batch commits.
+
+The purge walks the partial index on ``expires_at``, which only holds live
+messages with a timer. It handles one batch per short transaction, so no
+lock is held for long and a backlog is worked off a batch at a time. Each
+conversation in a batch is refreshed once, and each of its participants gets
+a single ``messages_expired`` event listing every message that went.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import fanout, inbox, media_store, storage_usage
+from .models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+# Bounds one purge run; the next run picks up whatever is left
+MAX_BATCHES = 50
+
+
+def expires_at(sender, sent_at=None):
+    """When a message ``sender`` sends now (or at ``sent_at``) disappears, or None."""
+    timer = getattr(sender, 'privacy_disappearing_messages_timer', 0) or 0
+    if timer <= 0:
+        return None
+    return (sent_at or timezone.now()) + timedelta(seconds=timer)
+
+
+def due(now=None):
+    """Live messages whose time is up."""
+    return Message.objects.filter(
+        expires_at__isnull=False, deleted_at__isnull=True, expires_at__lte=now or timezone.now(),
+    )
+
+
+def purge_batch(batch_size=BATCH_SIZE, now=None):
+    """Tombstone up to ``batch_size`` expired messages; returns ``{conversation_id: [message ids]}``."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        expired = due(now).order_by('expires_at')
+        if connection.features.has_select_for_update_skip_locked:
+            # Concurrent purges take different rows instead of waiting on each other
+            expired = expired.select_for_update(skip_locked=True)
+        rows = list(expired.values_list('id', 'conversation_id', 'blob_id', 'file', 'media_metadata')[:batch_size])
+        if not rows:
+            return {}
+        ids = [row[0] for row in rows]
+        storage_usage.subtract(Message.objects.filter(id__in=ids))
+        Message.objects.filter(id__in=ids).update(
+            deleted_at=now, text='', file=None, blob=None, file_name=None,
+            media_metadata={}, version=F('version') + 1,
+        )
+        media_store.release([row[2] for row in rows])
+        media_store.delete_legacy_files([(row[3], row[4]) for row in rows if row[3] and not row[2]], ids)
+
+    expired_by_conversation = defaultdict(list)
+    for message_id, conversation_id, *_ in rows:
+        expired_by_conversation[conversation_id].append(message_id)
+    return dict(expired_by_conversation)
+
+
+def _notify(expired_by_conversation):
+    participants = defaultdict(list)
+    for conversation_id, user_id in Conversation.participants.through.objects.filter(
+        conversation_id__in=expired_by_conversation,
+    ).values_list('conversation_id', 'user_id'):
+        participants[conversation_id].append(user_id)
+    fanout.send(
+        (fanout.user_group(user_id), {
+            'type': 'messages_expired',
+            'conversation_id': conversation_id,
+            'message_ids': message_ids,
+        })
+        for conversation_id, message_ids in expired_by_conversation.items()
+        for user_id in participants[conversation_id]
+    )
+
+
+def purge(batch_size=BATCH_SIZE, max_batches=MAX_BATCHES, now=None):
+    """Tombstone expired messages a batch at a time; returns how many went."""
+    purged = 0
+    for _ in range(max_batches):
+        expired_by_conversation = purge_batch(batch_size, now)
+        if not expired_by_conversation:
+            break
+        for conversation_id in expired_by_conversation:
+            inbox.refresh_entries(conversation_id)
+        _notify(expired_by_conversation)
+        count = sum(len(ids) for ids in expired_by_conversation.values())
+        purged += count
+        if count < batch_size:
+            break
+    if purged:
+        logger.info("Purged %s expired messages", purged)
+    return purged
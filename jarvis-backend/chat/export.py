@@ -0,0 +1,195 @@
+"""
+Streaming conversation export.
+
+Messages are read in keyset chunks of ``CHUNK_SIZE`` rows as plain values
+(no model instances or serializers) and written out as they arrive, so
+memory stays flat no matter how long the conversation is. Each chunk is a
+short query, which keeps connections free of long-lived cursors while a
+slow client downloads.
+
+The NDJSON stream starts with one ``conversation`` record followed by one
+``message`` record per line, oldest first. Archived messages (see
+chat.archive) are merged in by ``(timestamp, id)``. The zip variant wraps the same
+stream as ``messages.ndjson`` and can include the attachments under
+``media/``.
+"""
+import datetime
+import heapq
+import json
+import os
+import zipfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.utils import timezone
+
+from . import archive, inbox
+from .models import Message, Reaction
+from .pagination import keyset_filter
+
+CHUNK_SIZE = 2000
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FIELDS = (
+    'id', 'sender_id', 'text', 'message_type', 'file', 'file_type', 'file_name',
+    'media_metadata', 'latitude', 'longitude', 'contact_name', 'contact_phone',
+    'timestamp', 'is_read', 'is_delivered', 'reply_to_id', 'is_pinned',
+)
+
+
+def export_messages(user, conversation):
+    """Messages of ``conversation`` as ``user`` sees them, without deleted ones."""
+    return inbox.visible_messages(user, conversation.id).filter(deleted_at__isnull=True)
+
+
+def iter_chunks(queryset, chunk_size=CHUNK_SIZE):
+    """Yield lists of value dicts, walking ``(timestamp, id)`` with a keyset."""
+    page = queryset.order_by('timestamp', 'id')
+    while True:
+        rows = list(page.values(*EXPORT_FIELDS)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+        page = keyset_filter(queryset, last['timestamp'], last['id'], newer=True)
+
+
+def _attach_reactions(rows):
+    reactions = {}
+    for reaction in Reaction.objects.filter(
+        message_id__in=[row['id'] for row in rows]
+    ).values('message_id', 'emoji', user_username=F('user__username')).order_by('id'):
+        reactions.setdefault(reaction.pop('message_id'), []).append(reaction)
+    for row in rows:
+        row['reactions'] = reactions.get(row['id'], [])
+
+
+def _archived_rows(user, conversation, chunk_size=CHUNK_SIZE):
+    """Export rows of archived messages, oldest first, rebuilt from their stored bodies."""
+    queryset = archive.visible_messages(user, conversation.id)
+    page = queryset.order_by('timestamp', 'id')
+    while True:
+        chunk = list(page[:chunk_size])
+        for archived in chunk:
+            body = archived.body
+            reply_to = body.get('reply_to')
+            row = {name: body.get(name) for name in EXPORT_FIELDS}
+            row.update(
+                # Messages with files are never archived
+                file='',
+                sender_id=archived.sender_id,
+                timestamp=archived.timestamp,
+                reply_to_id=reply_to['id'] if isinstance(reply_to, dict) else reply_to,
+                reactions=archived.data['reactions'],
+            )
+            yield row
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+        page = keyset_filter(queryset, last.timestamp, last.id, newer=True)
+
+
+def iter_rows(user, conversation):
+    """Every exported message row with its reactions, oldest first."""
+    def live_rows():
+        for rows in iter_chunks(export_messages(user, conversation)):
+            _attach_reactions(rows)
+            yield from rows
+    return heapq.merge(live_rows(), _archived_rows(user, conversation), key=lambda row: (row['timestamp'], row['id']))
+
+
+class ExportEncoder(DjangoJSONEncoder):
+    """Keep full microsecond precision; DjangoJSONEncoder rounds to milliseconds."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _dumps(record):
+    return json.dumps(record, cls=ExportEncoder, ensure_ascii=False) + '\n'
+
+
+def media_path(row):
+    return f"media/{row['id']}_{os.path.basename(row['file'])}"
+
+
+def header(conversation):
+    participants = list(conversation.participants.values('id', 'username').order_by('id'))
+    return {
+        'type': 'conversation',
+        'id': conversation.id,
+        'created_at': conversation.created_at,
+        'participants': participants,
+        'exported_at': timezone.now(),
+    }
+
+
+def iter_ndjson(user, conversation, media_paths=False):
+    """Yield the export as NDJSON text, one chunk of messages at a time."""
+    yield _dumps(header(conversation))
+    lines = []
+    for row in iter_rows(user, conversation):
+        if row['file'] and media_paths:
+            row['file'] = media_path(row)
+        lines.append(_dumps({'type': 'message', **row}))
+        if len(lines) == CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+class _ZipStream:
+    """Write-only, unseekable file object whose contents are drained by the caller."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def iter_zip(user, conversation, include_media=False):
+    """Yield a zip archive as bytes while it is being built."""
+    storage = Message._meta.get_field('file').storage
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        with zip_file.open('messages.ndjson', 'w', force_zip64=True) as entry:
+            for text in iter_ndjson(user, conversation, media_paths=include_media):
+                entry.write(text.encode())
+                yield stream.drain()
+
+        if include_media:
+            media = export_messages(user, conversation).exclude(file='').exclude(file__isnull=True)
+            for rows in iter_chunks(media):
+                for row in rows:
+                    try:
+                        source = storage.open(row['file'], 'rb')
+                    except OSError:
+                        # Missing attachments are skipped; the NDJSON still references them
+                        continue
+                    info = zipfile.ZipInfo(media_path(row), date_time=row['timestamp'].timetuple()[:6])
+                    info.compress_type = zipfile.ZIP_STORED
+                    with source, zip_file.open(info, 'w', force_zip64=True) as entry:
+                        for block in iter(lambda: source.read(MEDIA_CHUNK_SIZE), b''):
+                            entry.write(block)
+                            yield stream.drain()
+    yield stream.drain()
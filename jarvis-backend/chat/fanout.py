@@ -0,0 +1,67 @@
+"""
+Sending a request's WebSocket events from synchronous code.
+
+Each ``async_to_sync`` call is a round trip to an event loop, so calling
+``group_send`` once per participant in a loop blocks the request thread once
+per event. ``send`` queues every event of a request and, once the transaction
+commits, delivers them all concurrently within a single ``async_to_sync``
+call. With channels_redis the sends share the layer's connection pool, so
+their Redis commands overlap instead of running one round trip after another.
+Events are only delivered once the transaction commits, so clients never
+fetch rows that aren't visible yet.
+
+Each delivery logs how long it took, and logs a warning when it takes longer
+than ``settings.FANOUT_SLOW_MS``.
+"""
+import asyncio
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def user_group(user_id):
+    return f"user_{user_id}"
+
+
+async def _send_all(channel_layer, events):
+    results = await asyncio.gather(
+        *(channel_layer.group_send(group, message) for group, message in events),
+        return_exceptions=True,
+    )
+    return [(group, result) for (group, _), result in zip(events, results) if isinstance(result, Exception)]
+
+
+def deliver(events):
+    """Send ``[(group, message)]`` now, in one event loop hop; returns the elapsed milliseconds."""
+    events = list(events)
+    if not events:
+        return 0.0
+    start = time.perf_counter()
+    failures = async_to_sync(_send_all)(get_channel_layer(), events)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for group, error in failures:
+        logger.error("Fan-out to %s failed: %s", group, error)
+    if elapsed_ms > getattr(settings, 'FANOUT_SLOW_MS', 250):
+        logger.warning("Fan-out of %s events to %s groups took %.1f ms",
+                       len(events), len({group for group, _ in events}), elapsed_ms)
+    else:
+        logger.debug("Fan-out of %s events took %.1f ms", len(events), elapsed_ms)
+    return elapsed_ms
+
+
+def send(events):
+    """Queue ``[(group, message)]`` to be delivered together once the current transaction commits."""
+    events = list(events)
+    if events:
+        transaction.on_commit(lambda: deliver(events))
+
+
+def send_to_users(user_ids, message):
+    """Queue the same ``message`` for each of ``user_ids``."""
+    send((user_group(user_id), message) for user_id in user_ids)
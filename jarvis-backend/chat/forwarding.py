@@ -0,0 +1,100 @@
+"""
+Forwarding one message to many conversations.
+
+Copies share the source's stored file: its blob gets one reference per copy
+and processed metadata is copied, so nothing is uploaded or processed again.
+All copies are inserted with one bulk_create. The view then sends each
+participant a single WebSocket event holding every copy they can see, and
+hands all pushes to one task that sends them in one FCM batch.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from accounts.models import BlockedUser
+
+from . import expiry, inbox, storage_usage
+from .models import Conversation, MediaBlob, Message
+
+MAX_TARGETS = 50
+
+COPIED_FIELDS = (
+    'text', 'message_type', 'file_type', 'file_name',
+    'latitude', 'longitude', 'contact_name', 'contact_phone',
+)
+
+
+def source_message(user, message_id):
+    """
+    Message ``message_id`` if ``user`` can see it: not deleted, cleared or
+    expired, and not from someone they blocked. Otherwise None.
+    """
+    conversation_id = Message.objects.filter(
+        id=message_id, conversation__participants=user,
+    ).values_list('conversation_id', flat=True).first()
+    if conversation_id is None:
+        return None
+    return inbox.visible_messages(user, conversation_id).filter(id=message_id, deleted_at__isnull=True).first()
+
+
+def target_conversations(user, conversation_ids):
+    """The conversations in ``conversation_ids`` that ``user`` takes part in."""
+    return list(
+        Conversation.objects.filter(id__in=conversation_ids, participants=user)
+        .prefetch_related('participants')
+        .order_by('id')
+    )
+
+
+def hidden_from(user, conversations):
+    """
+    Participants who mustn't see ``user``'s new messages yet, by conversation:
+    the other side of a one-to-one chat who blocked ``user``.
+    """
+    blockers = set(
+        BlockedUser.objects.filter(
+            blocked=user,
+            blocker__in={p.id for c in conversations for p in c.participants.all()},
+        ).values_list('blocker_id', flat=True)
+    )
+    hidden = {}
+    for conversation in conversations:
+        participants = conversation.participants.all()
+        if len(participants) == 2:
+            hidden[conversation.id] = [p.id for p in participants if p.id != user.id and p.id in blockers]
+        else:
+            hidden[conversation.id] = []
+    return hidden
+
+
+def _copy(source, sender, conversation):
+    message = Message(
+        conversation=conversation,
+        sender=sender,
+        file=source.file.name or None,
+        blob_id=source.blob_id,
+        expires_at=expiry.expires_at(sender),
+        **{name: getattr(source, name) for name in COPIED_FIELDS},
+    )
+    if source.file and source.media_processing_state != 'ready':
+        # Not processed yet: each copy is processed like a fresh upload
+        message.media_processing_state = 'pending'
+    else:
+        metadata = dict(source.media_metadata or {})
+        if not source.blob_id:
+            # Legacy previews are stored per message and only served to its conversation
+            metadata.pop('previews', None)
+        message.media_metadata = metadata
+    return message
+
+
+def forward(user, source, conversations, hidden):
+    """Copy ``source`` into each of ``conversations`` as sent by ``user``; returns the copies."""
+    copies = [_copy(source, user, conversation) for conversation in conversations]
+    with transaction.atomic():
+        if source.blob_id:
+            MediaBlob.objects.filter(id=source.blob_id).update(ref_count=F('ref_count') + len(copies))
+        copies = Message.objects.bulk_create(copies)
+    for copy in copies:
+        inbox.record_message(copy, hidden_from=hidden[copy.conversation_id])
+    storage_usage.add(Message.objects.filter(id__in=[copy.id for copy in copies]))
+    return copies
@@ -0,0 +1,273 @@
+"""
+Streamed NDJSON restore of conversation exports (see chat.export).
+
+The upload is read line by line and validated as it goes. Every
+``BATCH_SIZE`` lines the valid rows are written in their own transaction,
+together with the job's progress counters. A failed or interrupted upload
+can therefore be sent again to the same job: lines up to
+``job.lines_processed`` are skipped without being parsed. Nothing is held
+in memory beyond the current batch; reply links are resolved through
+ImportedMessage rows that are dropped once the job completes.
+
+On Postgres messages are written with COPY using ids drawn from the table's
+sequence; other backends use bulk_create.
+
+Media isn't restored. A backup can name any stored file and any preview path,
+and nothing proves the uploader may read (or, once purged, delete) them. So
+``file``, ``file_type``, ``file_name`` and ``media_metadata`` are ignored and
+media messages come back as text: their caption, or else the file name.
+"""
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from utils.chat_utils import get_or_create_1on1_conversation
+
+from . import inbox
+from .models import ImportedMessage, Message, Reaction
+
+BATCH_SIZE = 1000
+MAX_ERRORS = 50
+
+MESSAGE_TYPES = {value for value, _ in Message.MESSAGE_TYPES}
+MEDIA_TYPES = {'image', 'video', 'file', 'voice'}
+OPTIONAL_FIELDS = ('latitude', 'longitude', 'contact_name', 'contact_phone')
+
+User = get_user_model()
+
+
+class InvalidBackup(ValueError):
+    pass
+
+
+def _decode(line):
+    try:
+        record = json.loads(line)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid JSON: {e}")
+    if not isinstance(record, dict):
+        raise ValueError("Expected a JSON object")
+    return record
+
+
+def read_header(line, user):
+    """Return ``(participant id map, other user)`` from the export's first record."""
+    try:
+        record = _decode(line)
+    except ValueError as e:
+        raise InvalidBackup(str(e))
+    if record.get('type') != 'conversation' or not isinstance(record.get('participants'), list):
+        raise InvalidBackup("Backup must start with a conversation record")
+
+    usernames = {}
+    for participant in record['participants']:
+        if not isinstance(participant, dict) or 'id' not in participant or 'username' not in participant:
+            raise InvalidBackup("Malformed participant")
+        usernames[participant['id']] = participant['username']
+    if user.username not in usernames.values() or len(usernames) != 2:
+        raise InvalidBackup("Only one-to-one conversations you took part in can be restored")
+
+    users = {u.username: u for u in User.objects.filter(username__in=usernames.values())}
+    other_username = next(name for name in usernames.values() if name != user.username)
+    if other_username not in users:
+        raise InvalidBackup(f"User {other_username} no longer exists")
+    return {source_id: users[name] for source_id, name in usernames.items()}, users[other_username]
+
+
+def parse_message(record, participants, conversation):
+    """Validate one ``message`` record and build the unsaved Message for it."""
+    if record.get('type') != 'message':
+        raise ValueError("Expected a message record")
+    source_id = record.get('id')
+    if not isinstance(source_id, int):
+        raise ValueError("Message id must be an integer")
+    sender = participants.get(record.get('sender_id'))
+    if sender is None:
+        raise ValueError("Unknown sender")
+    timestamp = parse_datetime(record.get('timestamp') or '')
+    if timestamp is None:
+        raise ValueError("Invalid timestamp")
+    message_type = record.get('message_type') or 'text'
+    if message_type not in MESSAGE_TYPES:
+        raise ValueError(f"Unknown message type {message_type}")
+    text = record.get('text') or ''
+    if not isinstance(text, str):
+        raise ValueError("Text must be a string")
+    if message_type in MEDIA_TYPES:
+        message_type = 'text'
+        text = text or str(record.get('file_name') or '')
+
+    message = Message(
+        conversation=conversation,
+        sender=sender,
+        text=text,
+        message_type=message_type,
+        timestamp=timestamp,
+        is_read=bool(record.get('is_read')),
+        is_delivered=bool(record.get('is_delivered', True)),
+        is_pinned=bool(record.get('is_pinned')),
+        **{name: record.get(name) for name in OPTIONAL_FIELDS},
+    )
+    message.full_clean(exclude=['conversation', 'sender', 'reply_to'], validate_unique=False)
+    return source_id, message, record.get('reply_to_id'), record.get('reactions') or []
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    elif not isinstance(value, (str, int, Decimal)):
+        value = str(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_messages(messages):
+    """Insert with COPY, assigning ids from the sequence first so callers get pks back."""
+    fields = Message._meta.concrete_fields
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [Message._meta.db_table, len(messages)],
+        )
+        for message, (pk,) in zip(messages, cursor.fetchall()):
+            message.pk = pk
+
+        buffer = io.StringIO()
+        for message in messages:
+            values = []
+            for field in fields:
+                value = getattr(message, field.attname)
+                if field.get_internal_type() == 'FileField':
+                    value = value.name or ''
+                values.append(_copy_value(value))
+            buffer.write('\t'.join(values) + '\n')
+        buffer.seek(0)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        cursor.copy_expert(f"COPY {Message._meta.db_table} ({columns}) FROM STDIN", buffer)
+
+
+def _insert_messages(messages):
+    if connection.vendor == 'postgresql':
+        _copy_messages(messages)
+        return
+    # bulk_create stamps auto_now_add fields, so put the original times back
+    timestamps = [message.timestamp for message in messages]
+    Message.objects.bulk_create(messages)
+    for message, timestamp in zip(messages, timestamps):
+        message.timestamp = timestamp
+    Message.objects.bulk_update(messages, ['timestamp'])
+
+
+def write_batch(job, conversation, parsed, participants):
+    """Insert one batch of parsed rows; returns ``(imported, skipped)``."""
+    if not parsed:
+        return 0, 0
+
+    # Rows already present (an earlier restore of the same backup) are skipped
+    existing = {
+        (sender_id, timestamp): pk
+        for pk, sender_id, timestamp in Message.objects.filter(
+            conversation=conversation,
+            timestamp__in={message.timestamp for _, message, _, _ in parsed},
+        ).values_list('id', 'sender_id', 'timestamp')
+    }
+    fresh = []
+    mapping = []
+    for source_id, message, reply_source_id, reactions in parsed:
+        pk = existing.get((message.sender_id, message.timestamp))
+        if pk is None:
+            fresh.append((source_id, message, reply_source_id, reactions))
+        else:
+            mapping.append(ImportedMessage(job=job, source_id=source_id, message_id=pk))
+
+    _insert_messages([message for _, message, _, _ in fresh])
+    mapping.extend(ImportedMessage(job=job, source_id=source_id, message=message) for source_id, message, _, _ in fresh)
+    ImportedMessage.objects.bulk_create(mapping, ignore_conflicts=True)
+
+    reply_sources = {reply for _, _, reply, _ in fresh if reply is not None}
+    if reply_sources:
+        targets = dict(ImportedMessage.objects.filter(
+            job=job, source_id__in=reply_sources
+        ).values_list('source_id', 'message_id'))
+        replies = []
+        for _, message, reply_source_id, _ in fresh:
+            if targets.get(reply_source_id):
+                message.reply_to_id = targets[reply_source_id]
+                replies.append(message)
+        Message.objects.bulk_update(replies, ['reply_to'])
+
+    by_username = {user.username: user for user in participants.values()}
+    Reaction.objects.bulk_create([
+        Reaction(message=message, user=by_username[reaction['user_username']], emoji=str(reaction.get('emoji', ''))[:10])
+        for _, message, _, reactions in fresh
+        for reaction in reactions
+        if isinstance(reaction, dict) and reaction.get('user_username') in by_username
+    ], ignore_conflicts=True)
+    return len(fresh), len(parsed) - len(fresh)
+
+
+def run_import(job, stream):
+    """
+    Restore the NDJSON ``stream`` into ``job``'s conversation.
+
+    Raises InvalidBackup if the header can't be used; per-line problems are
+    recorded in ``job.errors`` and the line is skipped.
+    """
+    line = stream.readline()
+    bytes_processed = len(line)
+    participants, other_user = read_header(line, job.user)
+    if job.conversation_id is None:
+        job.conversation, _ = get_or_create_1on1_conversation(job.user, other_user)
+        job.lines_processed = 1
+        job.bytes_processed = bytes_processed
+        job.save(update_fields=['conversation', 'lines_processed', 'bytes_processed', 'updated_at'])
+    conversation = job.conversation
+
+    line_number = 1
+    parsed = []
+    pending_errors = []
+    skipped = 0
+    while True:
+        line = stream.readline()
+        if line:
+            line_number += 1
+            bytes_processed += len(line)
+            if line_number <= job.lines_processed or not line.strip():
+                continue
+            try:
+                parsed.append(parse_message(_decode(line), participants, conversation))
+            except Exception as e:
+                skipped += 1
+                pending_errors.append({'line': line_number, 'error': str(e)[:200]})
+
+        batch_full = line_number - job.lines_processed >= BATCH_SIZE
+        if (batch_full or not line) and line_number > job.lines_processed:
+            with transaction.atomic():
+                imported, duplicates = write_batch(job, conversation, parsed, participants)
+                job.lines_processed = line_number
+                job.bytes_processed = bytes_processed
+                job.messages_imported += imported
+                job.rows_skipped += skipped + duplicates
+                job.errors = (job.errors + pending_errors)[:MAX_ERRORS]
+                job.save(update_fields=[
+                    'lines_processed', 'bytes_processed', 'messages_imported', 'rows_skipped', 'errors', 'updated_at',
+                ])
+            parsed, pending_errors, skipped = [], [], 0
+        if not line:
+            break
+
+    job.status = 'completed'
+    job.save(update_fields=['status', 'updated_at'])
+    ImportedMessage.objects.filter(job=job).delete()
+    inbox.refresh_entries(conversation.id)
+    return job
@@ -0,0 +1,271 @@
+"""
+Materialized per-user conversation list.
+
+Every participant owns one InboxEntry per conversation. The functions here
+are called from the places that create, read, edit or delete messages so the
+entries never need to be rebuilt from the messages table on read.
+
+Each user and conversation also has a version counter in the cache. Any
+change visible in a user's conversation list or a conversation's history
+bumps it, which lets the list views answer conditional GETs without
+touching the database. Presence is left out: it changes on every connect
+and clients get it over the WebSocket and ``presence:user:*`` anyway.
+"""
+import time
+
+from django.core.cache import cache
+from django.db.models import Case, Count, Exists, F, OuterRef, Value, When
+from django.utils import timezone
+
+from accounts.models import BlockedUser
+
+from .models import Conversation, InboxEntry, Message
+
+PREVIEW_LENGTH = 100
+VERSION_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def _user_version_key(user_id):
+    return f"inbox:version:user:{user_id}"
+
+
+def _conversation_version_key(conversation_id):
+    return f"inbox:version:conversation:{conversation_id}"
+
+
+def _bump(keys):
+    keys = set(keys)
+    if keys:
+        # A fresh value from the clock differs from any old one, so all keys
+        # are written in one set_many (a single pipeline on Redis)
+        version = time.time_ns()
+        cache.set_many({key: version for key in keys}, VERSION_TIMEOUT)
+
+
+def get_versions(user_id, conversation_id=None):
+    """Return the version tokens for a user's inbox (and optionally a conversation)."""
+    keys = [_user_version_key(user_id)]
+    if conversation_id is not None:
+        keys.append(_conversation_version_key(conversation_id))
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), VERSION_TIMEOUT)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def touch_users(user_ids):
+    _bump(_user_version_key(user_id) for user_id in user_ids)
+
+
+def touch(conversation_id, user_ids=None):
+    """Invalidate a conversation and the inboxes of everyone in it."""
+    if user_ids is None:
+        user_ids = Conversation.participants.through.objects.filter(
+            conversation_id=conversation_id
+        ).values_list('user_id', flat=True)
+    _bump([_conversation_version_key(conversation_id), *(_user_version_key(user_id) for user_id in user_ids)])
+
+
+def touch_many(conversation_ids):
+    """touch() for several conversations with a single participant lookup."""
+    user_ids = Conversation.participants.through.objects.filter(
+        conversation_id__in=conversation_ids
+    ).values_list('user_id', flat=True)
+    _bump([
+        *(_conversation_version_key(conversation_id) for conversation_id in conversation_ids),
+        *(_user_version_key(user_id) for user_id in user_ids),
+    ])
+
+
+def touch_profile(user_id):
+    """
+    Invalidate everything that embeds ``user_id``'s profile: the
+    conversations they are in and the inboxes of everyone in those.
+    """
+    touch_many(list(Conversation.participants.through.objects.filter(
+        user_id=user_id
+    ).values_list('conversation_id', flat=True)))
+
+
+def message_preview(message):
+    if message is None or message.deleted_at:
+        return ''
+    if message.text:
+        return message.text[:PREVIEW_LENGTH]
+    return message.file_name or message.get_message_type_display()
+
+
+def _other_user_id(participant_ids, user_id):
+    if len(participant_ids) != 2:
+        return None
+    return next((pid for pid in participant_ids if pid != user_id), None)
+
+
+def ensure_entries(conversation):
+    """Create missing rows for every participant of ``conversation``."""
+    participant_ids = list(conversation.participants.values_list('id', flat=True))
+    existing = set(
+        InboxEntry.objects.filter(conversation=conversation).values_list('user_id', flat=True)
+    )
+    missing = [
+        InboxEntry(
+            user_id=user_id,
+            conversation=conversation,
+            other_user_id=_other_user_id(participant_ids, user_id),
+            last_activity_at=conversation.created_at,
+            is_deleted=conversation.is_deleted,
+        )
+        for user_id in participant_ids
+        if user_id not in existing
+    ]
+    if missing:
+        InboxEntry.objects.bulk_create(missing, ignore_conflicts=True)
+
+
+def record_message(message, hidden_from=()):
+    """
+    Advance the entries of ``message.conversation`` to a newly sent message.
+
+    ``hidden_from`` lists users who must not see the message yet (they have
+    blocked the sender); their rows are left alone until unblock.
+    """
+    ensure_entries(message.conversation)
+    fields = {
+        'last_message': message,
+        'last_message_preview': message_preview(message),
+        'last_activity_at': message.timestamp,
+    }
+    entries = InboxEntry.objects.filter(conversation_id=message.conversation_id).exclude(user_id__in=hidden_from)
+    entries.filter(user_id=message.sender_id).update(**fields)
+    entries.exclude(user_id=message.sender_id).update(unread_count=F('unread_count') + 1, **fields)
+    touch(message.conversation_id)
+
+
+def message_changed(message):
+    """Refresh the preview of rows whose last message was edited."""
+    InboxEntry.objects.filter(last_message=message).update(last_message_preview=message_preview(message))
+    touch(message.conversation_id)
+
+
+def message_read(user, message):
+    if message.sender_id == user.id:
+        return
+    InboxEntry.objects.filter(
+        user=user, conversation_id=message.conversation_id, unread_count__gt=0
+    ).update(unread_count=F('unread_count') - 1)
+    touch(message.conversation_id)
+
+
+def mark_read(user, conversation_id):
+    InboxEntry.objects.filter(user=user, conversation_id=conversation_id).update(unread_count=0)
+    touch(conversation_id)
+
+
+def recount_unread(user, conversation_ids):
+    """Recompute ``user``'s unread counters for several conversations in two queries."""
+    blocked_senders = BlockedUser.objects.filter(blocker=user).values_list('blocked', flat=True)
+    counts = hide_cleared(Message.objects.filter(
+        conversation_id__in=conversation_ids, is_read=False, deleted_at__isnull=True,
+    ).exclude(sender=user).exclude(
+        sender__in=blocked_senders, is_delivered=False,
+    ), user).order_by().values('conversation_id').annotate(unread=Count('id')).values_list('conversation_id', 'unread')
+    InboxEntry.objects.filter(user=user, conversation_id__in=conversation_ids).update(unread_count=Case(
+        *[When(conversation_id=conversation_id, then=Value(unread)) for conversation_id, unread in counts],
+        default=Value(0),
+    ))
+    touch_many(conversation_ids)
+
+
+def set_deleted(conversation_ids, is_deleted):
+    InboxEntry.objects.filter(conversation_id__in=conversation_ids).update(is_deleted=is_deleted)
+    for conversation_id in conversation_ids:
+        touch(conversation_id)
+
+
+def cleared_before(user_id, conversation_id):
+    """The user's "clear chat" watermark for a conversation, or None."""
+    return InboxEntry.objects.filter(
+        user_id=user_id, conversation_id=conversation_id
+    ).values_list('cleared_before', flat=True).first()
+
+
+def hide_cleared(queryset, user):
+    """
+    Drop messages ``user`` has cleared, for querysets spanning conversations.
+
+    Single-conversation queries should filter on cleared_before() instead so
+    the (conversation, timestamp) index can stop at the watermark.
+    """
+    return queryset.exclude(Exists(InboxEntry.objects.filter(
+        user=user,
+        conversation_id=OuterRef('conversation_id'),
+        cleared_before__gte=OuterRef('timestamp'),
+    )))
+
+
+def hide_expired(queryset):
+    """Drop disappearing messages that are due but not purged yet (see chat.expiry)."""
+    return queryset.exclude(expires_at__lte=timezone.now())
+
+
+def clear(user, conversation_id):
+    """Hide everything sent so far from ``user`` only; a single-row write."""
+    fields = {
+        'cleared_before': timezone.now(),
+        'last_message': None,
+        'last_message_preview': '',
+        'unread_count': 0,
+    }
+    entries = InboxEntry.objects.filter(user=user, conversation_id=conversation_id)
+    if not entries.update(**fields):
+        ensure_entries(Conversation.objects.get(id=conversation_id))
+        entries.update(**fields)
+    touch(conversation_id, user_ids=[user.id])
+
+
+def visible_messages(user, conversation_id):
+    """Messages of a conversation as ``user`` is allowed to see them."""
+    blocked_senders = BlockedUser.objects.filter(blocker=user).values_list('blocked', flat=True)
+    messages = hide_expired(Message.objects.filter(conversation_id=conversation_id).exclude(
+        sender__in=blocked_senders,
+        is_delivered=False,
+    ))
+    watermark = cleared_before(user.id, conversation_id)
+    if watermark is not None:
+        messages = messages.filter(timestamp__gt=watermark)
+    return messages
+
+
+def refresh_entries(conversation_id, user_ids=None):
+    """
+    Recompute entries from the messages table.
+
+    Used after bulk changes (clear, restore, unblock, deletes) where the
+    incremental updates above cannot tell what the new state is.
+    """
+    try:
+        conversation = Conversation.objects.get(id=conversation_id)
+    except Conversation.DoesNotExist:
+        return
+    ensure_entries(conversation)
+
+    entries = InboxEntry.objects.filter(conversation=conversation).select_related('user')
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+
+    for entry in entries:
+        messages = visible_messages(entry.user, conversation.id)
+        last_message = messages.order_by('-timestamp', '-id').first()
+        entry.last_message = last_message
+        entry.last_message_preview = message_preview(last_message)
+        entry.last_activity_at = last_message.timestamp if last_message else (entry.cleared_before or conversation.created_at)
+        entry.unread_count = messages.exclude(sender=entry.user).filter(
+            is_read=False, deleted_at__isnull=True
+        ).count()
+        entry.is_deleted = conversation.is_deleted
+        entry.save(update_fields=[
+            'last_message', 'last_message_preview', 'last_activity_at', 'unread_count', 'is_deleted',
+        ])
+    touch(conversation.id)
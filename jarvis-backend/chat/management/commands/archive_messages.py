@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from chat import archive
+
+
+class Command(BaseCommand):
+    help = "Move messages older than MESSAGE_ARCHIVE_AFTER_DAYS to the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=archive.MAX_BATCHES)
+
+    def handle(self, *args, **options):
+        moved = archive.archive(batch_size=options['batch_size'], max_batches=options['max_batches'])
+        self.stdout.write(f"Archived {moved} messages")
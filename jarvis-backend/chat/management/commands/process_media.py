@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from chat import media_processing
+
+
+class Command(BaseCommand):
+    help = "Process pending message media in batches on a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=media_processing.BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=None, help='Pool size (defaults to the number of cores)')
+        parser.add_argument('--once', action='store_true', help='Exit when nothing is pending')
+
+    def handle(self, *args, **options):
+        processed = media_processing.run(
+            batch_size=options['batch_size'], workers=options['workers'], once=options['once'],
+        )
+        self.stdout.write(f"Processed {processed} media messages")
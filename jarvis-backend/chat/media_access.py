@@ -0,0 +1,140 @@
+"""
+Who may fetch a stored media file, and how it is served.
+
+Chat media (uploads, content-addressed blobs and their derivatives) is
+only served to participants of a conversation containing the message, and
+not once the message is deleted. Requests are identified by the usual API
+authentication, or by a signature in the URL so plain ``<Image>`` tags and
+external viewers work: URLs in message payloads are signed for the viewer
+(``signed_url`` / ``sign_message``). Signatures are bucketed by day so a
+viewer gets the same URL all day and HTTP caches keep working; membership
+is still checked on every request. Signatures cover the storage name as
+stored (unquoted), which is also what the view sees once the request path
+is decoded.
+
+Everything else under MEDIA_ROOT (profile pictures) is public.
+"""
+import os
+import re
+import time
+from urllib.parse import unquote, urlencode
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .models import Message
+
+PROTECTED_PREFIXES = ('chat_files/', 'blobs/', 'derivatives/', 'uploads/')
+# Names derived from the file's content hash never change meaning
+IMMUTABLE = re.compile(r'^(blobs|derivatives/[0-9a-f]{2}/[0-9a-f]{2}|avatars)/')
+SIGNATURE_DAYS = 7
+
+_DERIVATIVE = re.compile(r'^derivatives/[0-9a-f]{2}/[0-9a-f]{2}/(?P<sha>[0-9a-f]{64})_')
+_LEGACY_DERIVATIVE = re.compile(r'^derivatives/legacy/(?P<id>\d+)_')
+
+
+def is_protected(name):
+    return name.startswith(PROTECTED_PREFIXES)
+
+
+def is_immutable(name):
+    return bool(IMMUTABLE.match(name))
+
+
+def _signature(name, user_id, expires):
+    return salted_hmac('chat.media_access', f"{name}:{user_id}:{expires}").hexdigest()[:32]
+
+
+def sign(name, user_id, now=None):
+    """Query string granting ``user_id`` access to storage name ``name`` for at least six days."""
+    day = int((now or time.time()) // 86400)
+    expires = (day + SIGNATURE_DAYS) * 86400
+    return urlencode({'u': user_id, 'e': expires, 's': _signature(name, user_id, expires)})
+
+
+def verify(name, params):
+    """The user id a signed URL was issued to, or None."""
+    try:
+        user_id, expires = int(params.get('u', '')), int(params.get('e', ''))
+    except ValueError:
+        return None
+    if expires < time.time():
+        return None
+    if not constant_time_compare(params.get('s', ''), _signature(name, user_id, expires)):
+        return None
+    return user_id
+
+
+def signed_url(url, user_id):
+    """Sign a MEDIA_URL link for ``user_id``; other URLs are returned unchanged."""
+    if not url or not url.startswith(settings.MEDIA_URL):
+        return url
+    path = url[len(settings.MEDIA_URL):].split('?', 1)[0]
+    name = unquote(path)
+    if not is_protected(name):
+        return url
+    return f"{settings.MEDIA_URL}{path}?{sign(name, user_id)}"
+
+
+def sign_message(data, user_id):
+    """A copy of a serialized message with its media URLs signed for ``user_id``."""
+    if not data.get('file') and not data.get('previews'):
+        return data
+    data = dict(data)
+    data['file'] = signed_url(data.get('file'), user_id)
+    if data.get('previews'):
+        data['previews'] = {
+            size: {**preview, 'url': signed_url(preview['url'], user_id)}
+            for size, preview in data['previews'].items()
+        }
+    return data
+
+
+def can_access(user_id, name):
+    """Whether ``user_id`` is in a conversation with a live message using ``name``."""
+    if not is_protected(name):
+        return True
+    if user_id is None:
+        return False
+    messages = Message.objects.filter(conversation__participants=user_id, deleted_at__isnull=True)
+    match = _DERIVATIVE.match(name)
+    if match:
+        return messages.filter(blob__sha256=match['sha']).exists()
+    match = _LEGACY_DERIVATIVE.match(name)
+    if match:
+        return messages.filter(id=int(match['id'])).exists()
+    return messages.filter(file=name).exists()
+
+
+def etag(name, stat):
+    if is_immutable(name):
+        return f'"{os.path.splitext(os.path.basename(name))[0]}"'
+    return f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+
+
+def cache_control(name):
+    scope = 'private' if is_protected(name) else 'public'
+    if is_immutable(name):
+        return f"{scope}, max-age=31536000, immutable"
+    return f"{scope}, max-age=3600"
+
+
+def parse_range(header, size):
+    """
+    ``(start, end_inclusive)`` for a single ``bytes=`` range, None to serve
+    the whole file, or ValueError when the range can't be satisfied.
+    """
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, end
@@ -0,0 +1,177 @@
+"""
+Inspecting uploaded media and building its derivatives.
+
+``describe`` does the CPU-bound work for one file without touching the
+database, so it can run in a child process. It returns None for a file that
+can't be read, and only that message is marked failed. ``save_results`` writes any
+number of results back with one bulk_update. The single-message Celery task
+and the batch worker (``manage.py process_media``) both use them.
+
+The batch worker claims pending messages in batches and decodes them in
+parallel on a process pool with one process per core. Celery's prefork
+children are daemonic and can't start a pool of their own, which is why
+it runs as its own process.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F
+from PIL import Image
+
+from . import derivatives, inbox, storage_usage, waveform
+from .models import MediaBlob, Message
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 32
+POLL_INTERVAL = 2
+
+
+def describe(path, file_type, display_name, prefix):
+    """
+    Metadata for the stored file at ``path``: image size and derivatives
+    (stored under ``prefix``), or the waveform and duration of audio. None
+    if the file is missing or unreadable.
+    """
+    try:
+        size = default_storage.size(path)
+    except Exception as exc:
+        logger.warning("Unable to read media %s: %s", path, exc)
+        return None
+    metadata = {
+        "name": display_name,
+        "size": size,
+        "content_type": file_type or "",
+    }
+    try:
+        # Judged from the bytes; the declared file_type is the client's word
+        audio = waveform.detect(path)
+    except Exception as exc:
+        logger.warning("Unable to inspect media %s: %s", path, exc)
+        audio = None
+    if audio:
+        try:
+            metadata.update(waveform.describe(path, audio))
+        except Exception as exc:
+            # Without ffmpeg, or on a file it can't decode, the note just has no waveform
+            logger.warning("Unable to build waveform for %s: %s", path, exc)
+        return metadata
+
+    try:
+        with default_storage.open(path, 'rb') as file:
+            try:
+                with Image.open(file) as image:
+                    metadata["width"] = image.width
+                    metadata["height"] = image.height
+                    metadata["format"] = image.format
+                    try:
+                        metadata.update(derivatives.generate(image, prefix))
+                    except Exception as exc:
+                        logger.warning("Unable to build previews for %s: %s", path, exc)
+            except Exception:
+                pass
+    except Exception as exc:
+        logger.warning("Unable to inspect media %s: %s", path, exc)
+    return metadata
+
+
+def job(message):
+    """Arguments to ``describe`` for one message."""
+    return (
+        message.file.name,
+        message.file_type,
+        message.file_name or message.file.name.rsplit('/', 1)[-1],
+        derivatives.base_name(message),
+    )
+
+
+def set_state(messages, state):
+    """
+    Move ``messages`` to processing ``state``. The version bump makes cached
+    renders and list ETags change with it.
+    """
+    Message.objects.filter(id__in=[message.id for message in messages]).update(
+        media_processing_state=state, version=F('version') + 1,
+    )
+    inbox.touch_many({message.conversation_id for message in messages})
+
+
+def save_results(messages, results):
+    """Mark ``messages`` ready with their ``results``, or failed where a result is None, in one UPDATE."""
+    blobs = {}
+    for message, metadata in zip(messages, results):
+        if metadata is None:
+            message.media_processing_state = 'failed'
+            message.version = F('version') + 1
+            continue
+        message.media_metadata = metadata
+        message.media_processing_state = 'ready'
+        # bulk_update skips Message.save, so bump the render cache version here
+        message.version = F('version') + 1
+        if message.blob_id:
+            # Later copies of the same bytes reuse this instead of being processed
+            blobs[message.blob_id] = MediaBlob(
+                id=message.blob_id,
+                metadata={key: value for key, value in metadata.items() if key != 'name'},
+            )
+    with transaction.atomic():
+        Message.objects.bulk_update(messages, ['media_metadata', 'media_processing_state', 'version'])
+        MediaBlob.objects.bulk_update(list(blobs.values()), ['metadata'])
+        storage_usage.add(Message.objects.filter(id__in=[message.id for message in messages]))
+    inbox.touch_many({message.conversation_id for message in messages})
+
+
+def claim(batch_size=BATCH_SIZE):
+    """Switch up to ``batch_size`` pending messages to processing and return them."""
+    with transaction.atomic():
+        pending = Message.objects.filter(media_processing_state='pending').order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        ids = list(pending.values_list('id', flat=True)[:batch_size])
+        Message.objects.filter(id__in=ids).update(media_processing_state='processing', version=F('version') + 1)
+    messages = list(Message.objects.filter(id__in=ids).select_related('blob').order_by('id'))
+    inbox.touch_many({message.conversation_id for message in messages})
+    return messages
+
+
+def process_batch(pool, batch_size=BATCH_SIZE):
+    """Process one claimed batch on ``pool``; returns how many messages it held."""
+    messages = claim(batch_size)
+    empty = [message for message in messages if not message.file]
+    files = [message for message in messages if message.file]
+    try:
+        results = list(pool.map(describe, *zip(*map(job, files)))) if files else []
+    except Exception:
+        # A crashed pool process; don't leave the batch stuck in processing
+        set_state(files, 'failed')
+        raise
+    save_results(empty + files, [{} for _ in empty] + results)
+    return len(messages)
+
+
+def run(batch_size=BATCH_SIZE, workers=None, once=False):
+    """Process pending media until stopped (or until none is left with ``once``)."""
+    workers = workers or getattr(settings, 'MEDIA_WORKER_PROCESSES', None) or os.cpu_count()
+    processed = 0
+    while True:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+                while True:
+                    count = process_batch(pool, batch_size)
+                    processed += count
+                    if count:
+                        logger.info("Processed %s media messages", count)
+                    elif once:
+                        return processed
+                    else:
+                        time.sleep(POLL_INTERVAL)
+        except BrokenProcessPool:
+            # That batch was marked failed; carry on with a fresh pool
+            logger.exception("Media worker pool crashed; restarting it")
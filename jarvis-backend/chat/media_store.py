@@ -0,0 +1,177 @@
+"""
+Content-addressed storage for message media.
+
+Files are stored once per SHA-256 under ``blobs/<aa>/<bb>/<digest><ext>``
+and shared by every message with the same bytes, so a forwarded or
+re-uploaded file is neither written nor processed again. Each MediaBlob
+counts the messages using it; ``release`` deletes the file once nothing
+refers to it. Files are only deleted once the transaction dropping their
+rows commits, so a rollback never leaves rows pointing at missing files.
+
+Multipart uploads are hashed by HashingUploadHandler while Django reads
+the request body. Other files are hashed in one pass before being written.
+"""
+import hashlib
+import os
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from . import derivatives
+from .models import MediaBlob, Message
+
+READ_SIZE = 64 * 1024
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Passes upload chunks through unchanged, recording each file's SHA-256.
+
+    Insert it first in ``request.upload_handlers`` before the body is parsed;
+    digests are then available per form field in ``digests``.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+        self._hash = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self._hash.hexdigest()
+        return None
+
+
+def hash_file(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(READ_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def blob_name(digest, file_name):
+    ext = os.path.splitext(file_name or '')[1].lower()[:10]
+    return f"blobs/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def store(file, content_type='', digest=None):
+    """
+    Return the MediaBlob for ``file``'s bytes with one reference taken.
+
+    The caller attaches the blob to a message, or calls ``release`` if it
+    doesn't. Bytes are only written when no blob has them yet.
+    """
+    digest = digest or hash_file(file)
+    if MediaBlob.objects.filter(sha256=digest).update(ref_count=F('ref_count') + 1):
+        return MediaBlob.objects.get(sha256=digest)
+
+    file.seek(0)
+    name = default_storage.save(blob_name(digest, getattr(file, 'name', '')), file)
+    try:
+        with transaction.atomic():
+            return MediaBlob.objects.create(
+                sha256=digest,
+                file=name,
+                size=default_storage.size(name),
+                content_type=content_type or '',
+                ref_count=1,
+            )
+    except IntegrityError:
+        # A concurrent upload of the same bytes created the blob first
+        default_storage.delete(name)
+        MediaBlob.objects.filter(sha256=digest).update(ref_count=F('ref_count') + 1)
+        return MediaBlob.objects.get(sha256=digest)
+
+
+def _delete_files(names, metadata):
+    """Delete stored files ``names`` and the derivatives in ``metadata`` after commit."""
+    def delete():
+        for name in names:
+            default_storage.delete(name)
+        for item in metadata:
+            derivatives.delete(item)
+    if names:
+        transaction.on_commit(delete)
+
+
+def release(blob_ids):
+    """
+    Drop one reference per id in ``blob_ids``; delete blobs nobody uses.
+
+    Returns ``(files, bytes)`` deleted, or to be deleted once the caller's
+    transaction commits.
+    """
+    counts = Counter(blob_id for blob_id in blob_ids if blob_id is not None)
+    for blob_id, count in counts.items():
+        MediaBlob.objects.filter(id=blob_id).update(ref_count=F('ref_count') - count)
+    removed = []
+    for blob in MediaBlob.objects.filter(id__in=counts, ref_count=0):
+        # Conditional delete so a blob picked up again in the meantime survives
+        if MediaBlob.objects.filter(id=blob.id, ref_count=0).delete()[0]:
+            removed.append(blob)
+    _delete_files([blob.file.name for blob in removed], [blob.metadata for blob in removed])
+    return len(removed), sum(blob.size for blob in removed)
+
+
+def delete_legacy_files(rows, removed_ids):
+    """
+    Delete files stored before dedup, given as ``(name, media_metadata)``,
+    unless a message outside ``removed_ids`` still uses them (forwarded
+    copies share the file). Returns ``(files, bytes)``, deleted after commit
+    like ``release``.
+    """
+    unused = [
+        (name, metadata) for name, metadata in rows
+        if not Message.objects.filter(file=name).exclude(id__in=removed_ids).exists()
+    ]
+    _delete_files([name for name, _ in unused], [metadata for _, metadata in unused])
+    return len(unused), sum((metadata or {}).get('size') or 0 for _, metadata in unused)
+
+
+def release_messages(queryset):
+    """Release the blobs of messages that are about to be hard-deleted."""
+    return release(queryset.filter(blob__isnull=False).values_list('blob_id', flat=True).iterator())
+
+
+def reconcile():
+    """Reset every ``ref_count`` from the messages table; returns how many were off."""
+    fixed = 0
+    actual = Counter(Message.objects.filter(blob__isnull=False).values_list('blob_id', flat=True).iterator())
+    for blob_id, ref_count in MediaBlob.objects.values_list('id', 'ref_count').iterator():
+        if actual.get(blob_id, 0) != ref_count:
+            MediaBlob.objects.filter(id=blob_id).update(ref_count=actual.get(blob_id, 0))
+            fixed += 1
+    return fixed
+
+
+def dedup_stats():
+    """
+    Bytes stored versus bytes referenced by messages.
+
+    ``ratio`` is referenced / stored: 2.0 means each stored byte is used by
+    two messages on average.
+    """
+    totals = MediaBlob.objects.aggregate(stored=Sum('size'), blobs=Count('id'), references=Sum('ref_count'))
+    referenced = MediaBlob.objects.aggregate(total=Sum(F('size') * F('ref_count')))['total'] or 0
+    stored = totals['stored'] or 0
+    return {
+        'blobs': totals['blobs'] or 0,
+        'references': totals['references'] or 0,
+        'stored_bytes': stored,
+        'referenced_bytes': referenced,
+        'saved_bytes': referenced - stored,
+        'ratio': referenced / stored if stored else 1.0,
+        'legacy_files': Message.objects.filter(blob__isnull=True).exclude(file='').exclude(file__isnull=True).count(),
+    }
@@ -0,0 +1,87 @@
+# Generated by Django 6.0.2 on 2026-10-19 01:16
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+PREVIEW_LENGTH = 100
+
+
+def preview(message):
+    # Mirrors inbox.message_preview at the time of this migration
+    if message is None or message.deleted_at:
+        return ''
+    if message.text:
+        return message.text[:PREVIEW_LENGTH]
+    return message.file_name or message.get_message_type_display()
+
+
+def backfill_inbox(apps, schema_editor):
+    BlockedUser = apps.get_model('accounts', 'BlockedUser')
+    Conversation = apps.get_model('chat', 'Conversation')
+    InboxEntry = apps.get_model('chat', 'InboxEntry')
+    Message = apps.get_model('chat', 'Message')
+
+    blocked = defaultdict(set)
+    for blocker_id, blocked_id in BlockedUser.objects.values_list('blocker_id', 'blocked_id').iterator():
+        blocked[blocker_id].add(blocked_id)
+
+    for conversation in Conversation.objects.prefetch_related('participants').iterator(chunk_size=500):
+        participant_ids = [p.id for p in conversation.participants.all()]
+        entries = []
+        for user_id in participant_ids:
+            # What inbox.visible_messages shows: undelivered messages from blocked senders stay hidden
+            messages = Message.objects.filter(conversation=conversation).exclude(
+                sender_id__in=blocked[user_id], is_delivered=False,
+            )
+            last_message = messages.order_by('-timestamp', '-id').first()
+            other_user_id = None
+            if len(participant_ids) == 2:
+                other_user_id = next(pid for pid in participant_ids if pid != user_id)
+            entries.append(InboxEntry(
+                user_id=user_id,
+                conversation=conversation,
+                other_user_id=other_user_id,
+                last_message=last_message,
+                last_message_preview=preview(last_message),
+                last_activity_at=last_message.timestamp if last_message else conversation.created_at,
+                unread_count=messages.filter(
+                    is_read=False, deleted_at__isnull=True
+                ).exclude(sender_id=user_id).count(),
+                is_deleted=conversation.is_deleted,
+            ))
+        InboxEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('chat', '0004_alter_message_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_preview', models.CharField(blank=True, default='', max_length=255)),
+                ('last_activity_at', models.DateTimeField()),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='chat.conversation')),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message')),
+                ('other_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'is_deleted', 'last_activity_at'], name='chat_inboxe_user_id_4612d2_idx')],
+                'unique_together': {('user', 'conversation')},
+            },
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
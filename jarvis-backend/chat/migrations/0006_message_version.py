@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-19 01:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_inboxentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
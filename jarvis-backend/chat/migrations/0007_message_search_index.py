@@ -0,0 +1,24 @@
+# Generated by Django 6.0.2 on 2026-10-19 02:05
+
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from chat import search
+    search.install(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    from chat import search
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
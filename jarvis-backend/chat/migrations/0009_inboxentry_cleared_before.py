@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-19 03:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboxentry',
+            name='cleared_before',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
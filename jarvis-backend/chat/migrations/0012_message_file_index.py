@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-19 14:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_mediablob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('file__gt', '')), fields=['file'], name='chat_message_file_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.2 on 2026-10-19 15:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_message_file_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('media_type', models.CharField(max_length=20)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('conversation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='storage_usage', to='chat.conversation')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='storage_usage', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('conversation__isnull', True)), fields=('user', 'media_type'), name='chat_storage_usage_user_uniq'), models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('conversation', 'media_type'), name='chat_storage_usage_conversation_uniq')],
+            },
+        ),
+    ]
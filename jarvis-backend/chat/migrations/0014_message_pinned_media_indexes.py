@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-19 16:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_storageusage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True), ('is_pinned', True)), fields=['conversation', 'timestamp'], name='chat_message_pinned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(models.Q(('message_type', 'text'), _negated=True), ('deleted_at__isnull', True)), fields=['conversation', 'timestamp'], name='chat_message_media_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 6.0.2 on 2026-10-19 17:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_archive_table(apps, schema_editor):
+    from chat import archive
+    archive.create_table(schema_editor, apps.get_model('chat', 'ArchivedMessage'))
+
+
+def drop_archive_table(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model('chat', 'ArchivedMessage'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_message_expires_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # The table is created by chat.archive so it can be partitioned on PostgreSQL
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.CreateModel(
+                name='ArchivedMessage',
+                fields=[
+                    ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                    ('timestamp', models.DateTimeField()),
+                    ('month', models.DateField()),
+                    ('payload', models.BinaryField()),
+                    ('archived_at', models.DateTimeField(auto_now_add=True)),
+                    ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='chat.conversation')),
+                    ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ],
+                options={
+                    'indexes': [models.Index(fields=['conversation', 'timestamp', 'id'], name='chat_archive_history_idx'), models.Index(fields=['sender'], name='chat_archive_sender_idx')],
+                },
+            ),
+        ]),
+        migrations.RunPython(create_archive_table, drop_archive_table),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:15
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def start_grace_periods(apps, schema_editor):
+    # Conversations deleted before deleted_at existed get the full grace period from now
+    Conversation = apps.get_model('chat', 'Conversation')
+    Conversation.objects.filter(is_deleted=True, deleted_at__isnull=True).update(deleted_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_archived_message'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurgeRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff', models.DateTimeField()),
+                ('phase', models.CharField(choices=[('messages', 'Messages'), ('conversations', 'Conversations'), ('done', 'Done')], default='messages', max_length=20)),
+                ('last_deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('messages_purged', models.PositiveIntegerField(default=0)),
+                ('conversations_purged', models.PositiveIntegerField(default=0)),
+                ('files_deleted', models.PositiveIntegerField(default=0)),
+                ('bytes_freed', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at', 'id'], name='chat_message_deleted_idx'),
+        ),
+        migrations.RunPython(start_grace_periods, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,16 @@
+import json
+import uuid
+import zlib
+
 from django.db import models
 from django.conf import settings
+from django.utils.functional import cached_property
 
 class Conversation(models.Model):
     participants = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='conversations')
     is_deleted = models.BooleanField(default=False)
+    # When is_deleted was set; the purge (chat.purge) removes it after a grace period
+    deleted_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -30,6 +37,8 @@ class Message(models.Model):
     message_type = models.CharField(max_length=20, choices=MESSAGE_TYPES, default='text')
     
     file = models.FileField(upload_to='chat_files/', null=True, blank=True)
+    # Content-addressed copy of ``file``; null for files stored before dedup
+    blob = models.ForeignKey('MediaBlob', null=True, blank=True, related_name='messages', on_delete=models.SET_NULL)
     file_type = models.CharField(max_length=50, null=True, blank=True)
     file_name = models.CharField(max_length=255, null=True, blank=True)
     media_processing_state = models.CharField(
@@ -58,6 +67,10 @@ class Message(models.Model):
     reply_to = models.ForeignKey('self', null=True, blank=True, related_name='replies', on_delete=models.SET_NULL)
     deleted_at = models.DateTimeField(null=True, blank=True)
     is_pinned = models.BooleanField(default=False)
+    # Set from the sender's disappearing messages timer (see chat.expiry)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    # Bumped on every change to the rendered message (see chat.render_cache)
+    version = models.PositiveIntegerField(default=1)
 
     class Meta:
         indexes = [
@@ -66,12 +79,61 @@ class Message(models.Model):
             models.Index(fields=['conversation', 'deleted_at', 'timestamp']),
             models.Index(fields=['sender', 'timestamp']),
             models.Index(fields=['message_type']),
+            # Media requests are authorized by file name (see chat.media_access)
+            models.Index(fields=['file'], name='chat_message_file_idx', condition=models.Q(file__gt='')),
+            # Pinned and media listings only ever read these rows
+            models.Index(
+                fields=['conversation', 'timestamp'], name='chat_message_pinned_idx',
+                condition=models.Q(is_pinned=True, deleted_at__isnull=True),
+            ),
+            models.Index(
+                fields=['conversation', 'timestamp'], name='chat_message_media_idx',
+                condition=~models.Q(message_type='text') & models.Q(deleted_at__isnull=True),
+            ),
+            # The soft-delete purge only scans tombstones
+            models.Index(
+                fields=['deleted_at', 'id'], name='chat_message_deleted_idx',
+                condition=models.Q(deleted_at__isnull=False),
+            ),
+            # The expiry purge scans live messages due to disappear
+            models.Index(
+                fields=['expires_at'], name='chat_message_expiry_idx',
+                condition=models.Q(expires_at__isnull=False, deleted_at__isnull=True),
+            ),
         ]
         ordering = ['-timestamp']
 
+    def save(self, *args, **kwargs):
+        if self.pk:
+            self.version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'version' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'version']
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.sender.username}: {self.text[:20]}"
 
+class MediaBlob(models.Model):
+    """
+    One stored file, shared by every message with identical bytes.
+
+    Stored under ``blobs/<aa>/<bb>/<sha256><ext>``. ``ref_count`` is the number
+    of messages using the blob; the file is deleted when it reaches zero
+    (see chat.media_store). ``metadata`` caches the processed media metadata
+    so later copies skip processing.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=255)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=50, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    metadata = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
+
 class Reaction(models.Model):
     message = models.ForeignKey(Message, related_name='reactions', on_delete=models.CASCADE)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='reactions', on_delete=models.CASCADE)
@@ -83,3 +145,205 @@ class Reaction(models.Model):
 
     def __str__(self):
         return f"{self.user.username} reacted {self.emoji} to {self.message.id}"
+
+
+class InboxEntry(models.Model):
+    """
+    One row per (user, conversation) holding what the conversation list shows.
+
+    Kept current by the message write path through chat.inbox so the list
+    endpoint reads a single indexed range instead of aggregating messages.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='inbox_entries', on_delete=models.CASCADE)
+    conversation = models.ForeignKey(Conversation, related_name='inbox_entries', on_delete=models.CASCADE)
+    other_user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+    last_message = models.ForeignKey(Message, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+    last_message_preview = models.CharField(max_length=255, blank=True, default='')
+    last_activity_at = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
+    is_deleted = models.BooleanField(default=False)
+    # Messages at or before this time are hidden from this user only ("clear chat")
+    cleared_before = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('user', 'conversation')
+        indexes = [
+            models.Index(fields=['user', 'is_deleted', 'last_activity_at']),
+        ]
+
+    def __str__(self):
+        return f"Inbox {self.user_id}:{self.conversation_id}"
+
+
+class ImportJob(models.Model):
+    """
+    A streamed NDJSON restore into one conversation.
+
+    Each batch commits together with the counters below, so an interrupted
+    upload can be sent again and resumes after the last committed line.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='chat_imports', on_delete=models.CASCADE)
+    conversation = models.ForeignKey(Conversation, null=True, blank=True, related_name='imports', on_delete=models.SET_NULL)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    bytes_total = models.BigIntegerField(null=True, blank=True)
+    bytes_processed = models.BigIntegerField(default=0)
+    lines_processed = models.PositiveIntegerField(default=0)
+    messages_imported = models.PositiveIntegerField(default=0)
+    rows_skipped = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Import {self.id} ({self.status})"
+
+
+class ImportedMessage(models.Model):
+    """Maps a message id from the backup to the row it was restored as, for reply links."""
+    job = models.ForeignKey(ImportJob, related_name='imported_messages', on_delete=models.CASCADE)
+    source_id = models.BigIntegerField()
+    message = models.ForeignKey(Message, related_name='+', on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('job', 'source_id')
+
+
+class UploadSession(models.Model):
+    """
+    A resumable media upload.
+
+    Chunks are stored as separate parts named by their offset; ``received``
+    only advances once a part is fully stored, so it is always a safe offset
+    to resume from. Committing assembles the parts into the message file.
+    """
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('committing', 'Committing'),
+        ('committed', 'Committed'),
+        ('expired', 'Expired'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='upload_sessions', on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=50)
+    total_size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    message = models.ForeignKey(Message, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.received}/{self.total_size})"
+
+
+class StorageUsage(models.Model):
+    """
+    Bytes and files of processed media by message type, counted either for
+    the sender (``conversation`` null) or for a conversation (``user`` null).
+
+    Adjusted as media is processed and messages are deleted (see
+    chat.storage_usage), so usage is read without scanning messages.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, related_name='storage_usage', on_delete=models.CASCADE)
+    conversation = models.ForeignKey(Conversation, null=True, blank=True, related_name='storage_usage', on_delete=models.CASCADE)
+    media_type = models.CharField(max_length=20)
+    bytes = models.BigIntegerField(default=0)
+    count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'media_type'], condition=models.Q(conversation__isnull=True),
+                name='chat_storage_usage_user_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['conversation', 'media_type'], condition=models.Q(user__isnull=True),
+                name='chat_storage_usage_conversation_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        owner = f"user {self.user_id}" if self.user_id else f"conversation {self.conversation_id}"
+        return f"{owner} {self.media_type}: {self.bytes} bytes"
+
+
+class ArchivedMessage(models.Model):
+    """
+    A message moved out of ``Message`` once it fell behind the retention
+    horizon (see chat.archive).
+
+    Only what history and export read is kept: the rendered body and the
+    reactions, as zlib-compressed JSON in ``payload``. On PostgreSQL the table
+    is range-partitioned by ``month``, so old months can be detached or moved
+    to cheaper storage as a whole.
+    """
+    # The id the message had in the live table
+    id = models.BigIntegerField(primary_key=True)
+    conversation = models.ForeignKey(Conversation, related_name='archived_messages', on_delete=models.CASCADE)
+    sender = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    timestamp = models.DateTimeField()
+    month = models.DateField()
+    payload = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='chat_archive_history_idx'),
+            models.Index(fields=['sender'], name='chat_archive_sender_idx'),
+        ]
+
+    @cached_property
+    def data(self):
+        return json.loads(zlib.decompress(self.payload))
+
+    @property
+    def body(self):
+        return self.data['body']
+
+    def __str__(self):
+        return f"Archived message {self.id}"
+
+
+class PurgeRun(models.Model):
+    """
+    One pass of the soft-delete purge (see chat.purge) and what it removed.
+
+    The cursor of the current phase is saved with every batch, so a run that
+    was interrupted resumes where it stopped, with the same cutoff.
+    """
+    PHASES = [
+        ('messages', 'Messages'),
+        ('conversations', 'Conversations'),
+        ('done', 'Done'),
+    ]
+
+    cutoff = models.DateTimeField()
+    phase = models.CharField(max_length=20, choices=PHASES, default='messages')
+    # Last row handled in the current phase: (deleted_at, id) for messages, id for conversations
+    last_deleted_at = models.DateTimeField(null=True, blank=True)
+    last_id = models.BigIntegerField(default=0)
+    messages_purged = models.PositiveIntegerField(default=0)
+    conversations_purged = models.PositiveIntegerField(default=0)
+    files_deleted = models.PositiveIntegerField(default=0)
+    bytes_freed = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Purge {self.id} ({self.phase})"
@@ -1,5 +1,13 @@
+import heapq
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.db.models import Q
 from django.utils.dateparse import parse_datetime
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class MessageHistoryPagination(LimitOffsetPagination):
@@ -7,6 +15,163 @@ class MessageHistoryPagination(LimitOffsetPagination):
     max_limit = 100
 
 
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination over (timestamp, id), newest first.
+
+    The cursor is an opaque token holding the boundary row and the paging
+    direction, so a deep page costs the same as the first one and messages
+    sharing a timestamp are never skipped or repeated. No COUNT(*) is issued.
+    Requests that still send ``offset`` are served by MessageHistoryPagination.
+
+    Views with a ``get_archive()`` returning ``(queryset, newest_timestamp)``
+    get archived rows (see chat.archive) merged in, but only for pages that
+    reach back as far as the newest archived row.
+    """
+    page_size = 50
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    invalid_cursor_message = 'Invalid cursor'
+    legacy_pagination_class = MessageHistoryPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.legacy = None
+        if 'offset' in request.query_params:
+            self.legacy = self.legacy_pagination_class()
+            return self.legacy.paginate_queryset(queryset, request, view)
+
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+
+        if self.cursor is None:
+            reverse = False
+            page_qs = queryset.order_by('-timestamp', '-id')
+        else:
+            reverse, timestamp, pk = self.cursor
+            page_qs = keyset_filter(queryset, timestamp, pk, newer=reverse)
+
+        rows = list(page_qs[:self.page_size + 1])
+        archive = getattr(view, 'get_archive', None)
+        archive = archive() if archive is not None else None
+        if archive is not None:
+            rows = self.merge_archive(rows, *archive, reverse)
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.page = rows
+        self.has_next = (has_more and not reverse) or (reverse and bool(rows))
+        # The newest page has nothing newer; paging back up stops once caught up
+        self.has_previous = has_more if reverse else (self.cursor is not None and bool(rows))
+        return rows
+
+    def merge_archive(self, rows, queryset, newest, reverse):
+        """``rows`` with the archived rows that sort into the same page."""
+        if reverse:
+            if self.cursor[1] > newest:
+                return rows
+            archived = keyset_filter(queryset, self.cursor[1], self.cursor[2], newer=True)
+        else:
+            if len(rows) > self.page_size and rows[-1].timestamp > newest:
+                # Even the look-ahead row is newer than anything archived
+                return rows
+            archived = queryset.order_by('-timestamp', '-id')
+            if self.cursor is not None:
+                archived = keyset_filter(queryset, self.cursor[1], self.cursor[2])
+        archived = list(archived.select_related('sender')[:self.page_size + 1])
+        merged = heapq.merge(rows, archived, key=lambda row: (row.timestamp, row.pk), reverse=not reverse)
+        return list(merged)[:self.page_size + 1]
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            reverse = tokens['d'][0] == 'p'
+            timestamp = parse_datetime(tokens['t'][0])
+            pk = int(tokens['i'][0])
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, timestamp, pk
+
+    def encode_cursor(self, message, reverse):
+        querystring = parse.urlencode({
+            'd': 'p' if reverse else 'n',
+            't': message.timestamp.isoformat(),
+            'i': message.pk,
+        })
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        url = remove_query_param(self.base_url, 'before')
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.legacy is not None:
+            return self.legacy.get_next_link()
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if self.legacy is not None:
+            return self.legacy.get_previous_link()
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def keyset_filter(queryset, timestamp, pk, newer=False):
+    """
+    Rows strictly after the (timestamp, pk) boundary in paging order.
+
+    Older pages walk ``-timestamp, -id``; newer pages walk ``timestamp, id``
+    and are reversed by the caller so results always read newest first.
+    """
+    if newer:
+        return queryset.filter(
+            Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk)
+        ).order_by('timestamp', 'id')
+    return queryset.filter(
+        Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk)
+    ).order_by('-timestamp', '-id')
+
+
 def apply_history_cursor(queryset, request):
     before = request.query_params.get('before')
     if not before:
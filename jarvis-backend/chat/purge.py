@@ -0,0 +1,164 @@
+"""
+Hard-deleting what users deleted.
+
+Deleting a message only sets ``deleted_at``, and deleting a conversation only
+sets ``is_deleted``, so both can still be restored. Once
+``settings.PURGE_GRACE_DAYS`` have passed, ``run`` removes the rows for good
+together with their files:
+
+1. tombstoned messages, walked through the partial index on
+   ``(deleted_at, id)``;
+2. deleted conversations with no messages since they were deleted. Each is
+   emptied a batch of messages (then archived messages) at a time before its
+   own row goes.
+
+Each batch is one short transaction followed by a pause
+(``settings.PURGE_BATCH_PAUSE`` seconds), so the purge doesn't hold locks for
+long or crowd out requests. The batch also saves the run's cursor and counters
+to its ``PurgeRun`` row, in the same transaction. An interrupted run therefore
+resumes right after its last committed batch, and the row remains as the
+record of what was removed. Files go only after their batch commits, so a
+rolled back batch still has them.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from . import inbox, media_store, storage_usage
+from .models import ArchivedMessage, Conversation, InboxEntry, Message, PurgeRun
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+LOCK_KEY = 'chat:purge:lock'
+LOCK_TIMEOUT = 60 * 60
+
+
+def cutoff(now=None):
+    """Rows deleted before this are past the grace period."""
+    return (now or timezone.now()) - timedelta(days=getattr(settings, 'PURGE_GRACE_DAYS', 30))
+
+
+def delete_messages(ids):
+    """
+    Hard-delete messages ``ids`` in the caller's transaction; their files are
+    deleted once it commits (see media_store).
+
+    Returns the conversations whose inbox preview pointed at one of them, to
+    refresh once committed, and the number of files and bytes freed.
+    """
+    rows = list(Message.objects.filter(id__in=ids).values_list('blob_id', 'file', 'media_metadata'))
+    # Live messages are still counted
+    storage_usage.subtract(Message.objects.filter(id__in=ids))
+    previews = set(InboxEntry.objects.filter(last_message_id__in=ids).values_list('conversation_id', flat=True))
+    # Replies render a preview of the message they answer
+    Message.objects.filter(reply_to_id__in=ids).update(version=F('version') + 1)
+    Message.objects.filter(id__in=ids).delete()
+
+    blob_files, blob_bytes = media_store.release([blob_id for blob_id, _, _ in rows])
+    legacy_files, legacy_bytes = media_store.delete_legacy_files(
+        [(name, metadata) for blob_id, name, metadata in rows if name and not blob_id], ids,
+    )
+    return previews, blob_files + legacy_files, blob_bytes + legacy_bytes
+
+
+def _delete_messages(purge_run, ids):
+    previews, files, freed = delete_messages(ids)
+    purge_run.messages_purged += len(ids)
+    purge_run.files_deleted += files
+    purge_run.bytes_freed += freed
+    return previews
+
+
+def _purge_messages(purge_run, batch_size):
+    previews = set()
+    with transaction.atomic():
+        tombstones = Message.objects.filter(deleted_at__lt=purge_run.cutoff)
+        if purge_run.last_deleted_at is not None:
+            tombstones = tombstones.filter(
+                Q(deleted_at__gt=purge_run.last_deleted_at)
+                | Q(deleted_at=purge_run.last_deleted_at, id__gt=purge_run.last_id)
+            )
+        rows = list(tombstones.order_by('deleted_at', 'id').values_list('id', 'deleted_at')[:batch_size])
+        if rows:
+            previews = _delete_messages(purge_run, [pk for pk, _ in rows])
+            purge_run.last_id, purge_run.last_deleted_at = rows[-1]
+        else:
+            purge_run.phase, purge_run.last_id, purge_run.last_deleted_at = 'conversations', 0, None
+        purge_run.save()
+    for conversation_id in previews:
+        inbox.refresh_entries(conversation_id)
+
+
+def deleted_conversations(before):
+    """Conversations deleted before ``before`` that nobody has written to since."""
+    return Conversation.objects.filter(is_deleted=True, deleted_at__lt=before).exclude(
+        Exists(Message.objects.filter(conversation=OuterRef('pk'), timestamp__gte=OuterRef('deleted_at')))
+    )
+
+
+def _purge_conversations(purge_run, batch_size):
+    conversation = deleted_conversations(purge_run.cutoff).filter(id__gt=purge_run.last_id).order_by('id').first()
+    with transaction.atomic():
+        if conversation is None:
+            purge_run.phase = 'done'
+            purge_run.finished_at = timezone.now()
+        elif ids := list(Message.objects.filter(conversation=conversation).values_list('id', flat=True)[:batch_size]):
+            _delete_messages(purge_run, ids)
+        elif ids := list(ArchivedMessage.objects.filter(conversation=conversation).values_list('id', flat=True)[:batch_size]):
+            ArchivedMessage.objects.filter(id__in=ids).delete()
+            purge_run.messages_purged += len(ids)
+        else:
+            # Empty now; inbox entries and counters go with it
+            purge_run.last_id = conversation.id
+            conversation.delete()
+            purge_run.conversations_purged += 1
+        purge_run.save()
+
+
+def step(purge_run, batch_size=BATCH_SIZE):
+    """Purge one batch of ``purge_run``; returns False once the run is finished."""
+    if purge_run.phase == 'messages':
+        _purge_messages(purge_run, batch_size)
+    elif purge_run.phase == 'conversations':
+        _purge_conversations(purge_run, batch_size)
+    return purge_run.phase != 'done'
+
+
+def run(batch_size=BATCH_SIZE, pause=None, max_batches=None, now=None):
+    """
+    Resume the unfinished purge or start a new one, and work through it.
+
+    Returns the ``PurgeRun``, or None if another purge holds the lock.
+    """
+    if not cache.add(LOCK_KEY, True, LOCK_TIMEOUT):
+        logger.info("Purge already running")
+        return None
+    pause = getattr(settings, 'PURGE_BATCH_PAUSE', 0) if pause is None else pause
+    try:
+        purge_run = PurgeRun.objects.filter(finished_at__isnull=True).order_by('-id').first()
+        if purge_run is None:
+            purge_run = PurgeRun.objects.create(cutoff=cutoff(now))
+        batches = 0
+        while step(purge_run, batch_size):
+            batches += 1
+            if max_batches is not None and batches >= max_batches:
+                break
+            cache.set(LOCK_KEY, True, LOCK_TIMEOUT)
+            if pause:
+                time.sleep(pause)
+    finally:
+        cache.delete(LOCK_KEY)
+
+    if purge_run.finished_at:
+        logger.info(
+            "Purge %s finished: %s messages, %s conversations, %s files (%s bytes)", purge_run.id,
+            purge_run.messages_purged, purge_run.conversations_purged, purge_run.files_deleted, purge_run.bytes_freed,
+        )
+    return purge_run
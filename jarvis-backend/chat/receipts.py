@@ -0,0 +1,74 @@
+"""
+Read receipts for many conversations at once.
+
+``mark_read`` flips every unread message up to the requested point in each
+conversation with a single UPDATE that only matches ``is_read=False`` rows,
+and groups the result by sender so each counterparty gets one
+``messages_read`` event however many conversations were read.
+"""
+from django.db import transaction
+from django.db.models import F, Max, Q
+
+from accounts.models import BlockedUser
+
+from . import inbox
+from .models import Message
+
+MAX_CONVERSATIONS = 100
+
+
+def mark_read(user, points):
+    """
+    Mark messages sent to ``user`` as read.
+
+    ``points`` maps conversation ids to the id of the last message the user
+    has seen, or ``None`` for the whole conversation. Conversations the user
+    isn't in, and points outside their conversation, are ignored.
+
+    Returns ``(conversation_ids, receipts)`` where ``receipts`` maps each
+    sender to ``[{'conversation_id', 'up_to'}]`` with ``up_to`` the newest
+    timestamp that was marked read.
+    """
+    conversation_ids = set(user.conversations.filter(id__in=points).values_list('id', flat=True))
+    boundaries = dict(
+        (conversation_id, (timestamp, pk))
+        for pk, conversation_id, timestamp in Message.objects.filter(
+            id__in=[points[c] for c in conversation_ids if points[c] is not None],
+            conversation_id__in=conversation_ids,
+        ).values_list('id', 'conversation_id', 'timestamp')
+    )
+
+    condition = Q()
+    marked = []
+    for conversation_id in conversation_ids:
+        if points[conversation_id] is None:
+            condition |= Q(conversation_id=conversation_id)
+        elif conversation_id in boundaries:
+            timestamp, pk = boundaries[conversation_id]
+            condition |= Q(conversation_id=conversation_id) & (
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lte=pk)
+            )
+        else:
+            continue
+        marked.append(conversation_id)
+    if not marked:
+        return [], {}
+
+    # Pending messages from blocked users and cleared history stay hidden, so they stay unread too
+    blocked_senders = BlockedUser.objects.filter(blocker=user).values_list('blocked', flat=True)
+    unread = inbox.hide_cleared(Message.objects.filter(condition, is_read=False).exclude(sender=user).exclude(
+        sender__in=blocked_senders, is_delivered=False,
+    ), user)
+
+    receipts = {}
+    with transaction.atomic():
+        for row in unread.order_by().values('sender_id', 'conversation_id').annotate(up_to=Max('timestamp')):
+            receipts.setdefault(row['sender_id'], []).append({
+                'conversation_id': row['conversation_id'],
+                'up_to': row['up_to'].isoformat(),
+            })
+        if receipts:
+            unread.update(is_read=True, version=F('version') + 1)
+
+    inbox.recount_unread(user, marked)
+    return marked, receipts
@@ -0,0 +1,97 @@
+"""
+Cache of serialized messages keyed by (id, version).
+
+Only the viewer-independent body of a message is cached; the sender profile
+is attached per request by MessageSerializer so privacy masking still
+applies. Message.version is bumped whenever the rendered body can change
+(edit, delete, read/delivery, reaction, pin, media processing), so stale
+entries are never read and simply expire.
+"""
+import time
+
+from django.core.cache import cache
+from django.db.models import F
+
+
+RENDER_TIMEOUT = 60 * 60 * 24
+STATS_TIMEOUT = 60 * 60 * 24 * 30
+
+_HITS_KEY = "message:render:stats:hits"
+_MISSES_KEY = "message:render:stats:misses"
+_MISS_MICROS_KEY = "message:render:stats:miss_us"
+
+
+def render_key(message):
+    # The creation time guards against ids reused after a database reset
+    created = int(message.timestamp.timestamp() * 1_000_000)
+    return f"message:render:{message.pk}:{message.version}:{created}"
+
+
+def invalidate(*message_ids):
+    """Bump versions for changes that don't go through Message.save()."""
+    from .models import Message
+    Message.objects.filter(id__in=message_ids).update(version=F('version') + 1)
+
+
+def _incr(key, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, STATS_TIMEOUT):
+            cache.incr(key, delta)
+
+
+def get_bodies(messages, render_misses):
+    """
+    Return ``{message.pk: body}`` for ``messages`` using one multi-get.
+
+    ``render_misses(list_of_messages)`` must return bodies in the same order;
+    it is only called for messages missing from the cache.
+    """
+    keys = {message.pk: render_key(message) for message in messages}
+    cached = cache.get_many(list(keys.values())) if keys else {}
+
+    bodies = {}
+    misses = []
+    for message in messages:
+        body = cached.get(keys[message.pk])
+        if body is None:
+            misses.append(message)
+        else:
+            bodies[message.pk] = body
+
+    elapsed_us = 0
+    if misses:
+        start = time.perf_counter()
+        rendered = render_misses(misses)
+        elapsed_us = int((time.perf_counter() - start) * 1_000_000)
+        cache.set_many({keys[m.pk]: body for m, body in zip(misses, rendered)}, RENDER_TIMEOUT)
+        bodies.update({m.pk: body for m, body in zip(misses, rendered)})
+
+    _incr(_HITS_KEY, len(messages) - len(misses))
+    _incr(_MISSES_KEY, len(misses))
+    _incr(_MISS_MICROS_KEY, elapsed_us)
+    return bodies
+
+
+def stats():
+    """Hit rate and estimated serializer time saved since the counters were created."""
+    values = cache.get_many([_HITS_KEY, _MISSES_KEY, _MISS_MICROS_KEY])
+    hits = values.get(_HITS_KEY, 0)
+    misses = values.get(_MISSES_KEY, 0)
+    miss_us = values.get(_MISS_MICROS_KEY, 0)
+    lookups = hits + misses
+    avg_miss_us = miss_us / misses if misses else 0
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / lookups if lookups else 0.0,
+        'avg_render_us': avg_miss_us,
+        'serializer_seconds_saved': hits * avg_miss_us / 1_000_000,
+    }
+
+
+def reset_stats():
+    cache.delete_many([_HITS_KEY, _MISSES_KEY, _MISS_MICROS_KEY])
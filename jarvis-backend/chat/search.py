@@ -0,0 +1,147 @@
+"""
+Full-text search over message text.
+
+Postgres keeps a generated ``tsvector`` column with a GIN index on the
+messages table; SQLite uses an external-content FTS5 table kept in sync by
+triggers. Either way the index is maintained by the database on write, so
+the code paths that save messages don't need to know about it. Other
+backends (or SQLite builds without FTS5) fall back to ``icontains``.
+
+The ``simple`` text search configuration is used on Postgres so matching
+doesn't depend on the language of the conversation and behaves like the
+FTS5 ``unicode61`` tokenizer: case-insensitive whole-word terms, all of
+which must match.
+"""
+import re
+
+from django.db import OperationalError, connections
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+
+MESSAGE_TABLE = 'chat_message'
+FTS_TABLE = 'chat_message_fts'
+SEARCH_CONFIG = 'simple'
+
+POSTGRES_INSTALL = [
+    f"ALTER TABLE {MESSAGE_TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', coalesce(text, ''))) STORED",
+    f"CREATE INDEX IF NOT EXISTS chat_message_search_gin ON {MESSAGE_TABLE} USING gin (search_vector)",
+]
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS chat_message_search_gin",
+    f"ALTER TABLE {MESSAGE_TABLE} DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_ai': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {MESSAGE_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); END"
+    ),
+    f'{FTS_TABLE}_ad': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {MESSAGE_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) VALUES ('delete', old.id, old.text); END"
+    ),
+    f'{FTS_TABLE}_au': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF text ON {MESSAGE_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) VALUES ('delete', old.id, old.text); "
+        f"INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); END"
+    ),
+}
+
+_fts_available = {}
+
+
+def install(connection):
+    """Create the search index for ``connection``'s backend. Safe to re-run."""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for statement in POSTGRES_INSTALL:
+                cursor.execute(statement)
+    elif connection.vendor == 'sqlite':
+        install_sqlite(connection)
+
+
+def uninstall(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for statement in POSTGRES_UNINSTALL:
+                cursor.execute(statement)
+        elif connection.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    _fts_available.pop(connection.alias, None)
+
+
+def install_sqlite(connection):
+    """
+    Create the FTS5 table and its sync triggers, rebuilding the index if any
+    trigger was missing.
+
+    Django rebuilds SQLite tables on most schema changes, which drops their
+    triggers, so this also runs after every migrate (see ChatConfig.ready).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+            list(SQLITE_TRIGGERS),
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        if len(existing) == len(SQLITE_TRIGGERS):
+            return
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                f"USING fts5(text, content='{MESSAGE_TABLE}', content_rowid='id')"
+            )
+        except OperationalError:
+            # SQLite built without FTS5; search falls back to icontains
+            return
+        for sql in SQLITE_TRIGGERS.values():
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    _fts_available.pop(connection.alias, None)
+
+
+def ensure_index(sender, using='default', **kwargs):
+    """post_migrate receiver restoring SQLite triggers dropped by table rebuilds."""
+    connection = connections[using]
+    if connection.vendor == 'sqlite' and MESSAGE_TABLE in connection.introspection.table_names():
+        install_sqlite(connection)
+
+
+def _has_fts_table(connection):
+    if connection.alias not in _fts_available:
+        _fts_available[connection.alias] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available[connection.alias]
+
+
+def terms(query):
+    """Split a user query into plain word terms; operators and quotes are dropped."""
+    return re.findall(r'\w+', query or '')
+
+
+def filter_messages(queryset, query):
+    """Restrict a Message queryset to rows whose text contains every term of ``query``."""
+    words = terms(query)
+    if not words:
+        return queryset.none()
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        return queryset.filter(RawSQL(
+            f'"{MESSAGE_TABLE}"."search_vector" @@ plainto_tsquery(%s, %s)',
+            [SEARCH_CONFIG, ' '.join(words)],
+            output_field=BooleanField(),
+        ))
+
+    if connection.vendor == 'sqlite' and _has_fts_table(connection):
+        match = ' '.join(f'"{word}"' for word in words)
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]
+        ))
+
+    condition = Q()
+    for word in words:
+        condition &= Q(text__icontains=word)
+    return queryset.filter(condition)
@@ -1,6 +1,9 @@
+from django.db import models
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
-from .models import Conversation, Message, Reaction
+from .models import ArchivedMessage, Conversation, ImportJob, InboxEntry, Message, Reaction
 from accounts.serializers import UserSerializer
+from . import media_access, render_cache
 
 class ReactionSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
@@ -8,42 +11,84 @@ class ReactionSerializer(serializers.ModelSerializer):
         model = Reaction
         fields = ['emoji', 'username', 'timestamp']
 
-class MessageSerializer(serializers.ModelSerializer):
-    sender = UserSerializer(read_only=True)
+class SideloadedUsers:
+    """
+    Users referenced by a compact response.
+
+    Serializers register users here instead of nesting them, and the view
+    renders each profile once into a top-level ``users`` map.
+    """
+
+    def __init__(self):
+        self._users = {}
+
+    def add(self, user):
+        self._users.setdefault(user.id, user)
+        return user.id
+
+    def render(self, context):
+        # One list serializer so the field set is built once, not per user
+        data = UserSerializer(list(self._users.values()), many=True, context=context).data
+        return {str(user['id']): user for user in data}
+
+
+MESSAGE_FIELDS = [
+    'id',
+    'conversation',
+    'sender',
+    'text',
+    'message_type',
+    'file',
+    'file_type',
+    'file_name',
+    'media_processing_state',
+    'media_metadata',
+    'previews',
+    'placeholder',
+    'latitude',
+    'longitude',
+    'contact_name',
+    'contact_phone',
+    'timestamp',
+    'is_read',
+    'is_delivered',
+    'reactions',
+    'reply_to',
+    'deleted_at',
+    'is_pinned',
+    'expires_at',
+]
+
+
+class MessageBodySerializer(serializers.ModelSerializer):
+    """Viewer-independent part of a message, cached by chat.render_cache."""
+    sender_id = serializers.IntegerField(read_only=True)
     reactions = serializers.SlugRelatedField(
         many=True,
         read_only=True,
         slug_field='emoji'
     )
-    
+    previews = serializers.SerializerMethodField()
+    placeholder = serializers.SerializerMethodField()
+
     class Meta:
         model = Message
-        fields = [
-            'id',
-            'conversation',
-            'sender',
-            'text',
-            'message_type',
-            'file',
-            'file_type',
-            'file_name',
-            'media_processing_state',
-            'media_metadata',
-            'latitude',
-            'longitude',
-            'contact_name',
-            'contact_phone',
-            'timestamp',
-            'is_read',
-            'is_delivered',
-            'reactions',
-            'reply_to',
-            'deleted_at',
-            'is_pinned',
-        ]
+        fields = [name for name in MESSAGE_FIELDS if name != 'sender'] + ['sender_id']
+
+    def get_previews(self, instance):
+        # Downscaled copies made by chat.derivatives, smallest first
+        previews = (instance.media_metadata or {}).get('previews')
+        if not previews:
+            return None
+        return {
+            name: {key: preview[key] for key in ('url', 'width', 'height')}
+            for name, preview in previews.items()
+        }
+
+    def get_placeholder(self, instance):
+        return (instance.media_metadata or {}).get('placeholder')
 
     def to_representation(self, instance):
-        # Pass context to PublicUserSerializer for privacy masking
         representation = super().to_representation(instance)
         if instance.reply_to:
             representation['reply_to'] = {
@@ -53,6 +98,108 @@ class MessageSerializer(serializers.ModelSerializer):
             }
         return representation
 
+
+def render_message_bodies(messages):
+    prefetch_related_objects(messages, 'reactions', 'reply_to__sender')
+    return [dict(body) for body in MessageBodySerializer(messages, many=True).data]
+
+
+class MessageListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        bodies = self.child.get_bodies(items)
+        return [self.child.compose(item, bodies[item.pk]) for item in items]
+
+
+class MessageSerializer(serializers.ModelSerializer):
+    """
+    Full message representation.
+
+    The body comes from chat.render_cache; only the sender is rendered per
+    request. With ``sideload`` in the context the sender is emitted as
+    ``sender_id`` and registered for side-loading; a ``fields`` set in the
+    context trims the output to those fields (``id`` is always kept).
+    """
+    sender = UserSerializer(read_only=True)
+    reactions = serializers.SlugRelatedField(
+        many=True,
+        read_only=True,
+        slug_field='emoji'
+    )
+    previews = serializers.JSONField(read_only=True)
+    placeholder = serializers.CharField(read_only=True)
+    
+    class Meta:
+        model = Message
+        fields = MESSAGE_FIELDS
+        list_serializer_class = MessageListSerializer
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get('sideload') is not None:
+            del fields['sender']
+            fields['sender_id'] = serializers.IntegerField(read_only=True)
+
+        requested = self.context.get('fields')
+        if requested:
+            if 'sender' in requested:
+                requested = requested | {'sender_id'}
+            for name in list(fields):
+                if name != 'id' and name not in requested:
+                    del fields[name]
+        return fields
+
+    def get_bodies(self, messages):
+        # Archived messages carry their rendered body with them
+        archived = {m.pk: m.body for m in messages if isinstance(m, ArchivedMessage)}
+        if archived:
+            messages = [m for m in messages if m.pk not in archived]
+        # Bodies primed by a parent list (e.g. the conversation list) are reused
+        primed = self.context.get('message_bodies')
+        if primed is not None:
+            missing = [m for m in messages if m.pk not in primed]
+            if missing:
+                primed.update(render_cache.get_bodies(missing, render_message_bodies))
+            return {**primed, **archived} if archived else primed
+        bodies = render_cache.get_bodies(messages, render_message_bodies)
+        bodies.update(archived)
+        return bodies
+
+    def compose(self, instance, body):
+        sideload = self.context.get('sideload')
+        if sideload is not None:
+            sideload.add(instance.sender)
+
+        representation = {}
+        for name, field in self.fields.items():
+            if name == 'sender':
+                # Rendered with the request context for privacy masking
+                representation[name] = self._render_sender(field, instance.sender)
+            else:
+                representation[name] = body.get(name)
+
+        request = self.context.get('request')
+        if request is not None and request.user.is_authenticated:
+            representation = media_access.sign_message(representation, request.user.id)
+        if request is not None and representation.get('file'):
+            representation['file'] = request.build_absolute_uri(representation['file'])
+        if request is not None and representation.get('previews'):
+            representation['previews'] = {
+                name: {**preview, 'url': request.build_absolute_uri(preview['url'])}
+                for name, preview in representation['previews'].items()
+            }
+        return representation
+
+    def _render_sender(self, field, sender):
+        if not hasattr(self, '_senders'):
+            self._senders = {}
+        if sender.pk not in self._senders:
+            self._senders[sender.pk] = field.to_representation(sender)
+        return self._senders[sender.pk]
+
+    def to_representation(self, instance):
+        return self.compose(instance, self.get_bodies([instance])[instance.pk])
+
 class ConversationSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
     last_message = serializers.SerializerMethodField()
@@ -90,12 +237,83 @@ class ConversationSerializer(serializers.ModelSerializer):
         For group chats or self-chats, return None.
         """
         user = self.context['request'].user
-        participants = obj.participants.all()
+        # Evaluate once so prefetched participants are reused instead of
+        # issuing count() and exclude() queries per conversation
+        participants = list(obj.participants.all())
         
-        if participants.count() == 2:
+        if len(participants) == 2:
             # 1-on-1 chat: return the other user's ID
-            other_user = participants.exclude(id=user.id).first()
+            other_user = next((p for p in participants if p.id != user.id), None)
             return other_user.id if other_user else None
         
         return None
 
+
+class InboxEntryListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        items = list(data)
+        # Fetch every row's last message body in one cache round trip
+        messages = [entry.last_message for entry in items if entry.last_message_id]
+        self.context['message_bodies'] = render_cache.get_bodies(messages, render_message_bodies)
+        return super().to_representation(items)
+
+
+class InboxEntrySerializer(serializers.ModelSerializer):
+    """
+    Renders an InboxEntry in the same shape as ConversationSerializer.
+
+    With ``sideload`` in the context participants are emitted as
+    ``participant_ids`` and registered for side-loading.
+    """
+    id = serializers.IntegerField(source='conversation_id', read_only=True)
+    participants = UserSerializer(source='conversation.participants', many=True, read_only=True)
+    last_message = MessageSerializer(read_only=True)
+    other_user_id = serializers.IntegerField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = InboxEntry
+        fields = [
+            'id',
+            'participants',
+            'last_message',
+            'unread_count',
+            'other_user_id',
+            'is_deleted',
+            'last_message_preview',
+            'last_activity_at',
+        ]
+        list_serializer_class = InboxEntryListSerializer
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get('sideload') is not None:
+            del fields['participants']
+        return fields
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        sideload = self.context.get('sideload')
+        if sideload is not None:
+            representation['participant_ids'] = [
+                sideload.add(user) for user in instance.conversation.participants.all()
+            ]
+        return representation
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = [
+            'id', 'conversation', 'status', 'bytes_total', 'bytes_processed', 'lines_processed',
+            'messages_imported', 'rows_skipped', 'errors', 'progress', 'created_at', 'updated_at',
+        ]
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        if obj.status == 'completed':
+            return 1.0
+        if not obj.bytes_total:
+            return None
+        return round(min(obj.bytes_processed / obj.bytes_total, 1.0), 4)
@@ -0,0 +1,137 @@
+"""
+Per-user and per-conversation storage counters.
+
+A message's media counts once processing has finished, when its size is in
+``media_metadata``, and stops counting when the message is deleted. Each
+change adjusts two ``StorageUsage`` rows for the message type, the sender's
+and the conversation's, with F() updates, so reading usage is one query
+over a handful of rows however many messages there are.
+
+Callers pass querysets: ``add`` after messages become counted and
+``subtract`` before they stop being counted, and only messages that are
+counted at that moment are summed. ``reconcile`` rebuilds the rows from the
+messages table, a batch of users or conversations at a time, to fix drift
+(a message deleted while its media was processing, say).
+"""
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import BigIntegerField, Count, F, Q, Sum
+from django.db.models.fields.json import KT
+from django.db.models.functions import Cast, Coalesce
+
+from .models import Conversation, Message, StorageUsage
+
+BATCH_SIZE = 500
+
+COUNTED = Q(media_processing_state='ready', deleted_at__isnull=True, file__gt='')
+
+
+def _size():
+    return Coalesce(Cast(KT('media_metadata__size'), BigIntegerField()), 0)
+
+
+def _apply(deltas):
+    for (user_id, conversation_id, media_type), (size, count) in deltas.items():
+        if not count:
+            continue
+        rows = StorageUsage.objects.filter(user_id=user_id, conversation_id=conversation_id, media_type=media_type)
+        if rows.update(bytes=F('bytes') + size, count=F('count') + count):
+            continue
+        try:
+            with transaction.atomic():
+                StorageUsage.objects.create(
+                    user_id=user_id, conversation_id=conversation_id, media_type=media_type,
+                    bytes=size, count=count,
+                )
+        except IntegrityError:
+            # Created concurrently
+            rows.update(bytes=F('bytes') + size, count=F('count') + count)
+
+
+def _adjust(queryset, sign):
+    deltas = defaultdict(lambda: [0, 0])
+    rows = (
+        queryset.filter(COUNTED)
+        .values('sender_id', 'conversation_id', 'message_type')
+        .annotate(size=Sum(_size()), files=Count('id'))
+    )
+    for row in rows:
+        for key in ((row['sender_id'], None, row['message_type']), (None, row['conversation_id'], row['message_type'])):
+            deltas[key][0] += sign * (row['size'] or 0)
+            deltas[key][1] += sign * row['files']
+    _apply(deltas)
+
+
+def add(queryset):
+    """Count the media of messages in ``queryset`` that just became counted."""
+    _adjust(queryset, 1)
+
+
+def subtract(queryset):
+    """Stop counting the media of messages in ``queryset``; call before deleting them."""
+    _adjust(queryset, -1)
+
+
+def _summary(rows):
+    by_type = {row.media_type: {'bytes': row.bytes, 'count': row.count} for row in rows if row.count}
+    return {
+        'bytes': sum(entry['bytes'] for entry in by_type.values()),
+        'count': sum(entry['count'] for entry in by_type.values()),
+        'by_type': by_type,
+    }
+
+
+def for_user(user_id):
+    return _summary(StorageUsage.objects.filter(user_id=user_id, conversation__isnull=True))
+
+
+def for_conversation(conversation_id):
+    return _summary(StorageUsage.objects.filter(conversation_id=conversation_id, user__isnull=True))
+
+
+def _rebuild(owner_field, owner_ids, scope):
+    actual = {
+        (row[owner_field], row['message_type']): (row['size'] or 0, row['files'])
+        for row in Message.objects.filter(COUNTED, **{f'{owner_field}__in': owner_ids})
+        .values(owner_field, 'message_type')
+        .annotate(size=Sum(_size()), files=Count('id'))
+    }
+    key_field = 'user_id' if owner_field == 'sender_id' else 'conversation_id'
+    stored = {
+        (getattr(row, key_field), row.media_type): row
+        for row in StorageUsage.objects.filter(scope, **{f'{key_field}__in': owner_ids})
+    }
+    fixed = 0
+    with transaction.atomic():
+        for key, row in stored.items():
+            size, count = actual.get(key, (0, 0))
+            if (row.bytes, row.count) != (size, count):
+                StorageUsage.objects.filter(id=row.id).update(bytes=size, count=count)
+                fixed += 1
+        missing = [
+            StorageUsage(**{key_field: owner_id}, media_type=media_type, bytes=size, count=count)
+            for (owner_id, media_type), (size, count) in actual.items()
+            if (owner_id, media_type) not in stored
+        ]
+        StorageUsage.objects.bulk_create(missing, ignore_conflicts=True)
+    return fixed + len(missing)
+
+
+def reconcile(batch_size=BATCH_SIZE):
+    """Recompute every counter from the messages table; returns how many rows were off."""
+    fixed = 0
+    scopes = [
+        (get_user_model(), 'sender_id', Q(conversation__isnull=True)),
+        (Conversation, 'conversation_id', Q(user__isnull=True)),
+    ]
+    for model, owner_field, scope in scopes:
+        last_id = 0
+        while True:
+            ids = list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            fixed += _rebuild(owner_field, ids, scope)
+            last_id = ids[-1]
+    return fixed
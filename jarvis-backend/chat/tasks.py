@@ -1,10 +1,11 @@
 from celery import shared_task
+from django.db.models import F
 from django.contrib.auth import get_user_model
-from PIL import Image
 import logging
 
-from utils.notifications import send_fcm_notification
+from utils.notifications import send_fcm_notification, send_fcm_notifications
 
+from . import archive, expiry, inbox, media_processing, media_store, purge, storage_usage, uploads
 from .models import Message
 
 logger = logging.getLogger(__name__)
@@ -47,6 +48,17 @@ def send_message_notification(self, user_id, title, body, data=None):
     return send_fcm_notification(user=user, title=title, body=body, data=data or {})
 
 
+@shared_task(queue='notifications')
+def send_message_notifications(notifications):
+    """One FCM batch for many ``{user_id, title, body, data}`` notifications."""
+    users = User.objects.in_bulk({item['user_id'] for item in notifications})
+    return send_fcm_notifications([
+        (users[item['user_id']], item['title'], item['body'], item.get('data') or {})
+        for item in notifications
+        if item['user_id'] in users
+    ])
+
+
 @shared_task(queue='notifications', bind=True, max_retries=3, default_retry_delay=30)
 def send_call_notification(self, user_id, chat_id, caller_name, caller_avatar, is_video, call_uuid, offer_type='offer', offer_sdp=''):
     return send_call_notification_now(
@@ -70,35 +82,55 @@ def process_message_media(self, message_id):
         return False
 
     if not message.file:
-        message.media_processing_state = 'ready'
-        message.media_metadata = {}
-        message.save(update_fields=['media_processing_state', 'media_metadata'])
+        media_processing.save_results([message], [{}])
         return True
 
-    message.media_processing_state = 'processing'
-    message.save(update_fields=['media_processing_state'])
+    # Claim it, so a batch worker (manage.py process_media) can't process it too
+    if not Message.objects.filter(id=message.id, media_processing_state='pending').update(
+        media_processing_state='processing', version=F('version') + 1,
+    ):
+        return False
+    inbox.touch(message.conversation_id)
+    metadata = media_processing.describe(*media_processing.job(message))
+    media_processing.save_results([message], [metadata])
+    return metadata is not None
 
-    metadata = {
-        "name": message.file_name or message.file.name.rsplit('/', 1)[-1],
-        "size": message.file.size,
-        "content_type": message.file_type or "",
-    }
 
-    try:
-        message.file.open('rb')
-        try:
-            with Image.open(message.file) as image:
-                metadata["width"] = image.width
-                metadata["height"] = image.height
-                metadata["format"] = image.format
-        except Exception:
-            pass
-        finally:
-            message.file.close()
-    except Exception as exc:
-        logger.warning("Unable to inspect media for message_id=%s: %s", message_id, exc)
-
-    message.media_metadata = metadata
-    message.media_processing_state = 'ready'
-    message.save(update_fields=['media_processing_state', 'media_metadata'])
-    return True
+@shared_task
+def expire_upload_sessions():
+    expired = uploads.expire_sessions()
+    if expired:
+        logger.info("Expired %s abandoned upload sessions", expired)
+    return expired
+
+
+@shared_task
+def reconcile_media_references():
+    fixed = media_store.reconcile()
+    if fixed:
+        logger.warning("Corrected reference counts on %s media blobs", fixed)
+    return fixed
+
+
+@shared_task
+def reconcile_storage_usage():
+    fixed = storage_usage.reconcile()
+    if fixed:
+        logger.warning("Corrected %s storage usage counters", fixed)
+    return fixed
+
+
+@shared_task
+def purge_expired_messages():
+    return expiry.purge()
+
+
+@shared_task
+def archive_old_messages():
+    return archive.archive()
+
+
+@shared_task
+def purge_deleted():
+    purge_run = purge.run()
+    return purge_run and purge_run.messages_purged
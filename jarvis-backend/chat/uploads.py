@@ -0,0 +1,226 @@
+"""
+Resumable chunked uploads.
+
+A client opens an UploadSession, PUTs byte ranges in order and commits.
+Each PUT body is copied to storage in ``READ_SIZE`` pieces as its own part
+object (``uploads/<session>/<offset>.part``), so a request never holds more
+than one piece in memory and any storage backend works. The session's
+``received`` offset only moves forward once a part is fully stored; a
+client that lost its connection asks for the offset and resends from there.
+
+On commit the parts are read back in order as one stream and saved as the
+message file, then deleted.
+"""
+import io
+import os
+import re
+from datetime import timedelta
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import UploadSession
+
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+READ_SIZE = 64 * 1024
+SESSION_TTL = timedelta(hours=24)
+
+ALLOWED_TYPES = [
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+    'video/mp4', 'video/quicktime', 'video/webm',
+    'audio/mpeg', 'audio/mp4', 'audio/m4a', 'audio/x-m4a', 'audio/aac', 'audio/wav', 'audio/webm',
+    'application/pdf',
+]
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class ChunkRejected(Exception):
+    """The chunk can't be applied at this offset; the client should resync."""
+
+
+def parse_content_range(header):
+    """Return ``(start, end_exclusive, total)`` from a ``Content-Range`` header."""
+    match = _CONTENT_RANGE.match(header or '')
+    if not match:
+        raise ValueError("Content-Range must look like 'bytes start-end/total'")
+    start, last, total = (int(group) for group in match.groups())
+    if last < start or last >= total:
+        raise ValueError("Content-Range is out of bounds")
+    return start, last + 1, total
+
+
+def _session_dir(session):
+    return f"uploads/{session.id}"
+
+
+def part_name(session, offset):
+    return f"{_session_dir(session)}/{offset:012d}.part"
+
+
+class _LimitedReader(io.RawIOBase):
+    """Reads at most ``length`` bytes from a request stream."""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        data = self.stream.read(min(len(buffer), self.remaining, READ_SIZE))
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def open_session(user, file_name, file_type, total_size):
+    return UploadSession.objects.create(
+        user=user,
+        file_name=file_name,
+        file_type=file_type,
+        total_size=total_size,
+        expires_at=timezone.now() + SESSION_TTL,
+    )
+
+
+def write_chunk(session, stream, start, length):
+    """
+    Store ``length`` bytes from ``stream`` as the part at ``start`` and
+    acknowledge it. Returns the new offset.
+    """
+    if session.status != 'open':
+        raise ChunkRejected(f"Upload is {session.status}")
+    if start != session.received:
+        raise ChunkRejected("Chunk does not start at the acknowledged offset")
+
+    name = part_name(session, start)
+    # A previous attempt at this offset may have left a partial part behind
+    default_storage.delete(name)
+    saved = default_storage.save(name, File(_LimitedReader(stream, length), name=os.path.basename(name)))
+    if default_storage.size(saved) != length:
+        default_storage.delete(saved)
+        raise ChunkRejected("Chunk body was shorter than its Content-Range")
+
+    acknowledged = UploadSession.objects.filter(
+        id=session.id, status='open', received=start
+    ).update(received=start + length)
+    if not acknowledged:
+        # Another request won the race for this offset; keep only its part
+        if saved != name:
+            default_storage.delete(saved)
+        raise ChunkRejected("Chunk was already acknowledged")
+    session.received = start + length
+    return session.received
+
+
+class _PartsReader(io.RawIOBase):
+    """
+    The stored parts of a session read back to back as one stream.
+
+    Only rewinding is supported, which is enough to hash the file before
+    storing it.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.index = 0
+        self.position = 0
+        self.current = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if (offset, whence) == (self.position, io.SEEK_SET) or (offset, whence) == (0, io.SEEK_CUR):
+            return self.position
+        if (offset, whence) != (0, io.SEEK_SET):
+            raise io.UnsupportedOperation("Only rewinding is supported")
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+        self.index = 0
+        self.position = 0
+        return 0
+
+    def readinto(self, buffer):
+        while True:
+            if self.current is None:
+                if self.index == len(self.names):
+                    return 0
+                self.current = default_storage.open(self.names[self.index], 'rb')
+                self.index += 1
+            data = self.current.read(min(len(buffer), READ_SIZE))
+            if data:
+                buffer[:len(data)] = data
+                self.position += len(data)
+                return len(data)
+            self.current.close()
+            self.current = None
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+        super().close()
+
+
+def assembled_file(session):
+    """
+    A File streaming the session's parts in offset order.
+
+    Parts are chained by offset and size, so leftovers from abandoned
+    attempts at a range that was later resent in different chunks are ignored.
+    """
+    _, files = default_storage.listdir(_session_dir(session))
+    names = []
+    offset = 0
+    for file_name in sorted(files):
+        if offset == session.total_size:
+            break
+        if not file_name[:12].isdigit() or int(file_name[:12]) != offset:
+            continue
+        name = f"{_session_dir(session)}/{file_name}"
+        names.append(name)
+        offset += default_storage.size(name)
+    if offset != session.total_size:
+        raise ChunkRejected("Upload is incomplete")
+    return File(io.BufferedReader(_PartsReader(names), buffer_size=READ_SIZE), name=session.file_name)
+
+
+def discard_parts(session):
+    try:
+        _, files = default_storage.listdir(_session_dir(session))
+    except FileNotFoundError:
+        return
+    for name in files:
+        default_storage.delete(f"{_session_dir(session)}/{name}")
+    try:
+        os.rmdir(default_storage.path(_session_dir(session)))
+    except (NotImplementedError, OSError):
+        pass
+
+
+def expire_sessions(batch_size=500):
+    """Drop parts of sessions that were never committed. Returns how many expired."""
+    expired = 0
+    while True:
+        sessions = list(UploadSession.objects.filter(
+            status__in=['open', 'committing'], expires_at__lt=timezone.now(),
+        )[:batch_size])
+        if not sessions:
+            return expired
+        for session in sessions:
+            discard_parts(session)
+        UploadSession.objects.filter(id__in=[s.id for s in sessions]).update(status='expired')
+        expired += len(sessions)
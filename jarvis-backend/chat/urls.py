@@ -4,18 +4,36 @@ from .views import (
     MessageListView, MessageDetailView, 
     ReactionView, MessageUploadView, 
     RestoreChatView, ClearMessagesView,
-    MarkConversationReadView
+    MarkConversationReadView, MessageSearchView,
+    ConversationExportView, ImportJobListView, ImportJobDetailView,
+    BulkMarkReadView, UploadSessionListView, UploadSessionDetailView,
+    UploadSessionCommitView, StorageUsageView, ConversationStorageView,
+    ForwardMessageView, PinnedMessageListView, MediaMessageListView
 )
 
 urlpatterns = [
     path('messages/upload/', MessageUploadView.as_view(), name='message-upload'),
+    path('uploads/', UploadSessionListView.as_view(), name='upload-session-list'),
+    path('uploads/<uuid:pk>/', UploadSessionDetailView.as_view(), name='upload-session-detail'),
+    path('uploads/<uuid:pk>/commit/', UploadSessionCommitView.as_view(), name='upload-session-commit'),
     path('conversations/', ConversationListView.as_view(), name='conversations'),
+    path('conversations/read/', BulkMarkReadView.as_view(), name='conversations-read'),
     path('conversations/<int:pk>/', ConversationDetailView.as_view(), name='conversation-detail'),
     path('conversations/<int:pk>/clear/', ClearMessagesView.as_view(), name='conversation-clear'),
     path('conversations/<int:conversation_id>/read/', MarkConversationReadView.as_view(), name='conversation-read'),
+    path('conversations/<int:pk>/export/', ConversationExportView.as_view(), name='conversation-export'),
+    path('conversations/<int:pk>/pinned/', PinnedMessageListView.as_view(), name='conversation-pinned'),
+    path('conversations/<int:pk>/media/', MediaMessageListView.as_view(), name='conversation-media'),
+    path('conversations/<int:pk>/storage/', ConversationStorageView.as_view(), name='conversation-storage'),
+    path('conversations/<int:conversation_id>/search/', MessageSearchView.as_view(), name='conversation-search'),
     path('messages/<int:conversation_id>/', MessageListView.as_view(), name='messages'),
     path('messages/detail/<int:pk>/', MessageDetailView.as_view(), name='message-detail'),
     path('messages/<int:message_id>/react/', ReactionView.as_view(), name='message-react'),
+    path('messages/<int:message_id>/forward/', ForwardMessageView.as_view(), name='message-forward'),
 
+    path('search/', MessageSearchView.as_view(), name='message-search'),
+    path('storage/', StorageUsageView.as_view(), name='storage-usage'),
+    path('imports/', ImportJobListView.as_view(), name='import-list'),
+    path('imports/<int:pk>/', ImportJobDetailView.as_view(), name='import-detail'),
     path('restore/', RestoreChatView.as_view(), name='restore-chat'),
 ]
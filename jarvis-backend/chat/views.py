@@ -1,11 +1,31 @@
+import hashlib
+import io
+import mimetypes
+import os
+import posixpath
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from .models import Conversation, Message, Reaction
-from .serializers import ConversationSerializer, MessageSerializer, ReactionSerializer
-from django.db.models import Q, Count, OuterRef, Subquery, Prefetch
+from .models import Conversation, ImportJob, InboxEntry, Message, Reaction, UploadSession
+from .serializers import (
+    ConversationSerializer, ImportJobSerializer, InboxEntrySerializer, MessageSerializer, ReactionSerializer,
+    SideloadedUsers,
+)
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from accounts import avatars
+from . import archive, expiry, export, fanout, forwarding, importer, inbox, media_access, media_store, receipts, render_cache, search, storage_usage, uploads
 from django.contrib.auth import get_user_model
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.views import APIView
-from .pagination import MessageHistoryPagination, apply_history_cursor
+from .pagination import MessageCursorPagination, apply_history_cursor
 from utils.chat_utils import get_or_create_1on1_conversation
 
 User = get_user_model()
@@ -15,35 +35,97 @@ except ImportError:
     # Handle potential circular import if strictly necessary, but usually models are fine
     pass
 
-class ConversationListView(generics.ListCreateAPIView):
+class VersionedListMixin:
+    """
+    Conditional GET for list views backed by chat.inbox version counters.
+
+    The ETag is derived from cached versions only, so a matching
+    If-None-Match is answered with 304 before any list query runs.
+    """
+
+    def get_version_tokens(self):
+        raise NotImplementedError
+
+    def get_etag(self, request):
+        tokens = [request.user.id, *self.get_version_tokens(), request.GET.urlencode()]
+        digest = hashlib.sha1(':'.join(str(t) for t in tokens).encode()).hexdigest()
+        return quote_etag(digest)
+
+    def list(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+class CompactResponseMixin:
+    """
+    Opt-in compact list shape.
+
+    ``?compact=true`` replaces nested user objects with ids and adds a
+    top-level ``users`` map carrying each profile once. ``?fields=a,b``
+    limits message objects to the listed fields.
+    """
+
+    def is_compact(self):
+        return self.request.query_params.get('compact', 'false') == 'true'
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.is_compact():
+            if not hasattr(self, '_sideload'):
+                self._sideload = SideloadedUsers()
+            context['sideload'] = self._sideload
+        fields = self.request.query_params.get('fields')
+        if fields:
+            context['fields'] = {name.strip() for name in fields.split(',') if name.strip()}
+        return context
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if not self.is_compact() or response.status_code != status.HTTP_200_OK:
+            return response
+
+        users = self._sideload.render(self.get_serializer_context()) if hasattr(self, '_sideload') else {}
+        if isinstance(response.data, list):
+            response.data = {'results': response.data, 'users': users}
+        else:
+            response.data['users'] = users
+        return response
+
+class ConversationListView(VersionedListMixin, CompactResponseMixin, generics.ListCreateAPIView):
     serializer_class = ConversationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return InboxEntrySerializer
+        return ConversationSerializer
+
     def get_queryset(self):
         user = self.request.user
         is_deleted = self.request.query_params.get('deleted', 'false') == 'true'
-        
-        # Subquery for unread counts
-        unread_count_qs = Message.objects.filter(
-            conversation=OuterRef('pk')
-        ).exclude(sender=user).filter(is_read=False).values('conversation').annotate(cnt=Count('id')).values('cnt')
-
-        recent_messages = Message.objects.select_related(
-            'sender',
-            'reply_to',
-            'reply_to__sender',
-        ).prefetch_related('reactions', 'reactions__user').order_by('-timestamp')[:1]
-
-        return user.conversations.filter(is_deleted=is_deleted).annotate(
-            unread_count_annotated=Subquery(unread_count_qs)
+
+        # Inbox rows are maintained on write (see chat.inbox), so listing is a
+        # range scan over (user, is_deleted, last_activity_at). Message bodies
+        # come from the render cache; reactions and replies are only loaded
+        # for cache misses.
+        return InboxEntry.objects.filter(
+            user=user,
+            is_deleted=is_deleted,
+        ).select_related(
+            'conversation',
+            'last_message',
+            'last_message__sender',
         ).prefetch_related(
-            'participants',
-            Prefetch(
-                'messages',
-                queryset=recent_messages,
-                to_attr='_prefetched_messages',
-            ),
-        ).order_by('-id')
+            'conversation__participants',
+        ).order_by('-last_activity_at', '-id')
+
+    def get_version_tokens(self):
+        return inbox.get_versions(self.request.user.id)
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -75,12 +157,14 @@ class ConversationDetailView(generics.DestroyAPIView):
 
     def perform_destroy(self, instance):
         instance.is_deleted = True
+        instance.deleted_at = timezone.now()
         instance.save()
+        inbox.set_deleted([instance.id], True)
 
-class MessageListView(generics.ListAPIView):
+class MessageListView(VersionedListMixin, CompactResponseMixin, generics.ListAPIView):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = MessageHistoryPagination
+    pagination_class = MessageCursorPagination
 
     def get_queryset(self):
         conversation_id = self.kwargs['conversation_id']
@@ -100,12 +184,135 @@ class MessageListView(generics.ListAPIView):
         
         queryset = Message.objects.filter(
             conversation_id=conversation_id
-        ).select_related('sender', 'reply_to', 'reply_to__sender').prefetch_related('reactions', 'reactions__user').exclude(
+        ).select_related('sender').exclude(
             sender__in=blocked_senders,
             is_delivered=False 
-        ).order_by('-timestamp')
+        ).order_by('-timestamp', '-id')
+
+        # Hide what this user cleared; other participants keep their history
+        cleared_before = inbox.cleared_before(self.request.user.id, conversation_id)
+        if cleared_before is not None:
+            queryset = queryset.filter(timestamp__gt=cleared_before)
+
+        return apply_history_cursor(inbox.hide_expired(queryset), self.request)
+
+    def get_archive(self):
+        # Older history moved out of the messages table (see chat.archive)
+        conversation_id = self.kwargs['conversation_id']
+        newest = archive.newest(conversation_id)
+        if newest is None:
+            return None
+        return apply_history_cursor(archive.visible_messages(self.request.user, conversation_id), self.request), newest
+
+    def get_version_tokens(self):
+        return inbox.get_versions(self.request.user.id, self.kwargs['conversation_id'])
+
+class MessageSearchView(CompactResponseMixin, generics.ListAPIView):
+    """
+    Full-text search over the user's conversations, or one conversation when
+    ``conversation_id`` is in the URL. Results are newest first and paged
+    with the same keyset cursor as the message history.
+    """
+    serializer_class = MessageSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        if not search.terms(params.get('q')):
+            return Response({"error": "Search query 'q' is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        conversation_id = kwargs.get('conversation_id')
+        if conversation_id is not None and not request.user.conversations.filter(id=conversation_id).exists():
+            return Response({"error": "Conversation not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        self.filters = {}
+        sender = params.get('sender')
+        if sender:
+            if not sender.isdigit():
+                return Response({"error": "sender must be a user id"}, status=status.HTTP_400_BAD_REQUEST)
+            self.filters['sender_id'] = int(sender)
+        for param, lookup in (('since', 'timestamp__gte'), ('until', 'timestamp__lt')):
+            value = params.get(param)
+            if value:
+                parsed = parse_datetime(value)
+                if parsed is None:
+                    return Response({"error": f"{param} must be an ISO 8601 timestamp"}, status=status.HTTP_400_BAD_REQUEST)
+                self.filters[lookup] = parsed
+
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        user = self.request.user
+        conversation_id = self.kwargs.get('conversation_id')
+        if conversation_id is not None:
+            conversations = user.conversations.filter(id=conversation_id)
+        else:
+            conversations = user.conversations.filter(is_deleted=False)
+
+        # Same visibility as the history: pending messages from blocked users stay hidden
+        blocked_senders = BlockedUser.objects.filter(blocker=user).values_list('blocked', flat=True)
+        queryset = Message.objects.filter(
+            conversation__in=conversations,
+            deleted_at__isnull=True,
+            **self.filters,
+        ).exclude(
+            sender__in=blocked_senders,
+            is_delivered=False,
+        ).select_related('sender')
+        queryset = inbox.hide_expired(inbox.hide_cleared(queryset, user))
+
+        return search.filter_messages(queryset, self.request.query_params.get('q')).order_by('-timestamp', '-id')
+
+class ConversationMessageSubsetView(CompactResponseMixin, generics.ListAPIView):
+    """
+    A subset of one conversation's messages, newest first, paged with the
+    history's keyset cursor. Subclasses filter with the predicate of a
+    partial index so text-only rows are never scanned.
+    """
+    serializer_class = MessageSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        if not request.user.conversations.filter(id=kwargs['pk']).exists():
+            return Response({"error": "Conversation not found"}, status=status.HTTP_404_NOT_FOUND)
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        queryset = inbox.visible_messages(self.request.user, self.kwargs['pk']).filter(deleted_at__isnull=True)
+        return self.filter_subset(queryset).select_related('sender').order_by('-timestamp', '-id')
+
+    def filter_subset(self, queryset):
+        raise NotImplementedError
+
+
+class PinnedMessageListView(ConversationMessageSubsetView):
+    def filter_subset(self, queryset):
+        return queryset.filter(is_pinned=True)
+
+
+class MediaMessageListView(ConversationMessageSubsetView):
+    """``?type=image,video`` limits the listing to those message types."""
+    MEDIA_TYPES = {value for value, _ in Message.MESSAGE_TYPES} - {'text'}
+
+    def list(self, request, *args, **kwargs):
+        types = request.query_params.get('type')
+        self.types = {name.strip() for name in types.split(',') if name.strip()} if types else set()
+        if self.types - self.MEDIA_TYPES:
+            return Response(
+                {"error": f"type must be one of {', '.join(sorted(self.MEDIA_TYPES))}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return super().list(request, *args, **kwargs)
+
+    def filter_subset(self, queryset):
+        # The index predicate itself, so the partial index applies with or without ?type=
+        queryset = queryset.exclude(message_type='text')
+        if self.types:
+            queryset = queryset.filter(message_type__in=self.types)
+        return queryset
 
-        return apply_history_cursor(queryset, self.request)
 
 class MessageDetailView(generics.DestroyAPIView):
     queryset = Message.objects.all()
@@ -116,10 +323,18 @@ class MessageDetailView(generics.DestroyAPIView):
         # Users can only delete their own messages
         return self.request.user.sent_messages.all()
 
+    def destroy(self, request, *args, **kwargs):
+        # Archived messages can't be soft-deleted; they go for good
+        if archive.delete_sent(request.user, kwargs['pk']) is None:
+            return super().destroy(request, *args, **kwargs)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     def perform_destroy(self, instance):
         from django.utils import timezone
+        storage_usage.subtract(Message.objects.filter(pk=instance.pk))
         instance.deleted_at = timezone.now()
         instance.save()
+        inbox.refresh_entries(instance.conversation_id)
 
 class RestoreChatView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -137,7 +352,7 @@ class RestoreChatView(APIView):
             participants=request.user,
             is_deleted=True
         )
-        conversations.update(is_deleted=False)
+        conversations.update(is_deleted=False, deleted_at=None)
 
         # 2. Restore Messages if a date is provided
         if restore_date:
@@ -146,11 +361,17 @@ class RestoreChatView(APIView):
                     conversation__id__in=conversation_ids,
                     sender=request.user,
                     deleted_at__lte=restore_date
-                )
-                messages.update(deleted_at=None)
+                ).filter(expires_at__isnull=True)  # disappeared messages have nothing left to restore
+                restored = list(messages.values_list('id', flat=True))
+                messages.update(deleted_at=None, version=F('version') + 1)
+                storage_usage.add(Message.objects.filter(id__in=restored))
             except Exception as e:
                 return Response({"error": f"Invalid date: {e}"}, status=status.HTTP_400_BAD_REQUEST)
 
+        affected = Conversation.objects.filter(id__in=conversation_ids, participants=request.user)
+        for conversation_id in affected.values_list('id', flat=True):
+            inbox.refresh_entries(conversation_id)
+
         return Response({"status": "restored", "count": conversations.count()})
 
 class ReactionView(APIView):
@@ -179,50 +400,24 @@ class ReactionView(APIView):
                 Reaction.objects.create(message=message, user=request.user, emoji=emoji)
                 status_code = status.HTTP_201_CREATED
                 msg = "added"
-            
+
+            render_cache.invalidate(message.id)
+            inbox.touch(message.conversation_id)
             return Response({"status": msg}, status=status_code)
 
         except Message.DoesNotExist:
             return Response({"error": "Message not found"}, status=status.HTTP_404_NOT_FOUND)
 
-from rest_framework.parsers import MultiPartParser, FormParser
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+import logging
 
-class MessageUploadView(APIView):
-    permission_classes = [permissions.IsAuthenticated]
-    parser_classes = (MultiPartParser, FormParser)
-
-    def post(self, request, *args, **kwargs):
-        conversation_id = request.data.get('conversation_id')
-        recipient_username = request.data.get('recipient_username')
-        text = request.data.get('text', '')
-        file = request.data.get('file')
-        file_type = request.data.get('file_type')
-        file_name = request.data.get('file_name')
-        reply_to_id = request.data.get('reply_to_id')
+from rest_framework.parsers import MultiPartParser, FormParser
 
-        # File Validation (Security)
-        if file:
-            # 1. Size Limit (e.g., 50MB)
-            if file.size > 50 * 1024 * 1024:
-                return Response({"error": "File too large (max 50MB)"}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # 2. Type Limit
-            allowed_types = ['image/jpeg', 'image/png', 'image/gif', 'image/webp', 
-                             'video/mp4', 'video/quicktime', 'video/webm',
-                             'audio/mpeg', 'audio/mp4', 'audio/wav', 'audio/webm',
-                             'application/pdf']
-            
-            # Check content_type (trusting header, but better than nothing). 
-            # For strict check, we'd use python-magic but that requires system libs.
-            if file.content_type not in allowed_types:
-                 return Response({"error": f"File type not allowed: {file.content_type}"}, status=status.HTTP_400_BAD_REQUEST)
+logger = logging.getLogger(__name__)
 
-        # Allow file only, text only, or both
-        if not file and not text:
-             return Response({"error": "Message must have text or file"}, status=status.HTTP_400_BAD_REQUEST)
+class MessageSendMixin:
+    """Creates a message and fans it out; shared by direct and chunked uploads."""
 
+    def send_message(self, request, conversation_id, recipient_username, text, file, file_type, file_name, reply_to_id, digest=None):
         try:
             conversation = None
             if conversation_id:
@@ -260,30 +455,48 @@ class MessageUploadView(APIView):
                 reply_to_message = Message.objects.filter(id=reply_to_id).first()
 
             message_type = _infer_message_type(file, file_type, text)
-            message = Message.objects.create(
-                conversation=conversation,
-                sender=request.user,
-                text=text,
-                file=file,
-                file_type=file_type,
-                file_name=file_name,
-                reply_to=reply_to_message,
-                message_type=message_type,
-                media_processing_state='pending' if file else 'ready',
-            )
+            blob = None
+            metadata = {}
+            if file:
+                # Identical bytes are stored once; already processed ones keep their metadata
+                file_name = file_name or os.path.basename(file.name)
+                blob = media_store.store(file, file_type, digest=digest)
+                if blob.metadata:
+                    metadata = {**blob.metadata, 'name': file_name}
+            try:
+                message = Message.objects.create(
+                    conversation=conversation,
+                    sender=request.user,
+                    text=text,
+                    file=blob.file.name if blob else None,
+                    blob=blob,
+                    file_type=file_type,
+                    file_name=file_name,
+                    reply_to=reply_to_message,
+                    message_type=message_type,
+                    media_processing_state='pending' if file and not metadata else 'ready',
+                    media_metadata=metadata,
+                    expires_at=expiry.expires_at(request.user),
+                )
+            except Exception:
+                if blob:
+                    media_store.release([blob.id])
+                raise
+
+            inbox.record_message(message, hidden_from=[other_user.id] if is_blocked else ())
+            if file and metadata:
+                # Already processed bytes count straight away
+                storage_usage.add(Message.objects.filter(pk=message.pk))
 
             serializer = MessageSerializer(message)
             data = serializer.data
 
-            if file:
+            if file and not metadata and not settings.MEDIA_BATCH_WORKER:
                 from .tasks import process_message_media
                 process_message_media.delay(message.id)
 
-            # Broadcast via WebSocket
-            channel_layer = get_channel_layer()
-
-            # Broadcast to all participants
             # Broadcast to all participants
+            events = []
             for participant in conversation.participants.all():
                  # If blocked, do NOT send to the blocker (recipient)
                  # But ALWAYS send to the sender (so they get update/confirmation)
@@ -293,13 +506,10 @@ class MessageUploadView(APIView):
                      should_send = False
                  
                  if should_send:
-                     async_to_sync(channel_layer.group_send)(
-                        f"user_{participant.id}",
-                        {
-                            'type': 'chat_message',
-                            'message': data
-                        }
-                    )
+                     events.append((fanout.user_group(participant.id), {
+                         'type': 'chat_message',
+                         'message': media_access.sign_message(data, participant.id)
+                     }))
                      # Send FCM if it's the recipient
                      if participant.id != request.user.id:
                          try:
@@ -313,20 +523,280 @@ class MessageUploadView(APIView):
                                      "conversation_id": str(conversation.id),
                                      "sender_id": str(request.user.id),
                                      "message_id": str(message.id),
-                                     "sender_avatar": request.user.profile_picture.url if request.user.profile_picture else ""
+                                     "sender_avatar": avatars.url(request.user)
                                  }
                              )
                          except Exception as e:
                              logger.error(f"Failed to send notification via upload view: {e}")
+            fanout.send(events)
 
-            return Response(data, status=status.HTTP_201_CREATED)
+            return Response(media_access.sign_message(data, request.user.id), status=status.HTTP_201_CREATED)
 
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f"Error in upload view: {e}", exc_info=True)
             return Response({"error": "Failed to upload message. Please try again."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class MessageUploadView(MessageSendMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, *args, **kwargs):
+        # Hash the file while the body is parsed rather than re-reading it
+        hasher = media_store.HashingUploadHandler(request)
+        request.upload_handlers.insert(0, hasher)
+        conversation_id = request.data.get('conversation_id')
+        recipient_username = request.data.get('recipient_username')
+        text = request.data.get('text', '')
+        file = request.data.get('file')
+        file_type = request.data.get('file_type')
+        file_name = request.data.get('file_name')
+        reply_to_id = request.data.get('reply_to_id')
+
+        # File Validation (Security)
+        if file:
+            # 1. Size Limit (e.g., 50MB)
+            if file.size > uploads.MAX_UPLOAD_SIZE:
+                return Response({"error": "File too large (max 50MB)"}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # 2. Type Limit
+            # Check content_type (trusting header, but better than nothing). 
+            # For strict check, we'd use python-magic but that requires system libs.
+            if file.content_type not in uploads.ALLOWED_TYPES:
+                 return Response({"error": f"File type not allowed: {file.content_type}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Allow file only, text only, or both
+        if not file and not text:
+             return Response({"error": "Message must have text or file"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return self.send_message(
+            request,
+            conversation_id=conversation_id,
+            recipient_username=recipient_username,
+            text=text,
+            file=file,
+            file_type=file_type,
+            file_name=file_name,
+            reply_to_id=reply_to_id,
+            digest=hasher.digests.get('file'),
+        )
+
+class ForwardMessageView(APIView):
+    """
+    Forward a message to several conversations at once:
+    ``{"conversation_ids": [12, 13]}``. Responds with the new messages.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, message_id):
+        conversation_ids = request.data.get('conversation_ids')
+        if not isinstance(conversation_ids, list) or not conversation_ids:
+            return Response({"error": "conversation_ids must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(conversation_ids) > forwarding.MAX_TARGETS:
+            return Response(
+                {"error": f"At most {forwarding.MAX_TARGETS} conversations per forward"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            conversation_ids = {int(pk) for pk in conversation_ids}
+        except (TypeError, ValueError):
+            return Response({"error": "conversation_ids must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        source = forwarding.source_message(request.user, message_id)
+        if source is None:
+            return Response({"error": "Message not found"}, status=status.HTTP_404_NOT_FOUND)
+        conversations = forwarding.target_conversations(request.user, conversation_ids)
+        if not conversations:
+            return Response({"error": "Conversation not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        hidden = forwarding.hidden_from(request.user, conversations)
+        copies = forwarding.forward(request.user, source, conversations, hidden)
+        if not settings.MEDIA_BATCH_WORKER:
+            from .tasks import process_message_media
+            for copy in copies:
+                if copy.media_processing_state == 'pending':
+                    process_message_media.delay(copy.id)
+
+        data = MessageSerializer(copies, many=True).data
+        # One event per participant holding every copy they can see, and one
+        # task for all the pushes
+        events = {}
+        notifications = []
+        for copy, item in zip(copies, data):
+            for participant in copy.conversation.participants.all():
+                if participant.id in hidden[copy.conversation_id]:
+                    continue
+                events.setdefault(participant.id, []).append(media_access.sign_message(item, participant.id))
+                if participant.id != request.user.id:
+                    notifications.append({
+                        'user_id': participant.id,
+                        'title': f"New message from {request.user.username}",
+                        'body': copy.text[:100] if copy.text else "Sent a file",
+                        'data': {
+                            "type": "chat_message",
+                            "conversation_id": str(copy.conversation_id),
+                            "sender_id": str(request.user.id),
+                            "message_id": str(copy.id),
+                            "sender_avatar": avatars.url(request.user),
+                        },
+                    })
+
+        fanout.send(
+            (fanout.user_group(user_id), {'type': 'chat_messages', 'messages': messages})
+            for user_id, messages in events.items()
+        )
+        if notifications:
+            try:
+                from .tasks import send_message_notifications
+                send_message_notifications.delay(notifications)
+            except Exception as e:
+                logger.error(f"Failed to queue forward notifications: {e}")
+
+        return Response({"messages": events[request.user.id]}, status=status.HTTP_201_CREATED)
+
+class UploadSessionListView(APIView):
+    """Open a resumable upload: ``{"file_name", "file_type", "size"}``."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        file_name = request.data.get('file_name')
+        file_type = request.data.get('file_type')
+        size = request.data.get('size')
+
+        if not file_name or not isinstance(size, int) or size <= 0:
+            return Response({"error": "file_name and a positive size are required"}, status=status.HTTP_400_BAD_REQUEST)
+        if size > uploads.MAX_UPLOAD_SIZE:
+            return Response({"error": "File too large (max 50MB)"}, status=status.HTTP_400_BAD_REQUEST)
+        if file_type not in uploads.ALLOWED_TYPES:
+            return Response({"error": f"File type not allowed: {file_type}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        session = uploads.open_session(request.user, file_name[:255], file_type, size)
+        return Response(_upload_state(session), status=status.HTTP_201_CREATED)
+
+def _upload_state(session):
+    return {
+        "id": str(session.id),
+        "offset": session.received,
+        "size": session.total_size,
+        "status": session.status,
+        "max_chunk_size": uploads.MAX_CHUNK_SIZE,
+        "expires_at": session.expires_at,
+        "message_id": session.message_id,
+    }
+
+class UploadSessionDetailView(APIView):
+    """
+    GET returns the acknowledged offset to resume from. PUT appends the byte
+    range given by ``Content-Range``, which must start at that offset.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_session(self, request, pk):
+        return UploadSession.objects.filter(id=pk, user=request.user).first()
+
+    def get(self, request, pk):
+        session = self.get_session(request, pk)
+        if session is None:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(_upload_state(session))
+
+    def put(self, request, pk):
+        session = self.get_session(request, pk)
+        if session is None:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        if session.expires_at < timezone.now():
+            return Response({"error": "Upload expired"}, status=status.HTTP_410_GONE)
+
+        try:
+            start, end, total = uploads.parse_content_range(request.headers.get('Content-Range'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        length = end - start
+        if total != session.total_size or length > uploads.MAX_CHUNK_SIZE:
+            return Response({"error": "Chunk does not match the upload"}, status=status.HTTP_400_BAD_REQUEST)
+        if int(request.META.get('CONTENT_LENGTH') or 0) != length:
+            return Response({"error": "Content-Length must match Content-Range"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            uploads.write_chunk(session, request.stream, start, length)
+        except uploads.ChunkRejected as e:
+            session.refresh_from_db()
+            return Response({"error": str(e), **_upload_state(session)}, status=status.HTTP_409_CONFLICT)
+        return Response(_upload_state(session))
+
+class UploadSessionCommitView(MessageSendMixin, APIView):
+    """
+    Turn a fully uploaded session into a message. Takes the same fields as
+    the multipart upload minus the file. Committing twice returns the same
+    message.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, pk):
+        session = UploadSession.objects.filter(id=pk, user=request.user).first()
+        if session is None:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        if session.status == 'committed' and session.message_id:
+            return Response(MessageSerializer(session.message, context={'request': request}).data, status=status.HTTP_200_OK)
+        if session.received != session.total_size:
+            return Response({"error": "Upload is incomplete", **_upload_state(session)}, status=status.HTTP_409_CONFLICT)
+
+        # Claim the session so a retried commit can't create a second message
+        if not UploadSession.objects.filter(id=session.id, status='open').update(status='committing'):
+            return Response({"error": f"Upload is {session.status}"}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            file = uploads.assembled_file(session)
+        except uploads.ChunkRejected as e:
+            UploadSession.objects.filter(id=session.id).update(status='open')
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        with file:
+            response = self.send_message(
+                request,
+                conversation_id=request.data.get('conversation_id'),
+                recipient_username=request.data.get('recipient_username'),
+                text=request.data.get('text', ''),
+                file=file,
+                file_type=session.file_type,
+                file_name=session.file_name,
+                reply_to_id=request.data.get('reply_to_id'),
+            )
+
+        if response.status_code != status.HTTP_201_CREATED:
+            UploadSession.objects.filter(id=session.id).update(status='open')
+            return response
+        UploadSession.objects.filter(id=session.id).update(status='committed', message_id=response.data['id'])
+        uploads.discard_parts(session)
+        return response
+
+def _send_read_receipts(reader, marked, receipts):
+    """
+    One messages_read event per counterparty listing every conversation read,
+    and one to the reader's own devices so their unread badges follow.
+    """
+    events = [
+        (fanout.user_group(sender_id), {
+            'type': 'messages_read',
+            'reader_id': reader.id,
+            'conversations': conversations,
+        })
+        for sender_id, conversations in receipts.items()
+    ]
+    if marked:
+        up_to = {}
+        for conversations in receipts.values():
+            for receipt in conversations:
+                up_to[receipt['conversation_id']] = max(up_to.get(receipt['conversation_id'], ''), receipt['up_to'])
+        events.append((fanout.user_group(reader.id), {
+            'type': 'messages_read',
+            'reader_id': reader.id,
+            # up_to is null where nothing was left unread
+            'conversations': [
+                {'conversation_id': conversation_id, 'up_to': up_to.get(conversation_id)}
+                for conversation_id in sorted(marked)
+            ],
+        }))
+    fanout.send(events)
+
 class MarkConversationReadView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -335,24 +805,49 @@ class MarkConversationReadView(APIView):
             conversation = Conversation.objects.get(id=conversation_id)
             if not conversation.participants.filter(id=request.user.id).exists():
                 return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
-            
-            Message.objects.filter(conversation=conversation).exclude(sender=request.user).update(is_read=True)
-            
-            channel_layer = get_channel_layer()
-            for participant in conversation.participants.all():
-                async_to_sync(channel_layer.group_send)(
-                    f"user_{participant.id}",
-                    {
-                        'type': 'messages_read',
-                        'conversation_id': str(conversation_id),
-                        'reader_id': request.user.id
-                    }
-                )
+
+            marked, read_receipts = receipts.mark_read(request.user, {conversation.id: request.data.get('up_to')})
+            _send_read_receipts(request.user, marked, read_receipts)
             return Response({"status": "read"}, status=status.HTTP_200_OK)
         except Conversation.DoesNotExist:
             return Response({"error": "Conversation not found"}, status=status.HTTP_404_NOT_FOUND)
 
+class BulkMarkReadView(APIView):
+    """
+    Mark several conversations read, each up to an optional message id:
+    ``{"conversations": [{"id": 12, "up_to": 345}, {"id": 13}]}``.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        entries = request.data.get('conversations')
+        if not isinstance(entries, list) or not entries:
+            return Response({"error": "conversations must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(entries) > receipts.MAX_CONVERSATIONS:
+            return Response(
+                {"error": f"At most {receipts.MAX_CONVERSATIONS} conversations per request"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        points = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                return Response({"error": "Each entry must be an object with an id"}, status=status.HTTP_400_BAD_REQUEST)
+            conversation_id, up_to = entry.get('id'), entry.get('up_to')
+            if not isinstance(conversation_id, int) or not (up_to is None or isinstance(up_to, int)):
+                return Response({"error": "id and up_to must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+            points[conversation_id] = up_to
+
+        marked, read_receipts = receipts.mark_read(request.user, points)
+        _send_read_receipts(request.user, marked, read_receipts)
+        return Response({"status": "read", "conversations": sorted(marked)}, status=status.HTTP_200_OK)
+
 class ClearMessagesView(APIView):
+    """
+    Clear chat. By default only the caller's view is cleared by moving their
+    watermark; ``{"for_everyone": true}`` soft-deletes the messages for all
+    participants instead, and deletes the archived ones.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk):
@@ -361,28 +856,235 @@ class ClearMessagesView(APIView):
             # Check if participant
             if not conversation.participants.filter(id=request.user.id).exists():
                 return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
-            
-            # Soft delete all messages in this conversation
-            from django.utils import timezone
-            now = timezone.now()
-            Message.objects.filter(conversation=conversation).update(deleted_at=now)
-            
+
+            for_everyone = request.data.get('for_everyone') in (True, 'true')
+            if for_everyone:
+                # Soft delete all messages in this conversation
+                now = timezone.now()
+                storage_usage.subtract(Message.objects.filter(conversation=conversation))
+                Message.objects.filter(conversation=conversation).update(deleted_at=now, version=F('version') + 1)
+                archive.delete(conversation.id)
+                inbox.refresh_entries(conversation.id)
+                recipients = list(conversation.participants.values_list('id', flat=True))
+            else:
+                inbox.clear(request.user, conversation.id)
+                # Only the caller's other devices need to drop their copy
+                recipients = [request.user.id]
+
             # Broadcast to participants
-            channel_layer = get_channel_layer()
-            for participant in conversation.participants.all():
-                async_to_sync(channel_layer.group_send)(
-                    f"user_{participant.id}",
-                    {
-                        'type': 'clear_chat',
-                        'conversation_id': pk
-                    }
-                )
-            
-            return Response({"status": "cleared"}, status=status.HTTP_200_OK)
+            fanout.send_to_users(recipients, {
+                'type': 'clear_chat',
+                'conversation_id': pk
+            })
+
+            return Response({"status": "cleared", "for_everyone": for_everyone}, status=status.HTTP_200_OK)
         except Conversation.DoesNotExist:
             return Response({"error": "Conversation not found"}, status=status.HTTP_404_NOT_FOUND)
 
 
+class ConversationExportView(APIView):
+    """
+    Stream a conversation as NDJSON (default) or, with ``?archive=zip``, as a
+    zip that can also carry attachments (``&media=true``).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        conversation = request.user.conversations.filter(id=pk).first()
+        if conversation is None:
+            return Response({"error": "Conversation not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        archive_format = request.query_params.get('archive', 'ndjson')
+        include_media = request.query_params.get('media', 'false') == 'true'
+        stamp = timezone.now().strftime('%Y%m%d')
+
+        if archive_format == 'zip':
+            response = StreamingHttpResponse(
+                export.iter_zip(request.user, conversation, include_media=include_media),
+                content_type='application/zip',
+            )
+            filename = f"conversation-{pk}-{stamp}.zip"
+        elif archive_format == 'ndjson':
+            if include_media:
+                return Response({"error": "Media can only be exported with archive=zip"}, status=status.HTTP_400_BAD_REQUEST)
+            response = StreamingHttpResponse(
+                export.iter_ndjson(request.user, conversation),
+                content_type='application/x-ndjson; charset=utf-8',
+            )
+            filename = f"conversation-{pk}-{stamp}.ndjson"
+        else:
+            return Response({"error": "archive must be 'ndjson' or 'zip'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['Cache-Control'] = 'no-store'
+        # Let nginx pass chunks straight through instead of buffering the whole export
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class ImportJobListView(APIView):
+    """Start a restore; the backup itself is uploaded to ImportJobDetailView."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        job = ImportJob.objects.create(user=request.user)
+        return Response(ImportJobSerializer(job).data, status=status.HTTP_201_CREATED)
+
+
+class ImportJobDetailView(APIView):
+    """
+    GET reports progress. PUT streams an NDJSON export into the job; sending
+    the same file again after an interruption resumes where it stopped.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    stale_after = timedelta(minutes=5)
+
+    def get(self, request, pk):
+        job = ImportJob.objects.filter(id=pk, user=request.user).first()
+        if job is None:
+            return Response({"error": "Import not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(ImportJobSerializer(job).data)
+
+    def put(self, request, pk):
+        # Claim the job atomically; a running job whose worker died can be taken over
+        now = timezone.now()
+        claimed = ImportJob.objects.filter(id=pk, user=request.user).filter(
+            Q(status__in=['pending', 'failed']) | Q(status='running', updated_at__lt=now - self.stale_after)
+        ).update(status='running', updated_at=now, bytes_total=int(request.META.get('CONTENT_LENGTH') or 0) or None)
+        job = ImportJob.objects.filter(id=pk, user=request.user).first()
+        if job is None:
+            return Response({"error": "Import not found"}, status=status.HTTP_404_NOT_FOUND)
+        if not claimed:
+            return Response({"error": f"Import is {job.status}"}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            importer.run_import(job, request.stream or io.BytesIO())
+        except importer.InvalidBackup as e:
+            job.status = 'failed'
+            job.save(update_fields=['status', 'updated_at'])
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception:
+            job.status = 'failed'
+            job.save(update_fields=['status', 'updated_at'])
+            raise
+        return Response(ImportJobSerializer(job).data)
+
+
+class StorageUsageView(APIView):
+    """Media the caller has sent, in bytes and files, in total and by message type."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response(storage_usage.for_user(request.user.id))
+
+
+class ConversationStorageView(APIView):
+    """Media in one conversation, in bytes and files, in total and by message type."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        if not Conversation.objects.filter(id=pk, participants=request.user).exists():
+            return Response({"error": "Conversation not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(storage_usage.for_conversation(pk))
+
+
+class IgnoreAcceptNegotiation(BaseContentNegotiation):
+    """
+    Media responses are the file itself whatever ``Accept`` says; without
+    this DRF answers ``Accept: image/*`` with 406 before the view runs.
+    Errors still render as JSON.
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class MediaFileView(APIView):
+    """
+    Files under MEDIA_URL.
+
+    Chat media is only served to conversation participants, identified by
+    API authentication or a signed URL (see chat.media_access); other files
+    are public. With MEDIA_ACCEL_REDIRECT set the bytes are handed to the
+    front server (nginx X-Accel-Redirect, or X-Sendfile for Apache/lighttpd),
+    which also handles ranges. Otherwise single byte ranges are served here.
+    """
+    permission_classes = [permissions.AllowAny]
+    content_negotiation_class = IgnoreAcceptNegotiation
+
+    def get(self, request, name):
+        name = posixpath.normpath(name).lstrip('/')
+        if name.startswith('..'):
+            return Response({"error": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+        if media_access.is_protected(name):
+            user_id = request.user.id if request.user.is_authenticated else media_access.verify(name, request.query_params)
+            # 404 rather than 403, so names can't be probed
+            if not media_access.can_access(user_id, name):
+                return Response({"error": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            path = default_storage.path(name)
+            stat = os.stat(path)
+        except (NotImplementedError, OSError):
+            return Response({"error": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = media_access.etag(name, stat)
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        elif settings.MEDIA_ACCEL_REDIRECT == 'nginx':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + name
+        elif settings.MEDIA_ACCEL_REDIRECT == 'sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = path
+        else:
+            response = self.local_response(request, path, stat.st_size, content_type, etag)
+
+        response['ETag'] = etag
+        response['Cache-Control'] = media_access.cache_control(name)
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    def local_response(self, request, path, size, content_type, etag):
+        range_header = request.headers.get('Range')
+        if_range = request.headers.get('If-Range')
+        if if_range and if_range != etag:
+            range_header = None
+        try:
+            byte_range = media_access.parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        file = open(path, 'rb')
+        if byte_range is None:
+            return FileResponse(file, content_type=content_type)
+
+        start, end = byte_range
+        file.seek(start)
+
+        def read_range(remaining=end - start + 1):
+            try:
+                while remaining > 0:
+                    data = file.read(min(remaining, uploads.READ_SIZE))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+            finally:
+                file.close()
+
+        response = StreamingHttpResponse(read_range(), status=status.HTTP_206_PARTIAL_CONTENT, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+        return response
+
+
 def _infer_message_type(file_obj, file_type, text):
     if not file_obj:
         return 'text'
@@ -0,0 +1,215 @@
+"""
+Waveform peaks and duration for voice notes and other audio.
+
+Audio is decoded as a stream and reduced to the peak of every 10ms frame
+as it goes. Only those frame peaks are kept, and when there are more than
+``MAX_FRAMES`` neighbouring frames are merged, so memory stays flat however
+long the recording is. At the end the frames are grouped into ``BUCKETS``
+peaks, scaled to 0-255 relative to the loudest one.
+
+PCM WAV is read with the standard library. Everything else (the app
+records AAC in .m4a) is decoded by ffmpeg, which streams 8kHz mono PCM
+through a pipe. Without ffmpeg only WAV files get a waveform.
+
+Whether a file is audio at all is decided from its stored bytes (``detect``),
+not from the ``file_type`` the client sent. Containers that may hold video
+as well are checked with ffprobe.
+"""
+import array
+import json
+import shutil
+import subprocess
+import sys
+import threading
+import wave
+
+from django.core.files.storage import default_storage
+
+BUCKETS = 96
+SAMPLE_RATE = 8000
+FRAME_SECONDS = 0.01
+MAX_FRAMES = 4096
+READ_SIZE = 64 * 1024
+
+_SAMPLE_TYPES = {1: 'b', 2: 'h', 4: 'i'}
+# Leading bytes of audio-only formats
+_AUDIO_SIGNATURES = (b'ID3', b'OggS', b'fLaC', b'#!AMR', b'\xff\xf1', b'\xff\xf9', b'\xff\xfb', b'\xff\xf3')
+# ISO media brands that are audio only; other brands may be video (.mp4)
+_AUDIO_BRANDS = (b'M4A ', b'M4B ', b'M4P ')
+
+
+class _Peaks:
+    """Running per-frame peaks of a stream of samples."""
+
+    def __init__(self, rate, channels=1, full_scale=32768):
+        self.frame_samples = max(1, int(rate * FRAME_SECONDS)) * channels
+        self.full_scale = full_scale
+        self.frames = []
+        self.merge = 1  # frames of FRAME_SECONDS per stored peak
+        self.pending_peak = 0
+        self.pending_samples = 0
+        self.pending_frames = 0
+        self.samples = 0
+
+    def add(self, samples):
+        self.samples += len(samples)
+        offset = 0
+        while offset < len(samples):
+            take = min(self.frame_samples - self.pending_samples, len(samples) - offset)
+            chunk = samples[offset:offset + take]
+            self.pending_peak = max(self.pending_peak, max(chunk), -min(chunk))
+            self.pending_samples += take
+            offset += take
+            if self.pending_samples == self.frame_samples:
+                self._close_frame()
+
+    def _close_frame(self):
+        self.pending_frames += 1
+        if self.pending_frames == self.merge:
+            self.frames.append(min(self.pending_peak / self.full_scale, 1.0))
+            self.pending_peak = self.pending_frames = 0
+            if len(self.frames) >= MAX_FRAMES:
+                self.frames = [max(self.frames[i:i + 2]) for i in range(0, len(self.frames), 2)]
+                self.merge *= 2
+        self.pending_samples = 0
+
+    def finish(self):
+        if self.pending_samples or self.pending_frames:
+            self.frames.append(min(self.pending_peak / self.full_scale, 1.0))
+        return self.frames
+
+
+def buckets(frames, count=BUCKETS):
+    """Group frame peaks into ``count`` peaks scaled to 0-255."""
+    if not frames:
+        return []
+    grouped = [
+        max(frames[i * len(frames) // count:max((i + 1) * len(frames) // count, i * len(frames) // count + 1)])
+        for i in range(count)
+    ]
+    loudest = max(grouped)
+    if loudest <= 0:
+        return [0] * count
+    return [round(peak / loudest * 255) for peak in grouped]
+
+
+def _from_wav(file):
+    with wave.open(file, 'rb') as audio:
+        width, channels, rate = audio.getsampwidth(), audio.getnchannels(), audio.getframerate()
+        if width not in _SAMPLE_TYPES:
+            raise ValueError(f"Unsupported WAV sample width {width}")
+        peaks = _Peaks(rate, channels, full_scale=2 ** (8 * width - 1))
+        frames_per_read = max(1, READ_SIZE // (width * channels))
+        while True:
+            data = audio.readframes(frames_per_read)
+            if not data:
+                break
+            if width == 1:
+                # 8-bit WAV is unsigned
+                samples = array.array('b', bytes((byte - 128) & 0xFF for byte in data))
+            else:
+                samples = array.array(_SAMPLE_TYPES[width], data)
+                if sys.byteorder == 'big':
+                    samples.byteswap()
+            peaks.add(samples)
+        return peaks.finish(), peaks.samples / channels / rate
+
+
+def _from_ffmpeg(name):
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise ValueError("ffmpeg is not installed")
+    try:
+        source, stdin = default_storage.path(name), None
+    except NotImplementedError:
+        # Remote storage: stream the file in (formats that need seeking may fail)
+        source, stdin = 'pipe:0', subprocess.PIPE
+
+    command = [ffmpeg, '-v', 'error']
+    if stdin is None:
+        command.append('-nostdin')
+    command += ['-i', source, '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1']
+    process = subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    feeder = None
+    if stdin is not None:
+        def feed():
+            try:
+                with default_storage.open(name, 'rb') as file:
+                    for chunk in iter(lambda: file.read(READ_SIZE), b''):
+                        process.stdin.write(chunk)
+            except (BrokenPipeError, OSError):
+                pass
+            finally:
+                process.stdin.close()
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+    peaks = _Peaks(SAMPLE_RATE)
+    leftover = b''
+    try:
+        for chunk in iter(lambda: process.stdout.read(READ_SIZE), b''):
+            chunk = leftover + chunk
+            usable = len(chunk) - len(chunk) % 2
+            leftover = chunk[usable:]
+            samples = array.array('h', chunk[:usable])
+            if sys.byteorder == 'big':
+                samples.byteswap()
+            peaks.add(samples)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+        if feeder is not None:
+            feeder.join()
+    if returncode != 0:
+        raise ValueError(f"ffmpeg exited with {returncode}")
+    return peaks.finish(), peaks.samples / SAMPLE_RATE
+
+
+def _probe(name):
+    """Whether ffprobe finds audio and no video in ``name``; None when it can't tell."""
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe is None:
+        return None
+    try:
+        source = default_storage.path(name)
+    except NotImplementedError:
+        return None
+    try:
+        result = subprocess.run(
+            [ffprobe, '-v', 'error', '-show_entries', 'stream=codec_type', '-of', 'json', source],
+            capture_output=True, timeout=30, check=True,
+        )
+        kinds = {stream.get('codec_type') for stream in json.loads(result.stdout).get('streams', [])}
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+    return 'audio' in kinds and 'video' not in kinds
+
+
+def detect(name):
+    """'wav' or 'audio' if the stored file ``name`` is audio, else None."""
+    with default_storage.open(name, 'rb') as file:
+        head = file.read(12)
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head.startswith(_AUDIO_SIGNATURES):
+        return 'audio'
+    if head[4:8] == b'ftyp':
+        if head[8:12] in _AUDIO_BRANDS or _probe(name):
+            return 'audio'
+    return None
+
+
+def describe(name, kind=None):
+    """
+    ``duration`` (seconds) and ``waveform`` (peaks 0-255) for the stored
+    audio file ``name``; ``kind`` is what ``detect`` returned for it.
+    """
+    kind = kind or detect(name)
+    if kind == 'wav':
+        with default_storage.open(name, 'rb') as file:
+            frames, duration = _from_wav(file)
+    elif kind == 'audio':
+        frames, duration = _from_ffmpeg(name)
+    else:
+        raise ValueError(f"{name} is not audio")
+    return {'duration': round(duration, 2), 'waveform': buckets(frames)}
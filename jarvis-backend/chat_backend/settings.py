@@ -124,6 +124,9 @@ else:
         },
     }
 
+# Request fan-outs slower than this are logged as warnings (chat.fanout)
+FANOUT_SLOW_MS = int(os.environ.get('FANOUT_SLOW_MS', 250))
+
 # Caching Configuration
 if REDIS_CACHE_URL:
     CACHES = {
@@ -157,6 +160,36 @@ CELERY_TASK_ROUTES = {
     'chat.tasks.send_call_notification': {'queue': 'notifications'},
     'chat.tasks.process_message_media': {'queue': 'media'},
 }
+CELERY_BEAT_SCHEDULE = {
+    'expire-upload-sessions': {
+        'task': 'chat.tasks.expire_upload_sessions',
+        'schedule': 60 * 60,
+    },
+    'reconcile-media-references': {
+        'task': 'chat.tasks.reconcile_media_references',
+        'schedule': 24 * 60 * 60,
+    },
+    'reconcile-storage-usage': {
+        'task': 'chat.tasks.reconcile_storage_usage',
+        'schedule': 24 * 60 * 60,
+    },
+    'purge-expired-messages': {
+        'task': 'chat.tasks.purge_expired_messages',
+        'schedule': 60,
+    },
+    'archive-old-messages': {
+        'task': 'chat.tasks.archive_old_messages',
+        'schedule': 24 * 60 * 60,
+    },
+    'purge-deleted': {
+        'task': 'chat.tasks.purge_deleted',
+        'schedule': 24 * 60 * 60,
+    },
+    'resume-deletion-jobs': {
+        'task': 'accounts.tasks.resume_deletion_jobs',
+        'schedule': 10 * 60,
+    },
+}
 if REDIS_CELERY_BROKER_URL and REDIS_CELERY_RESULT_BACKEND:
     CELERY_BROKER_URL = REDIS_CELERY_BROKER_URL
     CELERY_RESULT_BACKEND = REDIS_CELERY_RESULT_BACKEND
@@ -164,6 +197,25 @@ else:
     CELERY_TASK_ALWAYS_EAGER = True
     CELERY_TASK_EAGER_PROPAGATES = True
 
+# With a batch media worker running (manage.py process_media), uploads are
+# left pending for it instead of getting one Celery task each
+MEDIA_BATCH_WORKER = os.environ.get('MEDIA_BATCH_WORKER', 'False') == 'True'
+MEDIA_WORKER_PROCESSES = int(os.environ.get('MEDIA_WORKER_PROCESSES', 0)) or None
+
+# Read messages older than this many days (whole months) move to the
+# partitioned archive table (chat.archive); 0 keeps everything live
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.environ.get('MESSAGE_ARCHIVE_AFTER_DAYS', 365))
+
+# Deleted messages and conversations can be restored for this many days
+# before chat.purge removes them and their files for good; the purge sleeps
+# this many seconds between batches
+PURGE_GRACE_DAYS = int(os.environ.get('PURGE_GRACE_DAYS', 30))
+PURGE_BATCH_PAUSE = float(os.environ.get('PURGE_BATCH_PAUSE', 0.5))
+
+# Account and call history deletions (accounts.deletion) sleep this many
+# seconds between batches
+DELETION_BATCH_PAUSE = float(os.environ.get('DELETION_BATCH_PAUSE', 0.1))
+
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -221,6 +273,12 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Let the front server send media bytes after the app has authorized the
+# request: 'nginx' (X-Accel-Redirect to MEDIA_ACCEL_PREFIX, an internal
+# location aliased to MEDIA_ROOT) or 'sendfile' (X-Sendfile). Empty serves
+# files from Django.
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT', '')
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
 
 
 # Jazzmin Settings
@@ -1,15 +1,13 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from chat.views import MediaFileView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('accounts.urls')),
     path('api/chat/', include('chat.urls')),
     path('api/calls/', include('calls.urls')),
+    # Chat media is access-checked, so it's served by the app in every environment
+    re_path(r'^media/(?P<name>.+)$', MediaFileView.as_view(), name='media-file'),
 ]
-
-from django.conf import settings
-from django.conf.urls.static import static
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import argparse
+import threading
+
+import django
+
+# Set up Django environment
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_backend.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIClient
+
+from chat.models import Conversation, Message
+
+User = get_user_model()
+
+
+def seed(total):
+    alice = User.objects.create_user(username='bench_alice', password='password')
+    bob = User.objects.create_user(username='bench_bob', password='password')
+    conversation = Conversation.objects.create()
+    conversation.participants.add(alice, bob)
+
+    for start in range(0, total, 10000):
+        Message.objects.bulk_create([
+            Message(conversation=conversation, sender=bob if i % 2 else alice, text=f"message {i} " + 'x' * 40, is_delivered=True)
+            for i in range(start, min(start + 10000, total))
+        ])
+    return alice, conversation
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class PeakRSS(threading.Thread):
+    """Sample resident memory while a download runs."""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.peak
+
+
+def download(client, url):
+    baseline = rss_bytes()
+    sampler = PeakRSS()
+    sampler.start()
+    start = time.perf_counter()
+    response = client.get(url)
+    size = sum(len(chunk) for chunk in response.streaming_content)
+    elapsed = time.perf_counter() - start
+    return elapsed, size, sampler.stop() - baseline
+
+
+def page_through(client, url):
+    """What the app does today: walk the history over the REST API."""
+    baseline = rss_bytes()
+    sampler = PeakRSS()
+    sampler.start()
+    start = time.perf_counter()
+    size = 0
+    while url:
+        response = client.get(url)
+        size += len(response.content)
+        url = response.data['next']
+    elapsed = time.perf_counter() - start
+    return elapsed, size, sampler.stop() - baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure streaming export download time and peak RSS.')
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--compare-paging', action='store_true', help='Also page the history over the list API')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        print(f"seeding {args.messages} messages...")
+        alice, conversation = seed(args.messages)
+        client = APIClient()
+        client.force_authenticate(user=alice)
+        base = f'/api/chat/conversations/{conversation.id}/export/'
+
+        runs = {
+            'ndjson': lambda: download(client, base),
+            'zip': lambda: download(client, base + '?archive=zip'),
+        }
+        if args.compare_paging:
+            runs['api paging'] = lambda: page_through(client, f'/api/chat/messages/{conversation.id}/?limit=100')
+
+        print(f"{'export':<12} {'seconds':>10} {'MB':>10} {'peak RSS +MB':>14}")
+        for name, run in runs.items():
+            elapsed, size, peak = run()
+            print(f"{name:<12} {elapsed:>10.2f} {size / 2**20:>10.1f} {peak / 2**20:>14.1f}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
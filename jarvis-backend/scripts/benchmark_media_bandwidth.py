@@ -0,0 +1,105 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from unittest.mock import patch
+
+import django
+
+# Set up Django environment
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_backend.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment
+from PIL import Image
+from rest_framework.test import APIClient
+
+from chat import derivatives
+from chat.models import Conversation, Message
+
+User = get_user_model()
+
+
+def photo(seed, width, height):
+    """A noisy photo-sized JPEG, so it compresses like a camera picture."""
+    image = Image.effect_noise((width, height), 40 + seed % 20).convert('RGB')
+    image = Image.blend(image, Image.linear_gradient('L').resize((width, height)).convert('RGB'), 0.5)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def seed(client, conversation, count, width, height):
+    for i in range(count):
+        response = client.post('/api/chat/messages/upload/', {
+            'conversation_id': conversation.id,
+            'file': SimpleUploadedFile(f'photo_{i}.jpg', photo(i, width, height), content_type='image/jpeg'),
+            'file_type': 'image/jpeg',
+        }, format='multipart')
+        assert response.status_code == 201, response.data
+
+
+def decode_time(data, draft, repeat=5):
+    """Milliseconds to build the derivatives of one photo, with or without draft decoding."""
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+        for _ in range(repeat):
+            with Image.open(io.BytesIO(data)) as image:
+                if not draft:
+                    image.load()
+                derivatives.generate(image, 'bench/photo')
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes a client downloads to open a chat full of photos.')
+    parser.add_argument('--photos', type=int, default=30)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--page', type=int, default=50, help='Messages loaded when the chat opens')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                patch('chat.views.async_to_sync'), patch('chat.views.get_channel_layer'):
+            alice = User.objects.create_user(username='bench_alice', password='password')
+            bob = User.objects.create_user(username='bench_bob', password='password')
+            conversation = Conversation.objects.create()
+            conversation.participants.add(alice, bob)
+            client = APIClient()
+            client.force_authenticate(user=alice)
+
+            print(f"uploading {args.photos} {args.width}x{args.height} photos...")
+            seed(client, conversation, args.photos, args.width, args.height)
+
+            response = client.get(f'/api/chat/messages/{conversation.id}/?limit={args.page}')
+            payload = len(json.dumps(response.data, default=str).encode())
+            page = Message.objects.filter(id__in=[m['id'] for m in response.data['results']])
+            originals = sum(m.file.size for m in page if m.file)
+            thumbs = sum(m.media_metadata['previews']['thumb']['size'] for m in page if m.media_metadata.get('previews'))
+
+        print(f"{'chat open':<22} {'KB':>10}")
+        print(f"{'message JSON':<22} {payload / 1024:>10.1f}")
+        print(f"{'originals':<22} {originals / 1024:>10.1f}")
+        print(f"{'thumbnails':<22} {thumbs / 1024:>10.1f}")
+        print(f"saved per chat open: {(originals - thumbs) / 1024:.1f} KB ({1 - thumbs / originals:.1%})")
+
+        data = photo(0, args.width, args.height)
+        print(f"derivatives per photo: {decode_time(data, draft=True):.0f} ms with draft decoding, "
+              f"{decode_time(data, draft=False):.0f} ms decoding the full image")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import django
+
+# Set up Django environment
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_backend.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment
+from PIL import Image
+
+from chat import media_processing
+from chat.models import Conversation, Message
+from chat.tasks import process_message_media
+
+User = get_user_model()
+
+
+def seed(count, width, height):
+    alice = User.objects.create_user(username='bench_alice', password='password')
+    bob = User.objects.create_user(username='bench_bob', password='password')
+    conversation = Conversation.objects.create()
+    conversation.participants.add(alice, bob)
+
+    messages = []
+    for i in range(count):
+        image = Image.effect_noise((width, height), 40 + i % 20).convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=90)
+        name = default_storage.save(f'chat_files/bench_{i}.jpg', ContentFile(buffer.getvalue()))
+        messages.append(Message(
+            conversation=conversation, sender=alice, message_type='image', file=name,
+            file_type='image/jpeg', media_processing_state='pending', is_delivered=True,
+        ))
+    return [message.id for message in Message.objects.bulk_create(messages)]
+
+
+def reset(ids):
+    Message.objects.filter(id__in=ids).update(media_processing_state='pending', media_metadata={})
+
+
+def per_message(ids):
+    start = time.perf_counter()
+    for message_id in ids:
+        process_message_media(message_id)
+    return time.perf_counter() - start
+
+
+def batched(ids, batch_size, workers):
+    start = time.perf_counter()
+    media_processing.run(batch_size=batch_size, workers=workers, once=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-message media tasks with the batch worker.')
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--width', type=int, default=3000)
+    parser.add_argument('--height', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=media_processing.BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            print(f"seeding {args.images} {args.width}x{args.height} images...")
+            ids = seed(args.images, args.width, args.height)
+
+            runs = {
+                'per-message task': lambda: per_message(ids),
+                f'batch x{args.workers} procs': lambda: batched(ids, args.batch_size, args.workers),
+            }
+            print(f"{'mode':<20} {'seconds':>10} {'images/s':>10}")
+            for name, run in runs.items():
+                reset(ids)
+                elapsed = run()
+                print(f"{name:<20} {elapsed:>10.2f} {len(ids) / elapsed:>10.1f}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+
+import django
+
+# Set up Django environment
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_backend.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chat.models import Conversation, Message
+from chat.pagination import MessageCursorPagination
+
+User = get_user_model()
+
+
+def seed(total, same_timestamp_run):
+    alice = User.objects.create_user(username='bench_alice', password='password')
+    bob = User.objects.create_user(username='bench_bob', password='password')
+    conversation = Conversation.objects.create()
+    conversation.participants.add(alice, bob)
+
+    base = timezone.now()
+    batch = []
+    for i in range(total):
+        batch.append(Message(conversation=conversation, sender=bob, text=f"message {i}", is_delivered=True))
+        if len(batch) == 5000:
+            Message.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Message.objects.bulk_create(batch)
+
+    # Collapse runs of rows onto one timestamp so ties are common
+    ids = list(Message.objects.filter(conversation=conversation).order_by('id').values_list('id', flat=True))
+    for start in range(0, len(ids), same_timestamp_run):
+        Message.objects.filter(id__in=ids[start:start + same_timestamp_run]).update(
+            timestamp=base - timezone.timedelta(seconds=len(ids) - start)
+        )
+    return alice, conversation
+
+
+def timed(client, url, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.status_code
+    return statistics.median(samples)
+
+
+def cursor_at(conversation, depth):
+    boundary = Message.objects.filter(conversation=conversation).order_by('-timestamp', '-id')[depth]
+    paginator = MessageCursorPagination()
+    paginator.base_url = f'/api/chat/messages/{conversation.id}/'
+    return paginator.encode_cursor(boundary, reverse=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare offset and keyset paging of message history.')
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--tie-run', type=int, default=4, help='Messages sharing each timestamp')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        alice, conversation = seed(args.messages, args.tie_run)
+        client = APIClient()
+        client.force_authenticate(user=alice)
+        base = f'/api/chat/messages/{conversation.id}/'
+
+        print(f"{'depth':>10} {'offset ms':>12} {'cursor ms':>12}")
+        for fraction in (0, 0.1, 0.5, 0.9, 0.99):
+            depth = int((args.messages - args.page_size) * fraction)
+            offset_ms = timed(client, f'{base}?limit={args.page_size}&offset={depth}', args.repeat)
+            if depth:
+                cursor_url = cursor_at(conversation, depth - 1) + f'&limit={args.page_size}'
+            else:
+                cursor_url = f'{base}?limit={args.page_size}'
+            cursor_ms = timed(client, cursor_url, args.repeat)
+            print(f"{depth:>10} {offset_ms:>12.2f} {cursor_ms:>12.2f}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import json
+import argparse
+import statistics
+
+import django
+
+# Set up Django environment
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_backend.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIClient
+
+from chat import inbox
+from chat.models import Conversation, Message
+
+User = get_user_model()
+
+
+def seed(conversations, messages_per_conversation):
+    me = User.objects.create_user(username='bench_me', password='password')
+    first = None
+    for i in range(conversations):
+        other = User.objects.create_user(username=f'bench_friend_{i}', password='password', bio='x' * 120)
+        conversation = Conversation.objects.create()
+        conversation.participants.add(me, other)
+        Message.objects.bulk_create([
+            Message(conversation=conversation, sender=other if j % 2 else me, text=f"message {j}", is_delivered=True)
+            for j in range(messages_per_conversation)
+        ])
+        inbox.refresh_entries(conversation.id)
+        first = first or conversation
+    return me, first
+
+
+def measure(client, url, repeat):
+    samples = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        body = json.dumps(response.data, default=str).encode()
+        samples.append((time.perf_counter() - start) * 1000)
+        size = len(body)
+    return statistics.median(samples), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare default and compact (side-loaded) list payloads.')
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=50, help='Messages per conversation')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        me, conversation = seed(args.conversations, args.messages)
+        client = APIClient()
+        client.force_authenticate(user=me)
+
+        endpoints = {
+            'message page': f'/api/chat/messages/{conversation.id}/?limit={args.messages}',
+            'conversation list': '/api/chat/conversations/?',
+        }
+        print(f"{'endpoint':<20} {'shape':<10} {'bytes':>10} {'ms':>10}")
+        for name, url in endpoints.items():
+            for shape, suffix in (('default', ''), ('compact', '&compact=true')):
+                ms, size = measure(client, url + suffix, args.repeat)
+                print(f"{name:<20} {shape:<10} {size:>10} {ms:>10.2f}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
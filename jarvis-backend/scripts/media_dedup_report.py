@@ -0,0 +1,34 @@
+import os
+import sys
+import argparse
+
+import django
+
+# Set up Django environment
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_backend.settings')
+django.setup()
+
+from chat import media_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report how much media storage content-addressing saves.')
+    parser.add_argument('--reconcile', action='store_true', help='Recount blob references from messages first')
+    args = parser.parse_args()
+
+    if args.reconcile:
+        print(f"reference counts fixed: {media_store.reconcile()}")
+
+    stats = media_store.dedup_stats()
+    print(f"blobs:             {stats['blobs']}")
+    print(f"references:        {stats['references']}")
+    print(f"stored:            {stats['stored_bytes'] / 2**20:.1f} MB")
+    print(f"referenced:        {stats['referenced_bytes'] / 2**20:.1f} MB")
+    print(f"saved:             {stats['saved_bytes'] / 2**20:.1f} MB")
+    print(f"dedup ratio:       {stats['ratio']:.2f}x")
+    print(f"pre-dedup files:   {stats['legacy_files']}")
+
+
+if __name__ == '__main__':
+    main()
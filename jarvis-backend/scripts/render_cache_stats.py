@@ -0,0 +1,32 @@
+import os
+import sys
+import argparse
+
+import django
+
+# Set up Django environment
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_backend.settings')
+django.setup()
+
+from chat import render_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report message render cache hit rate and serializer time saved.')
+    parser.add_argument('--reset', action='store_true', help='Reset the counters after printing')
+    args = parser.parse_args()
+
+    stats = render_cache.stats()
+    print(f"hits:                 {stats['hits']}")
+    print(f"misses:               {stats['misses']}")
+    print(f"hit rate:             {stats['hit_rate']:.1%}")
+    print(f"avg render (miss):    {stats['avg_render_us']:.0f} us")
+    print(f"serializer time saved: {stats['serializer_seconds_saved']:.2f} s")
+
+    if args.reset:
+        render_cache.reset_stats()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from django.db.models import Count
 from chat.models import Conversation
+from chat.inbox import ensure_entries
 
 def get_or_create_1on1_conversation(user1, user2):
     """
@@ -11,6 +12,7 @@ def get_or_create_1on1_conversation(user1, user2):
         if not conversation:
             conversation = Conversation.objects.create()
             conversation.participants.add(user1)
+            ensure_entries(conversation)
         return conversation, False
     else:
         # 1-on-1 chat
@@ -19,5 +21,6 @@ def get_or_create_1on1_conversation(user1, user2):
         if not conversation:
             conversation = Conversation.objects.create()
             conversation.participants.add(user1, user2)
+            ensure_entries(conversation)
             return conversation, True
         return conversation, False
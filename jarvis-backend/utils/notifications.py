@@ -38,6 +38,71 @@ def _initialize():
         except Exception as e:
             logger.error(f"Firebase Init Failed: {e}")
 
+def _build_message(user, title, body, data=None, priority='high'):
+    """The FCM message for ``user``, with the data fields the app expects."""
+    # Standardize data fields for the app to consume
+    payload_data = data or {}
+    is_incoming_call = payload_data.get('type') == 'incoming_call'
+
+    if is_incoming_call:
+        # Canonical frontend contract for call notifications.
+        payload_data['callUUID'] = (
+            payload_data.get('callUUID')
+            or payload_data.get('call_uuid')
+            or payload_data.get('uuid')
+            or str(uuid.uuid4())
+        )
+        payload_data['chatId'] = str(payload_data.get('chatId') or payload_data.get('chat_id') or payload_data.get('conversation_id') or '')
+        payload_data['callerName'] = payload_data.get('callerName') or payload_data.get('caller_name') or title
+        payload_data['callerAvatar'] = payload_data.get('callerAvatar') or payload_data.get('caller_avatar') or ''
+        payload_data['isVideo'] = payload_data.get('isVideo') if payload_data.get('isVideo') is not None else payload_data.get('is_video')
+        payload_data['offerType'] = payload_data.get('offerType') or payload_data.get('offer_type') or 'offer'
+        payload_data['offerSdp'] = payload_data.get('offerSdp') or payload_data.get('offer_sdp') or ''
+    else:
+        # Ensure fallback for title/body in data payload
+        if 'sender_name' not in payload_data:
+            payload_data['sender_name'] = title
+        if 'text' not in payload_data:
+            payload_data['text'] = body
+
+    # Config kwargs
+    android_config = {
+        'priority': 'high', # 'high' is required for background wake-up
+        'ttl': 0 if payload_data.get('type') == 'incoming_call' else 3600 # 0 for calls (now or never)
+    }
+    
+    # Apple APNS Config (VoIP)
+    apns_config = messaging.APNSConfig(
+        headers={
+            "apns-push-type": "background" if payload_data.get('type') == 'incoming_call' else "alert",
+            "apns-priority": "10" if priority == 'high' else "5", 
+        },
+        payload=messaging.APNSPayload(
+            aps=messaging.Aps(
+                content_available=True, # Critical for background processing
+                sound='default'
+            )
+        )
+    )
+
+    notification = None
+    # Only attach visible notification if it's NOT a call and NOT a chat message
+    # We rely on data-only payloads for messages to allow the frontend Notifee 
+    # to build a custom rich Messaging UI locally.
+    if payload_data.get('type') not in ['incoming_call', 'chat_message', 'message']:
+        notification = messaging.Notification(
+            title=title,
+            body=body,
+        )
+
+    return messaging.Message(
+        notification=notification,
+        data=payload_data,
+        token=user.fcm_token,
+        android=messaging.AndroidConfig(**android_config),
+        apns=apns_config
+    )
+
 def send_fcm_notification(user, title, body, data=None, ttl=None, priority='high'):
     """
     Send an FCM notification to a specific user.
@@ -53,71 +118,42 @@ def send_fcm_notification(user, title, body, data=None, ttl=None, priority='high
          return False
 
     try:
-        # Standardize data fields for the app to consume
-        payload_data = data or {}
-        is_incoming_call = payload_data.get('type') == 'incoming_call'
-
-        if is_incoming_call:
-            # Canonical frontend contract for call notifications.
-            payload_data['callUUID'] = (
-                payload_data.get('callUUID')
-                or payload_data.get('call_uuid')
-                or payload_data.get('uuid')
-                or str(uuid.uuid4())
-            )
-            payload_data['chatId'] = str(payload_data.get('chatId') or payload_data.get('chat_id') or payload_data.get('conversation_id') or '')
-            payload_data['callerName'] = payload_data.get('callerName') or payload_data.get('caller_name') or title
-            payload_data['callerAvatar'] = payload_data.get('callerAvatar') or payload_data.get('caller_avatar') or ''
-            payload_data['isVideo'] = payload_data.get('isVideo') if payload_data.get('isVideo') is not None else payload_data.get('is_video')
-            payload_data['offerType'] = payload_data.get('offerType') or payload_data.get('offer_type') or 'offer'
-            payload_data['offerSdp'] = payload_data.get('offerSdp') or payload_data.get('offer_sdp') or ''
-        else:
-            # Ensure fallback for title/body in data payload
-            if 'sender_name' not in payload_data:
-                payload_data['sender_name'] = title
-            if 'text' not in payload_data:
-                payload_data['text'] = body
-
-        # Config kwargs
-        android_config = {
-            'priority': 'high', # 'high' is required for background wake-up
-            'ttl': 0 if payload_data.get('type') == 'incoming_call' else 3600 # 0 for calls (now or never)
-        }
-        
-        # Apple APNS Config (VoIP)
-        apns_config = messaging.APNSConfig(
-            headers={
-                "apns-push-type": "background" if payload_data.get('type') == 'incoming_call' else "alert",
-                "apns-priority": "10" if priority == 'high' else "5", 
-            },
-            payload=messaging.APNSPayload(
-                aps=messaging.Aps(
-                    content_available=True, # Critical for background processing
-                    sound='default'
-                )
-            )
-        )
-
-        notification = None
-        # Only attach visible notification if it's NOT a call and NOT a chat message
-        # We rely on data-only payloads for messages to allow the frontend Notifee 
-        # to build a custom rich Messaging UI locally.
-        if payload_data.get('type') not in ['incoming_call', 'chat_message', 'message']:
-            notification = messaging.Notification(
-                title=title,
-                body=body,
-            )
-
-        message = messaging.Message(
-            notification=notification,
-            data=payload_data,
-            token=user.fcm_token,
-            android=messaging.AndroidConfig(**android_config),
-            apns=apns_config
-        )
+        message = _build_message(user, title, body, data, priority)
         response = messaging.send(message)
         logger.info(f"Successfully sent FCM message to {user.username}: {response}")
         return True
     except Exception as e:
         logger.error(f"Error sending FCM notification to {user.username}: {e}")
         return False
+
+# FCM accepts at most this many messages per batch request
+FCM_BATCH_SIZE = 500
+
+def send_fcm_notifications(notifications):
+    """
+    Send many notifications with batched FCM requests.
+    :param notifications: (user, title, body, data) tuples.
+    :return: How many were delivered to FCM.
+    """
+    _initialize()
+
+    messages = []
+    for user, title, body, data in notifications:
+        if not user.fcm_token or not user.notifications_enabled:
+            continue
+        try:
+            messages.append(_build_message(user, title, body, data))
+        except Exception as e:
+            logger.error(f"Error building FCM notification for {user.username}: {e}")
+
+    sent = 0
+    for start in range(0, len(messages), FCM_BATCH_SIZE):
+        batch = messages[start:start + FCM_BATCH_SIZE]
+        try:
+            response = messaging.send_each(batch)
+            sent += response.success_count
+            if response.failure_count:
+                logger.warning(f"{response.failure_count} of {len(batch)} FCM messages failed")
+        except Exception as e:
+            logger.error(f"Error sending FCM batch: {e}")
+    return sent